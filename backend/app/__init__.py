@@ -0,0 +1,9 @@
+import time
+
+# Startup is timed from the first import of the app (see startup.py)
+STARTED = time.perf_counter()
+
+from dotenv import load_dotenv  # noqa: E402
+
+# Loaded once, before any of the modules read their settings from the environment
+load_dotenv()
@@ -0,0 +1,114 @@
+from sqlalchemy import case, func, literal
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .columnar import bet_columns
+
+# Bets with an outcome (a resolution date, "incomplete" or "expired") are settled
+# and no longer count towards what is outstanding on the leaderboard
+is_open = models.Bet.status == models.BetStatus.open
+
+
+def _with_archived(db: Session, user_id: int, outward, inward):
+    # Archived bets count too, through their per-pair totals
+    archived_outward, archived_inward = crud.get_archived_totals(db, user_id)
+    for totals, archived in ((outward, archived_outward), (inward, archived_inward)):
+        for counterparty_id, shots in archived.items():
+            totals[counterparty_id] = totals.get(counterparty_id, 0) + shots
+    return {
+        "total_user_shots_outward": sum(outward.values()),
+        "total_user_shots_inward": sum(inward.values()),
+        "outward": outward,
+        "inward": inward,
+    }
+
+
+def user_shot_balances(db: Session, user_id: int):
+    """
+    Per-counterparty and total shots for a user, summed in the database.
+    Every bet counts here, whatever its outcome, archived ones included.
+    """
+    # Shots this user owes to others
+    shots_i_owe = dict(
+        db.query(models.Bet.bettee_id, func.sum(models.Bet.shots))
+        .filter(models.Bet.bettor_id == user_id)
+        .group_by(models.Bet.bettee_id)
+        .all()
+    )
+
+    # Shots others owe this user
+    shots_others_owe_me = dict(
+        db.query(models.Bet.bettor_id, func.sum(models.Bet.shots))
+        .filter(models.Bet.bettee_id == user_id)
+        .group_by(models.Bet.bettor_id)
+        .all()
+    )
+
+    return _with_archived(db, user_id, shots_i_owe, shots_others_owe_me)
+
+
+def leaderboard(db: Session):
+    """
+    Outstanding shots owed by and to every user that is part of a bet, in the
+    same shape as the /data/graph leaderboard. Only open bets are summed.
+    """
+    open_shots = case((is_open, models.Bet.shots), else_=0)
+    owed_by = db.query(
+        models.Bet.bettor_id.label("user_id"),
+        open_shots.label("owed"),
+        literal(0).label("owed_to"),
+    )
+    owed_to = db.query(
+        models.Bet.bettee_id.label("user_id"),
+        literal(0).label("owed"),
+        open_shots.label("owed_to"),
+    )
+    totals = owed_by.union_all(owed_to).subquery()
+
+    rows = (
+        db.query(
+            models.User.id,
+            models.User.name,
+            func.sum(totals.c.owed).label("owed"),
+            func.sum(totals.c.owed_to).label("owed_to"),
+        )
+        .join(totals, totals.c.user_id == models.User.id)
+        .group_by(models.User.id, models.User.name)
+        .order_by(func.sum(totals.c.owed_to).desc(), models.User.id)
+        .all()
+    )
+
+    return [
+        {
+            "id": user_id,
+            "name": name,
+            "totalShotsOwed": owed,
+            "totalShotsOwedTo": owed_to,
+        }
+        for user_id, name, owed, owed_to in rows
+    ]
+
+
+# The same results, computed from the in-memory columnar snapshot of the bets table
+# rather than by the database. The async routes keep using the queries above.
+
+
+def user_shot_balances_from_columns(db: Session, user_id: int):
+    outward, inward = bet_columns.counterparty_totals(db, user_id)
+    return _with_archived(db, user_id, outward, inward)
+
+
+def leaderboard_from_columns(db: Session):
+    owed, owed_to = bet_columns.leaderboard_totals(db)
+    users = crud.get_users_by_ids(db, list(owed))
+    # Like the SQL version, only users that are still there
+    return [
+        {
+            "id": user_id,
+            "name": users[user_id].name,
+            "totalShotsOwed": owed[user_id],
+            "totalShotsOwedTo": owed_to[user_id],
+        }
+        for user_id in sorted(owed, key=lambda user_id: (-owed_to[user_id], user_id))
+        if user_id in users
+    ]
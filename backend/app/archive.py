@@ -0,0 +1,198 @@
+"""
+Hot/cold tiering of the bets table.
+
+Bets settled (resolved, expired or incomplete) more than ARCHIVE_AFTER_DAYS ago
+are moved from `bets` to `archived_bets` in batches of ARCHIVE_BATCH_SIZE, one
+short transaction each. Open bets are never archived. `bets` and its indexes
+then only hold the live working set, which is what the analytics queries and
+the in-memory state (graph, columnar snapshot, settlements) are built from.
+
+What archived bets still count for:
+- lifetime totals (shot balances, related users) add `archived_bet_totals`, a
+  per-pair rollup written in the same transaction as each batch
+- /data/stats folds them into its buckets when it is built
+- history reads (bet listings, per-user bets, the event log) union the archive
+  with `include_archived=true`, and /bets/{id} finds archived bets either way
+The leaderboard and settlements only count open bets, so they are unchanged.
+Archived bets are read-only, and drop out of /data/graph and /bets/search.
+
+Run it with `python -m app.archive`, or have the workers run it every
+ARCHIVE_INTERVAL_MINUTES. Batches are claimed with DELETE ... RETURNING, so
+concurrent runs never archive a bet twice. Bet ids come from a sequence that
+never reuses them (AUTOINCREMENT on SQLite, see migrations.py), so a new bet
+can't take an archived bet's id.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from datetime import timedelta
+
+from sqlalchemy import and_, delete, func, insert, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .columnar import CHUNK_SIZE, bet_row
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 180))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))
+# 0 leaves archiving to `python -m app.archive`
+ARCHIVE_INTERVAL_MINUTES = float(os.getenv("ARCHIVE_INTERVAL_MINUTES", 0))
+
+logger = logging.getLogger("app.archive")
+
+bets = models.Bet.__table__
+archived_bets = models.ArchivedBet.__table__
+
+ADD_TOTALS = text("""
+    INSERT INTO archived_bet_totals (bettor_id, bettee_id, bets, shots)
+    VALUES (:bettor_id, :bettee_id, :bets, :shots)
+    ON CONFLICT (bettor_id, bettee_id) DO UPDATE SET
+        bets = archived_bet_totals.bets + excluded.bets,
+        shots = archived_bet_totals.shots + excluded.shots
+    """)
+
+
+def _archivable(cutoff):
+    # Settled before the cutoff; bets closed without a resolution date by age
+    return and_(
+        bets.c.status != models.BetStatus.open,
+        func.coalesce(bets.c.resolved_at, bets.c.created_at) < cutoff,
+    )
+
+
+def _candidates(engine: Engine, cutoff, after, batch_size: int):
+    # Walks the created_at index: a bet can't have been settled before it was made
+    query = select(bets.c.created_at, bets.c.id).where(
+        bets.c.created_at < cutoff,
+        _archivable(cutoff),
+    )
+    if after is not None:
+        query = query.where(crud._after(crud.BET_ORDER, after))
+    with engine.connect() as conn:
+        return conn.execute(query.order_by(*crud.BET_ORDER).limit(batch_size)).all()
+
+
+def _move(engine: Engine, bet_ids, cutoff):
+    with engine.begin() as conn:
+        # Checked again, in case a bet was reopened since it was picked
+        rows = conn.execute(
+            delete(bets)
+            .where(bets.c.id.in_(bet_ids), _archivable(cutoff))
+            .returning(*bets.c)
+        ).all()
+        if not rows:
+            return rows
+        now = models.utcnow()
+        conn.execute(
+            insert(archived_bets), [dict(row._mapping, archived_at=now) for row in rows]
+        )
+
+        totals = {}
+        for row in rows:
+            if row.bettor_id is None or row.bettee_id is None:
+                continue
+            pair = totals.setdefault((row.bettor_id, row.bettee_id), [0, 0])
+            pair[0] += 1
+            pair[1] += row.shots or 0
+        if totals:
+            conn.execute(
+                ADD_TOTALS,
+                [
+                    {
+                        "bettor_id": bettor_id,
+                        "bettee_id": bettee_id,
+                        "bets": count,
+                        "shots": shots,
+                    }
+                    for (bettor_id, bettee_id), (count, shots) in totals.items()
+                ],
+            )
+    return rows
+
+
+def archive_bets(
+    engine: Engine,
+    older_than_days: float = ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    on_batch=None,
+):
+    """
+    Move every bet settled more than `older_than_days` ago to the archive, one
+    transaction per batch. `on_batch(rows)` gets the rows of each batch once it
+    is committed. Returns the number of bets archived.
+    """
+    cutoff = models.utcnow() - timedelta(days=older_than_days)
+    archived = 0
+    after = None
+    while True:
+        candidates = _candidates(engine, cutoff, after, batch_size)
+        if not candidates:
+            break
+        after = tuple(candidates[-1])
+        rows = _move(engine, [bet_id for _, bet_id in candidates], cutoff)
+        archived += len(rows)
+        if rows and on_batch is not None:
+            on_batch(rows)
+    if archived:
+        logger.info("Archived %d bets settled before %s", archived, cutoff.isoformat())
+    return archived
+
+
+async def archive_periodically(engine: Engine, on_batch):
+    # Runs for as long as the worker does; a failed run is retried next time
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_MINUTES * 60)
+        try:
+            await asyncio.to_thread(archive_bets, engine, on_batch=on_batch)
+        except Exception:
+            logger.exception("Archiving bets failed")
+
+
+def archived_rows(db: Session):
+    """
+    `(bet id, bet_row)` of every archived bet, streamed from the database.
+    """
+    rows = db.execute(
+        select(
+            archived_bets.c.id,
+            archived_bets.c.bettor_id,
+            archived_bets.c.bettee_id,
+            archived_bets.c.shots,
+            archived_bets.c.status,
+            archived_bets.c.created_at,
+            archived_bets.c.resolved_at,
+        ).execution_options(yield_per=CHUNK_SIZE)
+    )
+    for row in rows:
+        yield row.id, bet_row(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move long-settled bets to the archive."
+    )
+    parser.add_argument("--older-than-days", type=float, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from . import changes
+    from .database import get_engine
+    from .shared_state import shared_state
+
+    if not shared_state.enabled:
+        logger.warning(
+            "SHARED_STATE is not set: running workers keep the archived bets in "
+            "memory until they restart"
+        )
+    count = archive_bets(
+        get_engine(), args.older_than_days, args.batch_size, changes.bets_archived
+    )
+    logger.info("Archived %d bets", count)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,34 @@
+"""
+Async versions of the read functions in crud.py and aggregates.py.
+
+Each one runs the sync implementation through `AsyncSession.run_sync`, which
+drives it on the async driver's connection. The queries stay defined in one
+place, and awaiting them never blocks the event loop or a thread.
+"""
+
+import functools
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import aggregates, crud
+
+
+def _run_async(fn):
+    @functools.wraps(fn)
+    async def wrapper(db: AsyncSession, *args, **kwargs):
+        return await db.run_sync(fn, *args, **kwargs)
+
+    return wrapper
+
+
+get_user = _run_async(crud.get_user)
+get_user_by_email = _run_async(crud.get_user_by_email)
+get_users = _run_async(crud.get_users)
+get_users_by_ids = _run_async(crud.get_users_by_ids)
+get_related_users = _run_async(crud.get_related_users)
+get_bet = _run_async(crud.get_bet)
+get_bet_with_names = _run_async(crud.get_bet_with_names)
+get_bets = _run_async(crud.get_bets)
+search_bets = _run_async(crud.search_bets)
+user_shot_balances = _run_async(aggregates.user_shot_balances)
+leaderboard = _run_async(aggregates.leaderboard)
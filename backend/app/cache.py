@@ -0,0 +1,237 @@
+"""
+Response cache for the read routes.
+
+Entries hold the JSON-ready form of a route's result and carry tags such as
+`user:3` or `bet:12`. The mutation hooks in changes.py invalidate the tags a
+change touches, so entries only live until their data changes (or `CACHE_TTL`
+passes, as a safety net).
+
+CACHE_BACKEND picks the store: `memory` (per-process LRU, the default),
+`redis` (shared by every worker, needs the `redis` package and REDIS_URL), or
+`none` to turn caching off.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.encoders import jsonable_encoder
+
+from .limits import flights
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_TTL = int(os.getenv("CACHE_TTL", 300))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class CacheStats:
+    # Hits and misses per namespace (the part of the key before the first ":")
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self.invalidations = 0
+
+    def record(self, key: str, hit: bool):
+        namespace = key.split(":", 1)[0]
+        with self._lock:
+            counts = self._counts.setdefault(namespace, {"hits": 0, "misses": 0})
+            counts["hits" if hit else "misses"] += 1
+
+    def record_invalidation(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self):
+        with self._lock:
+            namespaces = {name: dict(counts) for name, counts in self._counts.items()}
+        hits = sum(counts["hits"] for counts in namespaces.values())
+        misses = sum(counts["misses"] for counts in namespaces.values())
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+            "invalidations": self.invalidations,
+            "namespaces": namespaces,
+        }
+
+
+class MemoryCache:
+    """
+    LRU of up to `max_entries` entries, each expiring `ttl` seconds after it was set.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: int = CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> set of keys
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, tags):
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCache:
+    """
+    Same interface as MemoryCache, stored in Redis so every worker shares it.
+    Each tag is a Redis set of the keys carrying it.
+    """
+
+    prefix = "cys:"
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = CACHE_TTL):
+        import redis
+
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value, tags):
+        pipe = self._redis.pipeline()
+        pipe.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        for tag in tags:
+            pipe.sadd(self.prefix + "tag:" + tag, self.prefix + key)
+            pipe.expire(self.prefix + "tag:" + tag, self.ttl)
+        pipe.execute()
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            tag_key = self.prefix + "tag:" + tag
+            keys = self._redis.smembers(tag_key)
+            self._redis.delete(tag_key, *keys)
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(self.prefix + "*"))
+        if keys:
+            self._redis.delete(*keys)
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value, tags):
+        pass
+
+    def invalidate(self, *tags):
+        pass
+
+    def clear(self):
+        pass
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = CacheStats()
+        # Bumped by every invalidation. A value computed while one happened may
+        # already be stale, so it is returned but not stored.
+        self._generation = 0
+
+    def get_or_set(self, key: str, tags, compute, stale_for: float = 0, budget=None):
+        """
+        Return the cached value for `key`, or compute, store and return it.
+        Exceptions (e.g. a 404) propagate and nothing is cached. Concurrent
+        misses for the same key share one computation; `stale_for` and `budget`
+        are passed on to Coalescer.run (see limits.py).
+        """
+        value = self.backend.get(key)
+        self.stats.record(key, hit=value is not None)
+        if value is not None:
+            return value
+        generation = self._generation
+
+        def fill():
+            value = jsonable_encoder(compute())
+            if generation == self._generation:
+                self.backend.set(key, value, list(tags))
+            return value
+
+        return flights.run(key, generation, fill, stale_for, budget)
+
+    async def get_or_set_async(self, key: str, tags, compute):
+        # Same as get_or_set, for an async `compute`
+        value = self.backend.get(key)
+        self.stats.record(key, hit=value is not None)
+        if value is not None:
+            return value
+        generation = self._generation
+
+        async def fill():
+            value = jsonable_encoder(await compute())
+            if generation == self._generation:
+                self.backend.set(key, value, list(tags))
+            return value
+
+        return await flights.run_async(key, generation, fill)
+
+    def invalidate(self, *tags):
+        self._generation += 1
+        self.stats.record_invalidation()
+        self.backend.invalidate(*tags)
+
+    def clear(self):
+        self._generation += 1
+        self.stats.record_invalidation()
+        self.backend.clear()
+
+
+def _backend():
+    if CACHE_BACKEND == "redis":
+        return RedisCache()
+    if CACHE_BACKEND == "none":
+        return NullCache()
+    return MemoryCache()
+
+
+response_cache = ResponseCache(_backend())
+
+
+def bet_tags(bet_id: int, bettor_id: int, bettee_id: int):
+    # Everything cached about a bet, or about either user taking part in it
+    return [f"bet:{bet_id}", f"user:{bettor_id}", f"user:{bettee_id}", "events"]
@@ -0,0 +1,128 @@
+"""
+Append-only log of the users and bets that changed, behind GET /sync.
+
+The mutations in routers/bets.py and routers/users.py (and the crud helpers
+they go through) `record` a row per user or bet they save or delete, in the
+same transaction as the change itself, so the log never disagrees with the
+tables. Rows carry a sequence number that only goes up; the data itself isn't
+copied. /sync reads the current version of what changed instead, so a page
+holds at most one upsert or tombstone per user or bet, however often it
+changed in between.
+
+- Deleting a user also tombstones the bets they were on, which leave the API
+  with them.
+- Archiving a bet (see archive.py) isn't logged: it can still be read as it was.
+- On Postgres, writers take a transaction-level advisory lock before they
+  append, so sequence numbers commit in order and a client asking for what
+  came after the last one it saw can't skip one that committed late.
+
+`backfill` (run by migrations.upgrade) starts an empty log with an upsert for
+every user and bet already there.
+"""
+
+import os
+
+from sqlalchemy import and_, func, insert, literal, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import models
+
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", 1000))
+
+USER = "user"
+BET = "bet"
+
+# Key of the Postgres advisory lock that orders writers to the log
+LOCK_KEY = 0x63797301
+
+change_log = models.ChangeLogEntry.__table__
+
+
+def record(db: Session, entity: str, ids, deleted: bool = False):
+    """
+    Log that the `entity` rows with `ids` were saved (or deleted). Goes out
+    with the session's next commit.
+    """
+    ids = list(ids)
+    if not ids:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        # Held until the commit
+        db.execute(select(func.pg_advisory_xact_lock(LOCK_KEY)))
+    now = models.utcnow()
+    db.execute(
+        insert(change_log),
+        [
+            {
+                "entity": entity,
+                "entity_id": entity_id,
+                "deleted": deleted,
+                "changed_at": now,
+            }
+            for entity_id in ids
+        ],
+    )
+
+
+def read(db: Session, after: int = 0, limit: int = SYNC_PAGE_SIZE):
+    """
+    `(changes, seq, more)` for up to `limit` log entries after `after`:
+    `{(entity, id): deleted}` for the latest entry about each user or bet, the
+    sequence number to ask for the next page after, and whether there is one.
+    """
+    rows = db.execute(
+        select(
+            change_log.c.seq,
+            change_log.c.entity,
+            change_log.c.entity_id,
+            change_log.c.deleted,
+        )
+        .where(change_log.c.seq > after)
+        .order_by(change_log.c.seq)
+        .limit(limit + 1)
+    ).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    changes = {}
+    for row in rows:
+        # Later entries win
+        changes[(row.entity, row.entity_id)] = row.deleted
+    return changes, rows[-1].seq if rows else after, more
+
+
+def backfill(engine: Engine):
+    """
+    Log an upsert for every user and bet (live or archived) if the log is
+    still empty, e.g. on a database from before it existed.
+    """
+    bets = models.Bet.__table__
+    archived_bets = models.ArchivedBet.__table__
+    now = models.utcnow()
+    columns = ["entity", "entity_id", "deleted", "changed_at"]
+    with engine.begin() as conn:
+        if conn.execute(select(change_log.c.seq).limit(1)).first() is not None:
+            return
+        users = models.User.__table__
+        conn.execute(
+            insert(change_log).from_select(
+                columns,
+                select(
+                    literal(USER), users.c.id, literal(False), literal(now)
+                ).order_by(users.c.id),
+            )
+        )
+        for table in (archived_bets, bets):
+            conn.execute(
+                insert(change_log).from_select(
+                    columns,
+                    select(literal(BET), table.c.id, literal(False), literal(now))
+                    .where(
+                        and_(
+                            table.c.bettor_id.is_not(None),
+                            table.c.bettee_id.is_not(None),
+                        )
+                    )
+                    .order_by(table.c.id),
+                )
+            )
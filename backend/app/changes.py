@@ -0,0 +1,196 @@
+"""
+Single place the mutation routes report committed changes to. From here the
+materialized graph is patched, cached responses are invalidated and deltas are
+pushed to live subscribers. Every change is also published to the other
+workers (see shared_state.py), which apply it to their own state through
+`apply`.
+"""
+
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .cache import bet_tags, response_cache
+from .columnar import bet_columns
+from .database import SessionLocal
+from .graph import bet_edge, shot_graph
+from .hub import hub
+from .replicas import replica_set
+from .settlements import settlement_book
+from .shared_state import shared_state
+from .stats import stats_book
+
+
+def _publish_leaderboard(db: Session, user_ids):
+    if not hub.has_subscribers:
+        return
+    # Rows are read off the materialized graph, so make sure there is one
+    shot_graph.ensure_built(db)
+    hub.publish("leaderboard", {"rows": shot_graph.leaderboard_rows(user_ids)})
+
+
+def _bet_saved(bet: models.Bet):
+    replica_set.saw_change()
+    shot_graph.bet_saved(bet)
+    # The stats take out what the bet counted for before, if it was there already
+    previous = bet_columns.row(bet.id)
+    bet_columns.bet_saved(bet)
+    stats_book.bet_saved(bet, previous)
+    settlement_book.bet_saved(bet)
+    response_cache.invalidate(*bet_tags(bet.id, bet.bettor_id, bet.bettee_id))
+
+
+def _bet_created(db: Session, bet: models.Bet):
+    _bet_saved(bet)
+    hub.publish("edge", bet_edge(bet))
+    _publish_leaderboard(db, [bet.bettor_id, bet.bettee_id])
+
+
+def _bet_updated(db: Session, bet: models.Bet):
+    _bet_saved(bet)
+    hub.publish("outcome", {"id": bet.id, "outcome": bet.outcome, "value": bet.shots})
+    _publish_leaderboard(db, [bet.bettor_id, bet.bettee_id])
+
+
+def _bet_deleted(db: Session, bet_id: int, bettor_id: int, bettee_id: int):
+    replica_set.saw_change()
+    shot_graph.bet_deleted(bet_id)
+    stats_book.bet_deleted(bet_columns.row(bet_id))
+    bet_columns.bet_deleted(bet_id)
+    settlement_book.bet_deleted(bet_id)
+    response_cache.invalidate(*bet_tags(bet_id, bettor_id, bettee_id))
+    hub.publish("edge_deleted", {"id": bet_id})
+    _publish_leaderboard(db, [bettor_id, bettee_id])
+
+
+def _bet_archived(bet_id: int, bettor_id: int, bettee_id: int):
+    # Out of the live working set, but still part of the history: the stats keep it
+    replica_set.saw_change()
+    shot_graph.bet_deleted(bet_id)
+    bet_columns.bet_deleted(bet_id)
+    settlement_book.bet_deleted(bet_id)
+    response_cache.invalidate(*bet_tags(bet_id, bettor_id, bettee_id))
+    hub.publish("edge_deleted", {"id": bet_id})
+
+
+def _user_updated(db: Session, user: models.User):
+    replica_set.saw_change()
+    shot_graph.user_saved(user)
+    # Names show up in other users' cached responses too, and renames are rare
+    response_cache.clear()
+    hub.publish("user", {"id": user.id, "name": user.name})
+    _publish_leaderboard(db, [user.id])
+
+
+def _user_deleted(db: Session, user_id: int):
+    replica_set.saw_change()
+    shot_graph.user_deleted(user_id)
+    # Deleting a user takes their bets with it
+    bet_columns.invalidate()
+    settlement_book.invalidate()
+    stats_book.invalidate()
+    response_cache.clear()
+    hub.publish("user_deleted", {"id": user_id})
+
+
+def batch():
+    # Changes reported inside go out to the other workers together
+    return shared_state.batch()
+
+
+def bet_created(db: Session, bet: models.Bet):
+    _bet_created(db, bet)
+    shared_state.publish({"kind": "bet_created", "bet_id": bet.id})
+
+
+def bet_updated(db: Session, bet: models.Bet):
+    _bet_updated(db, bet)
+    shared_state.publish({"kind": "bet_updated", "bet_id": bet.id})
+
+
+def bet_deleted(db: Session, bet_id: int, bettor_id: int, bettee_id: int):
+    _bet_deleted(db, bet_id, bettor_id, bettee_id)
+    shared_state.publish(
+        {
+            "kind": "bet_deleted",
+            "bet_id": bet_id,
+            "bettor_id": bettor_id,
+            "bettee_id": bettee_id,
+        }
+    )
+
+
+def bets_archived(rows):
+    # Rows of bets moved to the archive (see archive.py), in one batch
+    with batch():
+        for row in rows:
+            _bet_archived(row.id, row.bettor_id, row.bettee_id)
+            shared_state.publish(
+                {
+                    "kind": "bet_archived",
+                    "bet_id": row.id,
+                    "bettor_id": row.bettor_id,
+                    "bettee_id": row.bettee_id,
+                }
+            )
+
+
+def user_updated(db: Session, user: models.User):
+    _user_updated(db, user)
+    shared_state.publish({"kind": "user_updated", "user_id": user.id})
+
+
+def user_deleted(db: Session, user_id: int):
+    _user_deleted(db, user_id)
+    shared_state.publish({"kind": "user_deleted", "user_id": user_id})
+
+
+def apply(events):
+    """
+    Apply changes published by another worker, in order, loading the bets and
+    users they touched with one query each. Saved bets and users are applied
+    as they are now; any that are gone have a deletion coming after.
+    """
+    db = SessionLocal()
+    try:
+        bets = crud.get_bets_by_ids(
+            db,
+            [
+                event["bet_id"]
+                for event in events
+                if event["kind"] in ("bet_created", "bet_updated")
+            ],
+        )
+        users = crud.get_users_by_ids(
+            db,
+            [event["user_id"] for event in events if event["kind"] == "user_updated"],
+        )
+        for event in events:
+            kind = event["kind"]
+            if kind == "bet_created" and event["bet_id"] in bets:
+                _bet_created(db, bets[event["bet_id"]])
+            elif kind == "bet_updated" and event["bet_id"] in bets:
+                _bet_updated(db, bets[event["bet_id"]])
+            elif kind == "bet_deleted":
+                _bet_deleted(
+                    db, event["bet_id"], event["bettor_id"], event["bettee_id"]
+                )
+            elif kind == "bet_archived":
+                _bet_archived(event["bet_id"], event["bettor_id"], event["bettee_id"])
+            elif kind == "user_updated" and event["user_id"] in users:
+                _user_updated(db, users[event["user_id"]])
+            elif kind == "user_deleted":
+                _user_deleted(db, event["user_id"])
+    finally:
+        db.close()
+
+
+def resync():
+    # Changes from other workers may have been missed: drop everything derived
+    # from the database, so it is rebuilt on the next read (from the primary)
+    replica_set.saw_change()
+    shot_graph.invalidate()
+    bet_columns.invalidate()
+    settlement_book.invalidate()
+    stats_book.invalidate()
+    response_cache.clear()
+    hub.publish("resync", {})
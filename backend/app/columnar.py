@@ -0,0 +1,421 @@
+"""
+Columnar snapshot of the bets table for the analytics paths.
+
+The numeric columns of every bet (bettor, bettee, shots, status and the created and
+resolved timestamps) are held in `array` module arrays, 8 bytes or less per value,
+instead of one ORM instance and one dict per bet. The kernels below sum and bucket
+them with NumPy when it is installed (zero-copy views over the arrays) and with
+plain loops otherwise.
+
+Like the materialized graph, the snapshot is loaded once and then patched by the
+mutation hooks in changes.py. Bets left without a bettor or bettee by a deleted
+user are left out.
+"""
+
+import math
+import threading
+from array import array
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models
+
+try:
+    import numpy
+except ImportError:  # the kernels fall back to plain Python
+    numpy = None
+
+# Rows are read from the database in chunks of this size while loading
+CHUNK_SIZE = 10000
+
+STATUS_CODES = {status: code for code, status in enumerate(models.BetStatus)}
+OPEN = STATUS_CODES[models.BetStatus.open]
+RESOLVED = STATUS_CODES[models.BetStatus.resolved]
+# Deleted bets keep their row until the arrays are compacted
+DELETED = -1
+
+_EPOCH = datetime(1970, 1, 1)
+
+COLUMNS = {
+    "ids": "q",
+    "bettor_ids": "q",
+    "bettee_ids": "q",
+    "shots": "q",
+    "statuses": "b",
+    "created": "d",  # seconds since the epoch
+    "resolved": "d",  # seconds since the epoch, NaN if not resolved
+}
+# The columns making up a `bet_row`, in order
+ROW_COLUMNS = ("bettor_ids", "bettee_ids", "shots", "statuses", "created", "resolved")
+
+
+def timestamp(value: datetime):
+    return math.nan if value is None else (value - _EPOCH).total_seconds()
+
+
+def bet_row(bet: models.Bet):
+    """
+    `(bettor id, bettee id, shots, status code, created, resolved)` of a bet, as
+    stored in the snapshot.
+    """
+    return (
+        bet.bettor_id,
+        bet.bettee_id,
+        bet.shots or 0,
+        STATUS_CODES[models.BetStatus(bet.status or models.BetStatus.open)],
+        timestamp(bet.created_at),
+        timestamp(bet.resolved_at),
+    )
+
+
+def _group_sums(keys, weights):
+    # {key: sum of weights} over the parallel sequences `keys` and `weights`
+    if numpy is not None:
+        if len(keys) and keys.min() >= 0 and keys.max() < 4 * len(keys) + 1024:
+            # Small non-negative keys (user ids, mostly) can index the counts directly
+            counts = numpy.bincount(keys)
+            sums = numpy.bincount(keys, weights=weights, minlength=len(counts))
+            present = numpy.flatnonzero(counts)
+            return dict(
+                zip(present.tolist(), sums[present].astype(numpy.int64).tolist())
+            )
+        unique, inverse = numpy.unique(keys, return_inverse=True)
+        sums = numpy.bincount(inverse, weights=weights, minlength=len(unique))
+        return dict(zip(unique.tolist(), sums.astype(numpy.int64).tolist()))
+    sums = {}
+    for key, weight in zip(keys, weights):
+        sums[key] = sums.get(key, 0) + weight
+    return sums
+
+
+class BetColumns:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._reset()
+
+    def _reset(self):
+        for name, typecode in COLUMNS.items():
+            setattr(self, name, array(typecode))
+        self._positions = {}  # bet id -> row
+        self._deleted = 0
+
+    def __len__(self):
+        return len(self._positions)
+
+    @property
+    def nbytes(self):
+        return sum(
+            len(getattr(self, name)) * getattr(self, name).itemsize for name in COLUMNS
+        )
+
+    def build(self, db: Session):
+        with self._lock:
+            self._reset()
+            rows = db.execute(
+                select(
+                    models.Bet.id,
+                    models.Bet.bettor_id,
+                    models.Bet.bettee_id,
+                    models.Bet.shots,
+                    models.Bet.status,
+                    models.Bet.created_at,
+                    models.Bet.resolved_at,
+                )
+                .where(
+                    models.Bet.bettor_id.is_not(None), models.Bet.bettee_id.is_not(None)
+                )
+                .execution_options(yield_per=CHUNK_SIZE)
+            )
+            for row in rows:
+                self._append(*row)
+            self._built = True
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+            self._reset()
+
+    def ensure_built(self, db: Session):
+        with self._lock:
+            if not self._built:
+                self.build(db)
+
+    # Mutation hooks
+
+    def bet_saved(self, bet: models.Bet):
+        with self._lock:
+            if not self._built:
+                return
+            if bet.bettor_id is None or bet.bettee_id is None:
+                # Left behind by a deleted user, so not counted anywhere
+                self.bet_deleted(bet.id)
+                return
+            row = self._positions.get(bet.id)
+            if row is None:
+                self._append(
+                    bet.id,
+                    bet.bettor_id,
+                    bet.bettee_id,
+                    bet.shots,
+                    bet.status,
+                    bet.created_at,
+                    bet.resolved_at,
+                )
+                return
+            self.bettor_ids[row] = bet.bettor_id
+            self.bettee_ids[row] = bet.bettee_id
+            self.shots[row] = bet.shots or 0
+            self.statuses[row] = STATUS_CODES[models.BetStatus(bet.status)]
+            self.created[row] = timestamp(bet.created_at)
+            self.resolved[row] = timestamp(bet.resolved_at)
+
+    def bet_deleted(self, bet_id: int):
+        with self._lock:
+            row = self._positions.pop(bet_id, None)
+            if row is None:
+                return
+            self.statuses[row] = DELETED
+            self._deleted += 1
+            if self._deleted > len(self._positions):
+                self._compact()
+
+    def row(self, bet_id: int):
+        """
+        The stored `bet_row` of `bet_id`, or None if the bet isn't in the snapshot.
+        """
+        with self._lock:
+            row = self._positions.get(bet_id)
+            if row is None:
+                return None
+            return tuple(getattr(self, name)[row] for name in ROW_COLUMNS)
+
+    def rows(self, db: Session):
+        """
+        `bet_row` tuples of every bet.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            rows = zip(*(getattr(self, name) for name in ROW_COLUMNS))
+            return [row for row in rows if row[3] != DELETED]
+
+    # Kernels. Each returns plain Python values, so no NumPy view outlives the call
+    # (the arrays can't grow while one exists).
+
+    def open_bets(self, db: Session):
+        """
+        `(bet id, bettor id, bettee id, shots)` of every open bet.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            if numpy is not None:
+                statuses = self._view("statuses")
+                rows = numpy.flatnonzero(statuses == OPEN)
+                return list(
+                    zip(
+                        *(
+                            self._view(name)[rows].tolist()
+                            for name in ("ids", "bettor_ids", "bettee_ids", "shots")
+                        )
+                    )
+                )
+            return [
+                (bet_id, bettor_id, bettee_id, shots)
+                for bet_id, bettor_id, bettee_id, shots, status in zip(
+                    self.ids,
+                    self.bettor_ids,
+                    self.bettee_ids,
+                    self.shots,
+                    self.statuses,
+                )
+                if status == OPEN
+            ]
+
+    def leaderboard_totals(self, db: Session):
+        """
+        `(owed, owed_to)`: open shots owed by and to each user, with every user that
+        is part of a bet present in both.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            if numpy is not None:
+                statuses = self._view("statuses")
+                live = statuses != DELETED
+                open_shots = numpy.where(statuses == OPEN, self._view("shots"), 0)[live]
+                bettors = self._view("bettor_ids")[live]
+                bettees = self._view("bettee_ids")[live]
+                users = numpy.concatenate((bettors, bettees))
+                zeros = numpy.zeros(len(open_shots))
+                owed = _group_sums(users, numpy.concatenate((open_shots, zeros)))
+                owed_to = _group_sums(users, numpy.concatenate((zeros, open_shots)))
+                return owed, owed_to
+
+            owed, owed_to = {}, {}
+            for bettor_id, bettee_id, shots, status in zip(
+                self.bettor_ids, self.bettee_ids, self.shots, self.statuses
+            ):
+                if status == DELETED:
+                    continue
+                open_shots = shots if status == OPEN else 0
+                for user_id in (bettor_id, bettee_id):
+                    owed.setdefault(user_id, 0)
+                    owed_to.setdefault(user_id, 0)
+                owed[bettor_id] += open_shots
+                owed_to[bettee_id] += open_shots
+            return owed, owed_to
+
+    def counterparty_totals(self, db: Session, user_id: int):
+        """
+        `(outward, inward)`: shots `user_id` bet each counterparty, and shots each
+        counterparty bet them, over all bets whatever their outcome.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            if numpy is not None:
+                live = self._view("statuses") != DELETED
+                bettors, bettees = self._view("bettor_ids"), self._view("bettee_ids")
+                shots = self._view("shots")
+                outward = live & (bettors == user_id)
+                inward = live & (bettees == user_id)
+                return (
+                    _group_sums(bettees[outward], shots[outward]),
+                    _group_sums(bettors[inward], shots[inward]),
+                )
+
+            outward, inward = {}, {}
+            for bettor_id, bettee_id, shots, status in zip(
+                self.bettor_ids, self.bettee_ids, self.shots, self.statuses
+            ):
+                if status == DELETED:
+                    continue
+                if bettor_id == user_id:
+                    outward[bettee_id] = outward.get(bettee_id, 0) + shots
+                if bettee_id == user_id:
+                    inward[bettor_id] = inward.get(bettor_id, 0) + shots
+            return dict(sorted(outward.items())), dict(sorted(inward.items()))
+
+    def pair_balances(self, db: Session):
+        """
+        `{(a, b): shots}` with a < b: open shots a owes b, net of what b owes a.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            if numpy is not None:
+                statuses = self._view("statuses")
+                bettors, bettees = self._view("bettor_ids"), self._view("bettee_ids")
+                rows = (statuses == OPEN) & (bettors != bettees)
+                bettors, bettees = bettors[rows], bettees[rows]
+                shots = self._view("shots")[rows]
+                low = numpy.minimum(bettors, bettees)
+                high = numpy.maximum(bettors, bettees)
+                signed = numpy.where(bettors == low, shots, -shots)
+                span = int(high.max()) + 1 if len(high) else 1
+                sums = _group_sums(low * span + high, signed)
+                return {divmod(key, span): total for key, total in sums.items()}
+
+            balances = {}
+            for bettor_id, bettee_id, shots, status in zip(
+                self.bettor_ids, self.bettee_ids, self.shots, self.statuses
+            ):
+                if status != OPEN or bettor_id == bettee_id:
+                    continue
+                if bettor_id < bettee_id:
+                    key, signed = (bettor_id, bettee_id), shots
+                else:
+                    key, signed = (bettee_id, bettor_id), -shots
+                balances[key] = balances.get(key, 0) + signed
+            return dict(sorted(balances.items()))
+
+    def bucket_counts(self, db: Session, bucket_seconds: int):
+        """
+        `[(bucket start, bets created, shots wagered, bets resolved, shots called)]`
+        per `bucket_seconds` window (bucket starts are seconds since the epoch),
+        for the windows that have anything in them.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            if numpy is not None:
+                statuses = self._view("statuses")
+                live = statuses != DELETED
+                resolved = (statuses == RESOLVED) & ~numpy.isnan(self._view("resolved"))
+                shots = self._view("shots")
+                created = numpy.floor_divide(
+                    self._view("created")[live], bucket_seconds
+                )
+                called = numpy.floor_divide(
+                    self._view("resolved")[resolved], bucket_seconds
+                )
+                buckets = {}
+                for index, column in (
+                    (
+                        0,
+                        _group_sums(
+                            created.astype(numpy.int64), numpy.ones(len(created))
+                        ),
+                    ),
+                    (1, _group_sums(created.astype(numpy.int64), shots[live])),
+                    (
+                        2,
+                        _group_sums(
+                            called.astype(numpy.int64), numpy.ones(len(called))
+                        ),
+                    ),
+                    (3, _group_sums(called.astype(numpy.int64), shots[resolved])),
+                ):
+                    for bucket, value in column.items():
+                        buckets.setdefault(bucket, [0, 0, 0, 0])[index] = value
+            else:
+                buckets = {}
+                for shots, status, created, resolved in zip(
+                    self.shots, self.statuses, self.created, self.resolved
+                ):
+                    if status == DELETED:
+                        continue
+                    counts = buckets.setdefault(
+                        int(created // bucket_seconds), [0, 0, 0, 0]
+                    )
+                    counts[0] += 1
+                    counts[1] += shots
+                    if status == RESOLVED and not math.isnan(resolved):
+                        counts = buckets.setdefault(
+                            int(resolved // bucket_seconds), [0, 0, 0, 0]
+                        )
+                        counts[2] += 1
+                        counts[3] += shots
+            return [
+                (bucket * bucket_seconds, *counts)
+                for bucket, counts in sorted(buckets.items())
+            ]
+
+    # Internals
+
+    def _view(self, name):
+        column = getattr(self, name)
+        return numpy.frombuffer(column, dtype=column.typecode)
+
+    def _append(
+        self, bet_id, bettor_id, bettee_id, shots, status, created_at, resolved_at
+    ):
+        self._positions[bet_id] = len(self.ids)
+        self.ids.append(bet_id)
+        self.bettor_ids.append(bettor_id)
+        self.bettee_ids.append(bettee_id)
+        self.shots.append(shots or 0)
+        self.statuses.append(
+            STATUS_CODES[models.BetStatus(status or models.BetStatus.open)]
+        )
+        self.created.append(timestamp(created_at))
+        self.resolved.append(timestamp(resolved_at))
+
+    def _compact(self):
+        keep = [row for row, status in enumerate(self.statuses) if status != DELETED]
+        for name, typecode in COLUMNS.items():
+            column = getattr(self, name)
+            setattr(self, name, array(typecode, (column[row] for row in keep)))
+        self._positions = {bet_id: row for row, bet_id in enumerate(self.ids)}
+        self._deleted = 0
+
+
+bet_columns = BetColumns()
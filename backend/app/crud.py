@@ -1,5 +1,91 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, insert, or_, select, union_all, update
+from sqlalchemy.orm import Session, aliased, joinedload
+from . import change_log, models, schemas, search, utils
+
+
+# Keyset pagination
+def _after(columns, values):
+    # Row-value comparison `(a, b) > (x, y)`, spelled out so every backend can use
+    # its index
+    first, *rest = columns
+    condition = first > values[0]
+    if rest:
+        condition = or_(condition, and_(first == values[0], _after(rest, values[1:])))
+    return condition
+
+
+def paginate(
+    query,
+    columns,
+    limit: Optional[int],
+    cursor: Optional[str] = None,
+    key=None,
+    skip: int = 0,
+):
+    """
+    Return one page of `query` ordered by `columns`, and the cursor for the next page
+    (None once there is nothing left). Rows after `cursor` are found through the
+    ordering instead of an OFFSET, so deep pages cost as much as the first one.
+    `key` pulls the sort values back out of a row.
+    """
+    if cursor:
+        query = query.filter(_after(columns, utils.decode_cursor(cursor, len(columns))))
+    query = query.order_by(*columns).offset(skip)
+    if limit is None:
+        return query.all(), None
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, utils.encode_cursor(*key(rows[-1]))
+
+
+def bet_key(bet: models.Bet):
+    return bet.created_at, bet.id
+
+
+# Live and archived bets together, for history reads (see app/archive.py). It is
+# mapped like Bet, so the same columns, filters and ordering work on either.
+_bet_column_names = [column.name for column in models.Bet.__table__.c]
+all_bets = aliased(
+    models.Bet,
+    union_all(
+        select(*models.Bet.__table__.c),
+        select(*(models.ArchivedBet.__table__.c[name] for name in _bet_column_names)),
+    ).subquery("all_bets"),
+    name="all_bets",
+)
+
+
+def bet_source(include_archived: bool = False):
+    return all_bets if include_archived else models.Bet
+
+
+def bet_order(bets=models.Bet):
+    return (bets.created_at, bets.id)
+
+
+def bet_row_columns(bets=models.Bet):
+    # Bet columns to select for plain rows that schemas.Bet can be built from
+    # (and that bet_key works on)
+    return (
+        bets.bettor_id,
+        bets.bettee_id,
+        bets.shots,
+        bets.description,
+        bets.id,
+        bets.date_created,
+        bets.outcome,
+        bets.created_at,
+    )
+
+
+BET_ORDER = bet_order()
+BET_ROW_COLUMNS = bet_row_columns()
 
 
 # User CRUD operations
@@ -11,13 +97,54 @@ def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(
+    db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+):
+    return paginate(
+        db.query(models.User),
+        (models.User.id,),
+        limit,
+        cursor,
+        key=lambda user: (user.id,),
+        skip=skip,
+    )
+
+
+def get_users_by_ids(db: Session, user_ids):
+    # Resolve many users with a single IN query, keyed by id
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    users = db.query(models.User).filter(models.User.id.in_(user_ids)).all()
+    return {user.id: user for user in users}
+
+
+def get_related_users(db: Session, user_id: int):
+    # Users who have been involved in bets with the given user, in one query.
+    # Archived bets are found through their per-pair totals.
+    totals = models.ArchivedBetTotal
+    bettees = db.query(models.Bet.bettee_id).filter(models.Bet.bettor_id == user_id)
+    bettors = db.query(models.Bet.bettor_id).filter(models.Bet.bettee_id == user_id)
+    archived_bettees = db.query(totals.bettee_id).filter(totals.bettor_id == user_id)
+    archived_bettors = db.query(totals.bettor_id).filter(totals.bettee_id == user_id)
+    return (
+        db.query(models.User)
+        .filter(models.User.id != user_id)
+        .filter(
+            models.User.id.in_(
+                bettees.union(bettors, archived_bettees, archived_bettors)
+            )
+        )
+        .order_by(models.User.id)
+        .all()
+    )
 
 
 def create_user(db: Session, user: schemas.UserCreate):
     db_user = models.User(name=user.name, email=user.email)
     db.add(db_user)
+    db.flush()
+    change_log.record(db, change_log.USER, [db_user.id])
     db.commit()
     db.refresh(db_user)
     return db_user
@@ -28,45 +155,266 @@ def get_bet(db: Session, bet_id: int):
     return db.query(models.Bet).filter(models.Bet.id == bet_id).first()
 
 
-def get_bets(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Bet).offset(skip).limit(limit).all()
+def get_bet_with_names(db: Session, bet_id: int):
+    # Aliases for the bettor and bettee users
+    bettor_alias = aliased(models.User)
+    bettee_alias = aliased(models.User)
+
+    # Join with aliased user tables. Archived bets are found too: the id lookup
+    # is an index hit in each table.
+    db_bet = (
+        db.query(
+            all_bets,
+            bettor_alias.name.label("bettor_name"),
+            bettee_alias.name.label("bettee_name"),
+        )
+        .join(bettor_alias, all_bets.bettor_id == bettor_alias.id)
+        .join(bettee_alias, all_bets.bettee_id == bettee_alias.id)
+        .filter(all_bets.id == bet_id)
+        .first()
+    )
+
+    if not db_bet:
+        return None
+
+    # Unpack the result and format response
+    bet, bettor_name, bettee_name = db_bet
+    return {
+        "id": bet.id,
+        "date_created": bet.date_created,
+        "shots": bet.shots,
+        "description": bet.description,
+        "outcome": bet.outcome,
+        "bettor_id": bet.bettor_id,
+        "bettor_name": bettor_name,
+        "bettee_id": bet.bettee_id,
+        "bettee_name": bettee_name,
+    }
+
+
+def get_bets(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    as_rows: bool = False,
+    include_archived: bool = False,
+    **filters,
+):
+    # With `as_rows`, bets come back as plain rows of BET_ROW_COLUMNS
+    bets = bet_source(include_archived)
+    query = db.query(*bet_row_columns(bets)) if as_rows else db.query(bets)
+    query = filter_bets(query, bets=bets, **filters)
+    return paginate(query, bet_order(bets), limit, cursor, key=bet_key, skip=skip)
+
+
+def filter_bets(
+    query,
+    status: Optional[models.BetStatus] = None,
+    bettor_id: Optional[int] = None,
+    bettee_id: Optional[int] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    bets=models.Bet,
+):
+    if status is not None:
+        query = query.filter(bets.status == status)
+    if bettor_id is not None:
+        query = query.filter(bets.bettor_id == bettor_id)
+    if bettee_id is not None:
+        query = query.filter(bets.bettee_id == bettee_id)
+    if created_after is not None:
+        query = query.filter(bets.created_at >= created_after)
+    if created_before is not None:
+        query = query.filter(bets.created_at < created_before)
+    return query
+
+
+def search_bets(
+    db: Session,
+    query: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    user_id: Optional[int] = None,
+    **filters,
+):
+    """
+    Bets whose description or bettor's or bettee's name match `query`, best
+    match first, as plain rows of BET_ROW_COLUMNS with the names and `rank`.
+    Goes through the full-text index (see search.py), so only matching bets are
+    read. `user_id` keeps bets the user is on either side of.
+    """
+    found = search.matching(db.get_bind().dialect.name, query)
+    if found is None:
+        return [], None
+    index, bet_id, condition, rank = found
+
+    # The most recent matches that pass the filters, in index order, so the
+    # index is read newest first and stops once there are enough
+    candidates = filter_bets(
+        select(models.Bet.id.label("id"), rank.label("rank"))
+        .select_from(index)
+        .join(models.Bet, models.Bet.id == bet_id)
+        .where(condition),
+        **filters,
+    )
+    if user_id is not None:
+        candidates = candidates.where(
+            or_(models.Bet.bettor_id == user_id, models.Bet.bettee_id == user_id)
+        )
+    candidates = (
+        candidates.order_by(bet_id.desc()).limit(search.SEARCH_CANDIDATES).subquery()
+    )
+
+    bettor = aliased(models.User)
+    bettee = aliased(models.User)
+    rows = (
+        db.query(
+            *BET_ROW_COLUMNS,
+            bettor.name.label("bettor_name"),
+            bettee.name.label("bettee_name"),
+            candidates.c.rank,
+        )
+        .join(candidates, candidates.c.id == models.Bet.id)
+        .outerjoin(bettor, models.Bet.bettor_id == bettor.id)
+        .outerjoin(bettee, models.Bet.bettee_id == bettee.id)
+    )
+    return paginate(
+        rows,
+        (candidates.c.rank, models.Bet.id),
+        limit,
+        cursor,
+        key=lambda row: (row.rank, row.id),
+    )
+
+
+def get_bet_rows(db: Session, include_archived: bool = False):
+    """
+    Every bet as a plain row (attributes named like the Bet columns, plus
+    `bettor_name` and `bettee_name`), without building ORM instances.
+    """
+    bets = bet_source(include_archived)
+    bettor = aliased(models.User)
+    bettee = aliased(models.User)
+    return (
+        db.query(
+            bets.id,
+            bets.bettor_id,
+            bets.bettee_id,
+            bets.shots,
+            bets.description,
+            bets.outcome,
+            bets.date_created,
+            bets.status,
+            bets.resolved_at,
+            bettor.name.label("bettor_name"),
+            bettee.name.label("bettee_name"),
+        )
+        .join(bettor, bets.bettor_id == bettor.id)
+        .join(bettee, bets.bettee_id == bettee.id)
+        .order_by(bets.id)
+        .all()
+    )
+
+
+def get_user_bet_ids(db: Session, user_id: int):
+    # Ids of every bet, live or archived, the user is on either side of
+    return [
+        bet_id
+        for bet_id, in db.query(all_bets.id).filter(
+            or_(all_bets.bettor_id == user_id, all_bets.bettee_id == user_id)
+        )
+    ]
+
+
+def get_bet_rows_by_ids(db: Session, bet_ids):
+    # Bets, live or archived, for many ids as plain rows of the Bet columns
+    bet_ids = set(bet_ids)
+    if not bet_ids:
+        return []
+    return db.query(*bet_row_columns(all_bets)).filter(all_bets.id.in_(bet_ids)).all()
+
+
+def get_archived_totals(db: Session, user_id: int):
+    """
+    `(outward, inward)`: shots `user_id` bet each counterparty, and shots each
+    counterparty bet them, over the archived bets.
+    """
+    totals = models.ArchivedBetTotal
+    outward = dict(
+        db.query(totals.bettee_id, totals.shots)
+        .filter(totals.bettor_id == user_id)
+        .all()
+    )
+    inward = dict(
+        db.query(totals.bettor_id, totals.shots)
+        .filter(totals.bettee_id == user_id)
+        .all()
+    )
+    return outward, inward
 
 
 def create_bet(db: Session, bet: schemas.BetCreate):
-    db_bet = models.Bet(**bet.dict())
+    now = models.utcnow()
+    db_bet = models.Bet(
+        **bet.dict(), date_created=now, created_at=now, status=models.BetStatus.open
+    )
     db.add(db_bet)
+    db.flush()
+    change_log.record(db, change_log.BET, [db_bet.id])
     db.commit()
     db.refresh(db_bet)
     return db_bet
 
 
-def get_user_shot_balances(db: Session, user_id: int):
-    # Shots this user owes to others
-    shots_owed = db.query(models.Bet).filter(models.Bet.bettor_id == user_id).all()
-
-    # Shots others owe this user
-    shots_owed_to = db.query(models.Bet).filter(models.Bet.bettee_id == user_id).all()
+def get_bets_by_ids(db: Session, bet_ids):
+    # Bets (with bettor and bettee) for many ids in one query, keyed by id
+    bet_ids = set(bet_ids)
+    if not bet_ids:
+        return {}
+    bets = (
+        db.query(models.Bet)
+        .options(joinedload(models.Bet.bettor), joinedload(models.Bet.bettee))
+        .filter(models.Bet.id.in_(bet_ids))
+        .all()
+    )
+    return {bet.id: bet for bet in bets}
 
-    # Create dictionaries to store balances with specific users
-    shots_i_owe = {}
-    shots_others_owe_me = {}
 
-    # Process shots owed
-    for bet in shots_owed:
-        if bet.bettee_id not in shots_i_owe:
-            shots_i_owe[bet.bettee_id] = 0
-        shots_i_owe[bet.bettee_id] += bet.shots
+def create_bets(db: Session, bets):
+    """
+    Insert many bets with a single multi-row INSERT and commit once.
+    Returns the ids of the new bets, in order.
+    """
+    if not bets:
+        return []
+    now = models.utcnow()
+    rows = [
+        dict(bet.dict(), date_created=now, created_at=now, status=models.BetStatus.open)
+        for bet in bets
+    ]
+    statement = insert(models.Bet).returning(
+        models.Bet.id, sort_by_parameter_order=True
+    )
+    bet_ids = db.scalars(statement, rows).all()
+    change_log.record(db, change_log.BET, bet_ids)
+    db.commit()
+    return list(bet_ids)
 
-    # Process shots owed to me
-    for bet in shots_owed_to:
-        if bet.bettor_id not in shots_others_owe_me:
-            shots_others_owe_me[bet.bettor_id] = 0
-        shots_others_owe_me[bet.bettor_id] += bet.shots
 
-    # Return the shot balances in a structured format
-    return {
-        "total_user_shots_outward": sum(shots_i_owe.values()),
-        "total_user_shots_inward": sum(shots_others_owe_me.values()),
-        "outward": shots_i_owe,
-        "inward": shots_others_owe_me,
-    }
+def resolve_bets(db: Session, resolutions):
+    """
+    Apply many `(bet_id, outcome values, shots)` updates with one executemany
+    UPDATE and commit once.
+    """
+    if not resolutions:
+        return
+    rows = []
+    for bet_id, values, shots in resolutions:
+        row = dict(values, id=bet_id)
+        if shots is not None:
+            row["shots"] = shots
+        rows.append(row)
+    db.execute(update(models.Bet), rows)
+    change_log.record(db, change_log.BET, [row["id"] for row in rows])
+    db.commit()
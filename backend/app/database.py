@@ -1,14 +1,16 @@
 from fastapi import HTTPException, Query
-from sqlalchemy import create_engine, event
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
+import threading
+import time
 
-from dotenv import load_dotenv
-
-# Make sure dotenv is loaded
-load_dotenv()
+from . import metrics
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -17,23 +19,296 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 # is provided that matches a randomly generated string in memory.
 DATA_UPDATE_KEY = os.getenv("DATA_UPDATE_KEY")
 
-engine = create_engine(DATABASE_URL)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+# Connection pool tuning. Hosted Postgres caps connections per role, so
+# DB_POOL_SIZE + DB_MAX_OVERFLOW per worker should stay under that cap.
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 5)
+DB_MAX_OVERFLOW = _env_int("DB_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT = _env_int("DB_POOL_TIMEOUT", 30)
+DB_POOL_RECYCLE = _env_int("DB_POOL_RECYCLE", 1800)
+DB_POOL_PRE_PING = _env_flag("DB_POOL_PRE_PING", True)
+# Postgres only: queries running longer than this are cancelled (0 disables)
+DB_STATEMENT_TIMEOUT_MS = _env_int("DB_STATEMENT_TIMEOUT_MS", 0)
+# SQLite only
+SQLITE_MMAP_SIZE = _env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+SQLITE_SHARED_CACHE = _env_flag("SQLITE_SHARED_CACHE", False)
+
+
+class PoolMetrics:
+    """
+    Counters fed by one engine's pool: connections opened, checkouts, checkins
+    and invalidations, plus how long checkouts had to wait for a free connection
+    and how many gave up after DB_POOL_TIMEOUT. Each pool has its own, as
+    `pool.metrics` (see pool_stats).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool=None):
+        with self._lock:
+            stats = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+                idle=pool.checkedin(),
+            )
+        return stats
+
+
+class _TimedCheckout:
+    # Times how long getting a connection out of the pool takes, which is
+    # where requests queue up once the pool is exhausted. Pools have no event
+    # for the start of a checkout, so this wraps Pool.connect() itself.
+    metrics = None
+
+    def connect(self):
+        if self.metrics is None:
+            return super().connect()
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() swaps in a new pool; the counters carry on
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    # WAL lets readers carry on while a write is in progress, and with WAL,
+    # synchronous=NORMAL is still safe against corruption
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def pool_stats(pool) -> dict:
+    """
+    The counters of `pool` (see PoolMetrics), plus its current size for a QueuePool.
+    """
+    return (getattr(pool, "metrics", None) or PoolMetrics()).snapshot(pool)
+
+
+def _instrument(engine: Engine):
+    pool_metrics = engine.pool.metrics = PoolMetrics()
+    event.listen(engine, "connect", lambda *args: pool_metrics.count("connects"))
+    event.listen(engine, "checkout", lambda *args: pool_metrics.count("checkouts"))
+    event.listen(engine, "checkin", lambda *args: pool_metrics.count("checkins"))
+    event.listen(
+        engine, "invalidate", lambda *args: pool_metrics.count("invalidations")
+    )
+    # Statement counts and timings, per request and overall (see metrics.py)
+    event.listen(engine, "before_cursor_execute", metrics.before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", metrics.after_cursor_execute)
+    event.listen(engine, "handle_error", metrics.handle_error)
+
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    """
+    Keyword arguments for create_engine / create_async_engine, from the settings above.
+    """
+    options = {}
+    connect_args = {}
+    in_memory = url.startswith("sqlite") and (url.endswith("://") or ":memory:" in url)
+    if not in_memory:
+        options.update(
+            poolclass=TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+    if url.startswith("sqlite"):
+        if SQLITE_SHARED_CACHE and not in_memory:
+            connect_args.update(uri=True)
+    elif DB_STATEMENT_TIMEOUT_MS:
+        if is_async:
+            connect_args["server_settings"] = {
+                "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)
+            }
+        else:
+            connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def sqlite_url(url: str) -> str:
+    # Shared cache needs the database opened through a URI filename
+    if not (url.startswith("sqlite") and SQLITE_SHARED_CACHE):
+        return url
+    scheme, path = url.split(":///", 1)
+    if path.startswith("file:") or path in ("", ":memory:"):
+        return url
+    return f"{scheme}:///file:{path}?cache=shared&uri=true"
+
+
+def create_db_engine(url: str) -> Engine:
+    engine = create_engine(sqlite_url(url), **engine_options(url))
+    if url.startswith("sqlite"):
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    _instrument(engine)
+    return engine
+
+
+# The engines are created on first use, normally by the lifespan handler in
+# startup.py rather than on import, so importing the app neither loads the
+# database driver nor needs DATABASE_URL to be reachable
+_engine = None
+_engine_lock = threading.Lock()
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
 
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    if DATABASE_URL.startswith("sqlite"):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
-        cursor.close()
+def get_engine() -> Engine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_db_engine(DATABASE_URL)
+            SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+# With DATABASE_ASYNC set, the read routes in routers/async_reads.py are served
+# through an AsyncSession (asyncpg for Postgres, aiosqlite for SQLite) instead of
+# taking up a threadpool worker while they wait on the database.
+ASYNC_DATABASE = _env_flag("DATABASE_ASYNC", False)
 
+ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+
+_async_engine = None
+AsyncSessionLocal = None
+
+
+def get_async_engine():
+    """
+    The async engine, or None unless DATABASE_ASYNC is set.
+    """
+    global _async_engine, AsyncSessionLocal
+    if not ASYNC_DATABASE:
+        return None
+    with _engine_lock:
+        if _async_engine is None:
+            _async_engine = create_async_db_engine(DATABASE_URL)
+            AsyncSessionLocal = async_session_factory(_async_engine)
+    return _async_engine
 
-def init_db():
-    # This creates the tables in the database if they do not exist
-    Base.metadata.create_all(bind=engine)
+
+def create_async_db_engine(url: str):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(
+        sqlite_url(async_database_url(url)), **engine_options(url, is_async=True)
+    )
+    if url.startswith("sqlite"):
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    _instrument(engine.sync_engine)
+    return engine
+
+
+def async_session_factory(engine):
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    # Results are serialized after the session is done with them, so don't
+    # expire (and lazily reload) them on commit
+    return async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+
+def prewarm_pool(engine: Engine, size: int):
+    """
+    Open up to `size` pooled connections at once and put them back, so the first
+    requests don't pay for connecting.
+    """
+    if not isinstance(engine.pool, QueuePool) or size <= 0:
+        return
+    with ThreadPoolExecutor(size) as executor:
+        connections = list(executor.map(lambda _: engine.connect(), range(size)))
+    for connection in connections:
+        connection.close()
+
+
+async def prewarm_async_pool(engine, size: int):
+    if not isinstance(engine.pool, QueuePool) or size <= 0:
+        return
+    # Awaiting an AsyncConnection opens it
+    connections = await asyncio.gather(*(engine.connect() for _ in range(size)))
+    await asyncio.gather(*(connection.close() for connection in connections))
+
+
+async def dispose_engines():
+    global _engine, _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
 
 
 def get_db():
@@ -44,6 +319,11 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def authenticate_query_param(secret_key: str = Query(..., alias="secret_key")):
     """
     This dependency checks if the query parameter matches the expected secret key from the environment variable.
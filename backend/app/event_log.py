@@ -0,0 +1,121 @@
+import heapq
+from datetime import datetime
+from itertools import islice
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session, aliased
+
+from . import crud, models, utils
+
+# Rows are pulled from the database in chunks of this size while streaming
+CHUNK_SIZE = 500
+
+BET_CREATION = "bet_creation"
+BET_RESOLUTION = "bet_resolution"
+
+
+def event_key(event):
+    # Events are ordered by date, then bet, with a bet's creation before its resolution
+    return event["event_date"], event["id"], event["type"]
+
+
+def event_cursor(event) -> str:
+    return utils.encode_cursor(*event_key(event))
+
+
+def parse_event_cursor(token: str):
+    date, bet_id, event_type = utils.decode_cursor(token, 3)
+    if (
+        not isinstance(date, datetime)
+        or not isinstance(bet_id, int)
+        or event_type not in (BET_CREATION, BET_RESOLUTION)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return date, bet_id, event_type
+
+
+def _bets_by(db: Session, bets, date_field, since, until, limit):
+    date_column = getattr(bets, date_field)
+    bettor = aliased(models.User)
+    bettee = aliased(models.User)
+    query = (
+        db.query(
+            bets.id,
+            date_column,
+            bets.shots,
+            bets.description,
+            bettor.name,
+            bettee.name,
+        )
+        .join(bettor, bets.bettor_id == bettor.id)
+        .join(bettee, bets.bettee_id == bettee.id)
+        .filter(date_column.isnot(None))
+    )
+    if since is not None:
+        query = query.filter(date_column >= since)
+    if until is not None:
+        query = query.filter(date_column < until)
+    query = query.order_by(date_column, bets.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.yield_per(CHUNK_SIZE)
+
+
+def creation_events(db: Session, since=None, until=None, limit=None, bets=models.Bet):
+    rows = _bets_by(db, bets, "created_at", since, until, limit)
+    for bet_id, date, shots, description, bettor_name, bettee_name in rows:
+        yield {
+            "id": bet_id,
+            "type": BET_CREATION,
+            "event_date": date,
+            "description": f"{bettor_name} bet {bettee_name} {shots} shot(s): "
+            f"{description}",
+        }
+
+
+def resolution_events(db: Session, since=None, until=None, limit=None, bets=models.Bet):
+    rows = _bets_by(db, bets, "resolved_at", since, until, limit)
+    for bet_id, date, shots, description, bettor_name, bettee_name in rows:
+        yield {
+            "id": bet_id,
+            "type": BET_RESOLUTION,
+            "event_date": date,
+            "description": f"{bettor_name} called {shots} shot(s) on {bettee_name}",
+        }
+
+
+def iter_events(
+    db: Session,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    include_archived: bool = False,
+):
+    """
+    Yield events in date order, oldest first, from `since` (inclusive) up to
+    `until` (exclusive). `after` is the cursor of the last event a client has seen;
+    only later events are yielded. Archived bets only with `include_archived`.
+
+    Creation and resolution events each come from their own indexed, ordered
+    query and are merged as they stream, so nothing is sorted or held in memory.
+    """
+    after_key = None
+    if after:
+        after_key = parse_event_cursor(after)
+        if since is None or after_key[0] > since:
+            since = after_key[0]
+
+    # Neither query needs more than `limit` rows, unless some are skipped because
+    # they share the cursor's date. Either way rows are only read as they're consumed.
+    fetch = limit if after_key is None else None
+    bets = crud.bet_source(include_archived)
+    events = heapq.merge(
+        creation_events(db, since, until, fetch, bets),
+        resolution_events(db, since, until, fetch, bets),
+        key=event_key,
+    )
+    if after_key is not None:
+        events = (event for event in events if event_key(event) > after_key)
+    return islice(events, limit)
@@ -0,0 +1,128 @@
+"""
+Opt-in fast path for the big list responses, turned on with FAST_RESPONSES=1.
+
+The routes using it select plain rows instead of ORM instances, shape them into
+the same dicts their response models would produce and serialize them straight
+to JSON with orjson (or the json module if orjson isn't installed), skipping
+response model validation and jsonable_encoder. Bodies of COMPRESS_MIN_SIZE bytes
+or more are compressed with brotli (if installed) or gzip, when the client
+accepts it.
+"""
+
+import gzip
+import json
+import os
+from datetime import date, datetime
+
+from fastapi import Request, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FAST_RESPONSES = os.getenv("FAST_RESPONSES", "false").lower() in ("1", "true", "yes")
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+
+# Keys of schemas.Bet and schemas.BetDetail, in the order the models output them
+BET_FIELDS = (
+    "bettor_id",
+    "bettee_id",
+    "shots",
+    "description",
+    "id",
+    "date_created",
+    "outcome",
+    "bettee_name",
+    "bettor_name",
+)
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    # Same output as FastAPI's JSONResponse
+    return json.dumps(
+        value,
+        default=_default,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def bet_dicts(rows):
+    """
+    schemas.Bet shaped dicts from rows with the Bet columns, and optionally
+    `bettor_name` and `bettee_name`.
+    """
+    if not rows:
+        return []
+    # Look the columns up by position once, rather than by name on every row
+    columns = rows[0]._fields
+    positions = [
+        columns.index(field) if field in columns else None for field in BET_FIELDS
+    ]
+    return [
+        dict(
+            zip(
+                BET_FIELDS,
+                [None if position is None else row[position] for position in positions],
+            )
+        )
+        for row in rows
+    ]
+
+
+def bet_detail_dicts(rows):
+    """
+    schemas.BetDetail shaped dicts from rows with the Bet columns plus
+    `counterparty_id` and `counterparty_name`.
+    """
+    return [
+        {
+            "id": row.id,
+            "shots": row.shots,
+            "description": row.description,
+            "outcome": row.outcome,
+            "date_created": row.date_created,
+            "counterparty": {"id": row.counterparty_id, "name": row.counterparty_name},
+        }
+        for row in rows
+    ]
+
+
+def _accepts(request: Request, coding: str) -> bool:
+    for accepted in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = accepted.partition(";")
+        if name.strip() == coding and params.replace(" ", "") != "q=0":
+            return True
+    return False
+
+
+def json_response(request: Request, body: bytes, headers=None) -> Response:
+    """
+    A JSON response for an already serialized `body`, compressed if it is big
+    enough and the client accepts brotli or gzip.
+    """
+    headers = dict(headers or {})
+    if len(body) >= COMPRESS_MIN_SIZE:
+        headers["Vary"] = "Accept-Encoding"
+        if brotli is not None and _accepts(request, "br"):
+            body = brotli.compress(body, quality=4)
+            headers["Content-Encoding"] = "br"
+        elif _accepts(request, "gzip"):
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type="application/json", headers=headers)
@@ -0,0 +1,373 @@
+import threading
+import uuid
+from collections import deque
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .fast_responses import dumps
+
+
+def bet_edge(bet: models.Bet):
+    return {
+        "from": bet.bettor_id,
+        "to": bet.bettee_id,
+        "value": bet.shots,
+        "reason": bet.description,
+        "outcome": bet.outcome,
+        "dateCreated": bet.date_created,
+        "id": bet.id,
+    }
+
+
+class ShotGraph:
+    """
+    Materialized version of the /data/graph payload.
+
+    The graph is built from the database once, then kept up to date by the
+    bet and user mutation routes calling the `bet_saved`, `bet_deleted`,
+    `user_saved` and `user_deleted` hooks after they commit. Every change bumps
+    `version`, which clients can use to skip payloads they already have.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Identifies this process' copy of the graph, so versions from
+        # different workers (or restarts) never look alike to clients
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._built = False
+        self._reset()
+
+    def _reset(self):
+        self._nodes = {}  # user id -> {"id", "name"}
+        self._edges = {}  # bet id -> edge
+        self._bet_counts = {}  # user id -> number of bets the user is part of
+        self._shots_owed_by_user = {}
+        self._shots_owed_to_user = {}
+        # user id -> {counterparty id:
+        #     [bets, shots, open shots owed, open shots owed to]}
+        self._adjacency = {}
+        self._payload = None
+        self._body = None  # (version, payload serialized to JSON)
+        self._derived = {}  # results of whole-graph queries, kept until the next change
+
+    def etag(self, version: int):
+        return f'"{self.epoch}-{version}"'
+
+    def build(self, db: Session):
+        with self._lock:
+            self._reset()
+            for bet in crud.get_bet_rows(db):
+                self._add_node(bet.bettor_id, bet.bettor_name)
+                self._add_node(bet.bettee_id, bet.bettee_name)
+                self._add(bet_edge(bet))
+            self._built = True
+            self.version += 1
+
+    def invalidate(self):
+        # Forces a full rebuild on the next read
+        with self._lock:
+            self._built = False
+            self._reset()
+            self.version += 1
+
+    def ensure_built(self, db: Session):
+        with self._lock:
+            if not self._built:
+                self.build(db)
+
+    def snapshot(self, db: Session):
+        """
+        Return `(version, payload)`, building the graph first if needed.
+        """
+        with self._lock:
+            if not self._built:
+                self.build(db)
+            if self._payload is None:
+                self._payload = self._render()
+            return self.version, self._payload
+
+    def body(self):
+        """
+        `(version, JSON body)` of the current graph if it has been serialized, or None.
+        """
+        body = self._body
+        if body is not None and body[0] == self.version:
+            return body
+        return None
+
+    def snapshot_body(self, db: Session):
+        # Serialized outside the lock, so changes aren't held up by it
+        version, payload = self.snapshot(db)
+        body = (version, dumps(jsonable_encoder(payload)))
+        with self._lock:
+            if self.version == version:
+                self._body = body
+        return body
+
+    # Mutation hooks
+
+    def bet_saved(self, bet: models.Bet):
+        with self._lock:
+            if not self._built:
+                return
+            if bet.bettor_id is None or bet.bettee_id is None:
+                # Left behind by a deleted user, so not part of the graph
+                self.bet_deleted(bet.id)
+                return
+            self._add_node(bet.bettor_id, bet.bettor.name)
+            self._add_node(bet.bettee_id, bet.bettee.name)
+            self._add(bet_edge(bet))
+            self._changed()
+
+    def bet_deleted(self, bet_id: int):
+        with self._lock:
+            if not self._built:
+                return
+            if self._remove(bet_id):
+                self._changed()
+
+    def user_saved(self, user: models.User):
+        with self._lock:
+            if self._built and user.id in self._nodes:
+                self._nodes[user.id] = {"id": user.id, "name": user.name}
+                self._changed()
+
+    def user_deleted(self, user_id: int):
+        with self._lock:
+            if self._built and user_id in self._nodes:
+                self.invalidate()
+
+    def leaderboard_rows(self, user_ids):
+        """
+        Current leaderboard rows for the given users. Users that dropped out of the
+        graph come back as `{"id": ..., "removed": True}`.
+        """
+        with self._lock:
+            return [
+                (
+                    self._leaderboard_row(user_id)
+                    if user_id in self._nodes
+                    else {"id": user_id, "removed": True}
+                )
+                for user_id in dict.fromkeys(user_ids)
+            ]
+
+    # Queries, answered from the adjacency index without touching the database
+
+    def has_user(self, db: Session, user_id: int):
+        with self._lock:
+            self.ensure_built(db)
+            return user_id in self._nodes
+
+    def neighbors(self, db: Session, user_id: int):
+        """
+        Everyone `user_id` has a bet with, and what is open between them.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            return [
+                {
+                    **self._nodes[other_id],
+                    "bets": bets,
+                    "shots": shots,
+                    "shotsOwed": owed,
+                    "shotsOwedTo": owed_to,
+                }
+                for other_id, (bets, shots, owed, owed_to) in sorted(
+                    self._adjacency.get(user_id, {}).items()
+                )
+            ]
+
+    def reachable(self, db: Session, user_id: int, hops: int):
+        """
+        Users within `hops` bets of `user_id`, nearest first.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            distances = {user_id: 0}
+            queue = deque([user_id])
+            while queue:
+                current = queue.popleft()
+                if distances[current] == hops:
+                    continue
+                for other_id in self._adjacency.get(current, ()):
+                    if other_id not in distances:
+                        distances[other_id] = distances[current] + 1
+                        queue.append(other_id)
+            del distances[user_id]
+            return [
+                {**self._nodes[other_id], "distance": distance}
+                for other_id, distance in sorted(
+                    distances.items(), key=lambda item: (item[1], item[0])
+                )
+            ]
+
+    def owes_path(self, db: Session, source_id: int, target_id: int):
+        """
+        Shortest chain of open debts from `source_id` to `target_id` (each user owes
+        shots to the next), or None if there isn't one.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            previous = {source_id: None}
+            queue = deque([source_id])
+            while queue and target_id not in previous:
+                current = queue.popleft()
+                for other_id, link in self._adjacency.get(current, {}).items():
+                    if link[2] > 0 and other_id not in previous:
+                        previous[other_id] = current
+                        queue.append(other_id)
+            if target_id not in previous:
+                return None
+
+            path = [target_id]
+            while previous[path[-1]] is not None:
+                path.append(previous[path[-1]])
+            path.reverse()
+            return [
+                (
+                    {
+                        **self._nodes[user_id],
+                        "shotsOwedToNext": self._adjacency[user_id][next_id][2],
+                    }
+                    if next_id is not None
+                    else dict(self._nodes[user_id])
+                )
+                for user_id, next_id in zip(path, path[1:] + [None])
+            ]
+
+    def components(self, db: Session):
+        """
+        Groups of users connected by bets, largest first.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            if "components" not in self._derived:
+                seen = set()
+                components = []
+                for start in self._nodes:
+                    if start in seen:
+                        continue
+                    seen.add(start)
+                    members = [start]
+                    for current in members:
+                        for other_id in self._adjacency.get(current, ()):
+                            if other_id not in seen:
+                                seen.add(other_id)
+                                members.append(other_id)
+                    components.append(sorted(members))
+                components.sort(key=lambda members: (-len(members), members[0]))
+                self._derived["components"] = [
+                    {"size": len(members), "users": members} for members in components
+                ]
+            return self._derived["components"]
+
+    def centrality(self, db: Session, metric: str):
+        """
+        Users ranked by `metric`: "degree" (distinct counterparties) or "weighted"
+        (shots across all their bets).
+        """
+        with self._lock:
+            self.ensure_built(db)
+            key = ("centrality", metric)
+            if key not in self._derived:
+                rows = [
+                    {
+                        **node,
+                        "degree": len(self._adjacency.get(user_id, ())),
+                        "weighted": sum(
+                            link[1]
+                            for link in self._adjacency.get(user_id, {}).values()
+                        ),
+                    }
+                    for user_id, node in self._nodes.items()
+                ]
+                rows.sort(key=lambda row: (-row[metric], row["id"]))
+                self._derived[key] = rows
+            return self._derived[key]
+
+    # Internals
+
+    def _leaderboard_row(self, user_id):
+        return {
+            "id": user_id,
+            "name": self._nodes[user_id]["name"],
+            "totalShotsOwed": self._shots_owed_by_user.get(user_id, 0),
+            "totalShotsOwedTo": self._shots_owed_to_user.get(user_id, 0),
+        }
+
+    def _changed(self):
+        self.version += 1
+        self._payload = None
+        self._body = None
+        self._derived = {}
+
+    def _add_node(self, user_id, name):
+        if user_id not in self._nodes:
+            self._nodes[user_id] = {"id": user_id, "name": name}
+
+    def _add(self, edge):
+        # Count the new edge before dropping the one it replaces, so users
+        # that stay in the graph keep their position
+        previous = self._edges.get(edge["id"])
+        self._edges[edge["id"]] = edge
+        self._count(edge, 1)
+        if previous is not None:
+            self._count(previous, -1)
+
+    def _remove(self, bet_id):
+        edge = self._edges.pop(bet_id, None)
+        if edge is None:
+            return False
+        self._count(edge, -1)
+        return True
+
+    def _count(self, edge, sign):
+        bettor_id, bettee_id, shots = edge["from"], edge["to"], edge["value"]
+        self._shots_owed_by_user.setdefault(bettor_id, 0)
+        self._shots_owed_to_user.setdefault(bettee_id, 0)
+        # Resolved bets don't count towards the leaderboard
+        owed = 0 if edge["outcome"] else sign * shots
+        self._shots_owed_by_user[bettor_id] += owed
+        self._shots_owed_to_user[bettee_id] += owed
+
+        if bettor_id != bettee_id:
+            for user_id, other_id, owes, is_owed in (
+                (bettor_id, bettee_id, owed, 0),
+                (bettee_id, bettor_id, 0, owed),
+            ):
+                links = self._adjacency.setdefault(user_id, {})
+                link = links.setdefault(other_id, [0, 0, 0, 0])
+                link[0] += sign
+                link[1] += sign * shots
+                link[2] += owes
+                link[3] += is_owed
+                if link[0] == 0:
+                    del links[other_id]
+                    if not links:
+                        del self._adjacency[user_id]
+
+        for user_id in (bettor_id, bettee_id):
+            self._bet_counts[user_id] = self._bet_counts.get(user_id, 0) + sign
+            if self._bet_counts[user_id] == 0:
+                del self._bet_counts[user_id]
+                self._nodes.pop(user_id, None)
+                self._shots_owed_by_user.pop(user_id, None)
+                self._shots_owed_to_user.pop(user_id, None)
+
+    def _render(self):
+        leaderboard = [self._leaderboard_row(user_id) for user_id in self._nodes]
+        leaderboard.sort(key=lambda user: user["totalShotsOwedTo"], reverse=True)
+
+        return {
+            "version": self.version,
+            "nodes": list(self._nodes.values()),
+            "edges": list(self._edges.values()),
+            "leaderboard": leaderboard,
+        }
+
+
+shot_graph = ShotGraph()
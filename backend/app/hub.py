@@ -0,0 +1,61 @@
+import asyncio
+import json
+import threading
+
+from fastapi.encoders import jsonable_encoder
+
+
+class Hub:
+    """
+    In-process pub/sub for the live feed.
+
+    Subscribers are asyncio queues owned by the event loop serving the streaming
+    responses. `publish` is called from the (threadpool) mutation routes, encodes
+    the message once and hands it to the loop, which fans it out to every queue.
+    A subscriber that falls `queue_size` messages behind has its backlog replaced
+    by a single `resync` message, so one slow client can't hold memory hostage.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._loop = None
+        self._lock = threading.Lock()
+        self.sequence = 0
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event_type: str, data):
+        if not self._subscribers or self._loop is None:
+            return
+        with self._lock:
+            self.sequence += 1
+            message = (self.sequence, event_type, json.dumps(jsonable_encoder(data)))
+        try:
+            self._loop.call_soon_threadsafe(self._fan_out, message)
+        except RuntimeError:
+            # The loop has been closed (e.g. on shutdown)
+            self._loop = None
+
+    def _fan_out(self, message):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait((message[0], "resync", "{}"))
+
+
+hub = Hub()
@@ -0,0 +1,306 @@
+"""
+Keeps the expensive aggregate routes (/data/graph and /data/events) cheap when
+many clients ask for them at once, e.g. dashboards refreshing together:
+- single flight: concurrent requests for the same result share one
+  computation (`Coalescer`, which the response cache uses for every route)
+- stale-while-revalidate: for up to STALE_WHILE_REVALIDATE_SECONDS after a
+  result goes out of date, readers get the previous one while it is
+  recomputed in the background. Clients that just wrote something (see
+  replicas.py) always wait for a fresh one. 0, the default, turns this off.
+- a concurrency budget: at most EXPENSIVE_CONCURRENCY of these computations
+  run at once; one that can't start within EXPENSIVE_WAIT_MS is shed with a
+  503, or served the previous result if there is one
+- per-client rate limits: RATE_LIMIT_PER_MINUTE requests to these routes per
+  client, in bursts of up to RATE_LIMIT_BURST (default 10), over that a 429.
+  A RATE_LIMIT_PER_MINUTE of 0, the default, turns this off. Clients are
+  told apart by address, or by the first value of RATE_LIMIT_CLIENT_HEADER
+  (e.g. X-Forwarded-For) behind a proxy.
+
+Everything is per worker, and counted on /stats/limits and /metrics.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+from fastapi import HTTPException, Request
+
+STALE_WHILE_REVALIDATE_SECONDS = float(os.getenv("STALE_WHILE_REVALIDATE_SECONDS", 0))
+EXPENSIVE_CONCURRENCY = int(os.getenv("EXPENSIVE_CONCURRENCY", 4))
+EXPENSIVE_WAIT_MS = float(os.getenv("EXPENSIVE_WAIT_MS", 2000))
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", 0))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", 10))
+RATE_LIMIT_CLIENT_HEADER = os.getenv("RATE_LIMIT_CLIENT_HEADER")
+# Clients whose buckets are remembered, least recently seen dropped first
+RATE_LIMIT_CLIENTS = int(os.getenv("RATE_LIMIT_CLIENTS", 10000))
+
+logger = logging.getLogger("app.limits")
+
+COUNTERS = ("requests", "computed", "coalesced", "stale_served", "shed", "rate_limited")
+
+
+class LimitStats:
+    # Counters per route (or cache namespace: the part of a key before the first ":")
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def count(self, name: str, counter: str, amount: int = 1):
+        with self._lock:
+            counts = self._counts.setdefault(name, dict.fromkeys(COUNTERS, 0))
+            counts[counter] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+    def render(self):
+        # Prometheus text format, appended to /metrics
+        lines = []
+        for counter in COUNTERS:
+            name = f"app_expensive_{counter}_total"
+            lines += [
+                f"# HELP {name} Expensive route {counter.replace('_', ' ')}.",
+                f"# TYPE {name} counter",
+            ]
+            lines += [
+                f'{name}{{route="{route}"}} {counts[counter]}'
+                for route, counts in sorted(self.snapshot().items())
+            ]
+        return "\n".join(lines) + "\n"
+
+
+limit_stats = LimitStats()
+
+
+class Overloaded(HTTPException):
+    def __init__(self):
+        super().__init__(
+            503, "Too busy, try again shortly", headers={"Retry-After": "1"}
+        )
+
+
+class ConcurrencyBudget:
+    def __init__(self, slots: int, wait_ms: float):
+        self.slots = slots
+        self.wait_seconds = wait_ms / 1000
+        self._semaphore = threading.BoundedSemaphore(slots) if slots > 0 else None
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold one of the slots while the block runs, or raise Overloaded if none
+        frees up in time.
+        """
+        if self._semaphore is None:
+            yield
+            return
+        if not self._semaphore.acquire(timeout=self.wait_seconds):
+            raise Overloaded()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+expensive_budget = ConcurrencyBudget(EXPENSIVE_CONCURRENCY, EXPENSIVE_WAIT_MS)
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Coalescer:
+    """
+    Runs a computation once for all the callers asking for it at the same time.
+
+    A computation is identified by a key and a token saying which version of
+    the data it is for (a cache generation, the graph version), so callers
+    that come after a change never join one that started before it. Keys run
+    with `stale_for` also keep their last result, for stale-while-revalidate.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # (key, token) -> _Flight
+        # key -> [last result, monotonic time it went out of date or None]
+        self._stale = {}
+        self._async_flights = {}
+
+    def run(
+        self,
+        key: str,
+        token,
+        compute,
+        stale_for: float = 0,
+        budget: ConcurrencyBudget = None,
+    ):
+        """
+        `compute()`'s result for `(key, token)`. With `stale_for`, the previous
+        result for `key` is returned instead of waiting for a new one, for up
+        to `stale_for` seconds after it first went out of date; the first of
+        these callers starts the computation in the background. Then `compute`
+        runs after the request is over, so it must not use the request's session.
+        """
+        name = key.split(":", 1)[0]
+        now = time.monotonic()
+        with self._lock:
+            flight = self._flights.get((key, token))
+            leader = flight is None
+            if leader:
+                flight = self._flights[(key, token)] = _Flight()
+            stale = self._stale.get(key) if stale_for else None
+            if stale is not None and stale[1] is None:
+                stale[1] = now
+
+        if stale is not None and now - stale[1] < stale_for:
+            if leader:
+                threading.Thread(
+                    target=self._fly,
+                    args=(name, key, token, flight, compute, budget, True, True),
+                    name=f"revalidate-{name}",
+                    daemon=True,
+                ).start()
+            limit_stats.count(name, "stale_served")
+            return stale[0]
+
+        if leader:
+            self._fly(name, key, token, flight, compute, budget, bool(stale_for), False)
+        else:
+            limit_stats.count(name, "coalesced")
+            flight.done.wait()
+        if flight.error is not None:
+            if isinstance(flight.error, Overloaded) and stale is not None:
+                limit_stats.count(name, "stale_served")
+                return stale[0]
+            raise flight.error
+        return flight.value
+
+    def _fly(self, name, key, token, flight, compute, budget, keep, background):
+        try:
+            with budget.slot() if budget is not None else nullcontext():
+                flight.value = compute()
+            limit_stats.count(name, "computed")
+            if keep:
+                with self._lock:
+                    self._stale[key] = [flight.value, None]
+        except Overloaded as error:
+            limit_stats.count(name, "shed")
+            flight.error = error
+        except Exception as error:
+            if background:
+                # Readers keep getting the previous result until it is too old to
+                # serve, then compute it themselves
+                logger.exception("Recomputing %s in the background failed", key)
+            flight.error = error
+        finally:
+            with self._lock:
+                self._flights.pop((key, token), None)
+            flight.done.set()
+
+    async def run_async(self, key: str, token, compute):
+        # Single flight for an async `compute`, shared by the callers on this event loop
+        name = key.split(":", 1)[0]
+        flight = self._async_flights.get((key, token))
+        if flight is None:
+            flight = asyncio.ensure_future(compute())
+            self._async_flights[(key, token)] = flight
+            flight.add_done_callback(
+                lambda _: self._async_flights.pop((key, token), None)
+            )
+            limit_stats.count(name, "computed")
+        else:
+            limit_stats.count(name, "coalesced")
+        # A caller going away doesn't cancel the computation for the others
+        return await asyncio.shield(flight)
+
+
+flights = Coalescer()
+
+
+def stale_for(request: Request) -> float:
+    # How stale a result this client can be given
+    from .replicas import is_sticky
+
+    return 0 if is_sticky(request) else STALE_WHILE_REVALIDATE_SECONDS
+
+
+class RateLimiter:
+    """
+    A token bucket per client: `per_minute` requests a minute on average, and up
+    to `burst` at once.
+    """
+
+    def __init__(
+        self, per_minute: float, burst: int, max_clients: int = RATE_LIMIT_CLIENTS
+    ):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        # client -> [tokens, monotonic time of last update]
+        self._buckets = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def take(self, client: str) -> float:
+        """
+        Take a token for `client`: 0 if it had one, otherwise the seconds until it will.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(client, None) or [self.burst, now]
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / self.rate
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+
+
+def client_key(request: Request) -> str:
+    if RATE_LIMIT_CLIENT_HEADER:
+        forwarded = request.headers.get(RATE_LIMIT_CLIENT_HEADER)
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def expensive(route: str):
+    """
+    Dependency for an expensive route: counts its requests and applies the
+    per-client rate limit.
+    """
+
+    def check(request: Request):
+        limit_stats.count(route, "requests")
+        if not rate_limiter.enabled:
+            return
+        retry_after = rate_limiter.take(client_key(request))
+        if retry_after:
+            limit_stats.count(route, "rate_limited")
+            raise HTTPException(
+                429,
+                "Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    return check
@@ -1,16 +1,18 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
+from fastapi.responses import PlainTextResponse
 
-from .database import init_db
-from .routers import users, bets, data
+from .cache import response_cache
+from .metrics import MetricsMiddleware, metrics
+from .replicas import StickyReadsMiddleware, replica_set
+from .database import ASYNC_DATABASE, get_async_engine, get_engine, pool_stats
+from .limits import limit_stats
+from .shared_state import shared_state
+from .startup import lifespan, startup_timings
+from .routers import users, bets, data, live, sync
 
-
-load_dotenv()
-
-from fastapi import FastAPI
-
-app = FastAPI()
+# Engines, migrations and warming up happen in the lifespan handler (see startup.py)
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
@@ -20,16 +22,76 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Read-Primary-Until"],
 )
 
+# Sends clients' reads to the primary for a while after they write (see replicas.py)
+app.add_middleware(StickyReadsMiddleware)
+
+# Added last so it wraps everything else, CORS included
+app.add_middleware(MetricsMiddleware)
+
+if ASYNC_DATABASE:
+    # Registered first, so its async handlers win over the sync routes they mirror
+    from .routers import async_reads
+
+    app.include_router(async_reads.router)
+
 app.include_router(users.router)
 app.include_router(bets.router)
 app.include_router(data.router)
+app.include_router(live.router)
+app.include_router(sync.router)
 
 
-@app.on_event("startup")
-def on_startup():
-    init_db()
+app.get("/")(lambda: {"message": "Welcome to the betting API!"})
 
 
-app.get("/")(lambda: {"message": "Welcome to the betting API!"})
+@app.get("/stats/pool")
+def get_pool_stats():
+    # The sync and async engines each have a pool, and counters, of their own
+    stats = pool_stats(get_engine().pool)
+    async_engine = get_async_engine()
+    if async_engine is not None:
+        stats["async_pool"] = pool_stats(async_engine.pool)
+    return stats
+
+
+@app.get("/stats/replicas")
+def get_replica_stats():
+    # Reads served by each replica, and by the primary instead (and why)
+    return replica_set.stats()
+
+
+@app.get("/stats/cache")
+def get_cache_stats():
+    # Hits and misses of the response cache, per kind of cached response
+    return response_cache.stats.snapshot()
+
+
+@app.get("/stats/limits")
+def get_limit_stats():
+    # Coalesced, stale, shed and rate limited requests, per route or cache namespace
+    return limit_stats.snapshot()
+
+
+@app.get("/stats/startup")
+def get_startup_stats():
+    # How long this worker took to start, per phase, in milliseconds
+    return {
+        phase: round(seconds * 1000, 1) for phase, seconds in startup_timings.items()
+    }
+
+
+@app.get("/stats/shared")
+def get_shared_state_stats():
+    # Changes published to and applied from the other workers
+    return shared_state.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(
+        metrics.render() + limit_stats.render(), media_type="text/plain; version=0.0.4"
+    )
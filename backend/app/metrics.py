@@ -0,0 +1,257 @@
+"""
+Request and SQL instrumentation, served in the Prometheus text format on /metrics.
+
+MetricsMiddleware times every request per route template and counts the SQL
+statements it issued, so an N+1 regression shows up as a jump in
+`http_request_sql_statements` for one route. The cursor hooks that database.py
+installs on its engines time every statement, attribute it to the request being
+served (through a context variable) and log those slower than SLOW_QUERY_MS, with
+the bound parameter values redacted down to their types.
+
+With SERVER_TIMING=1 every response also carries a Server-Timing header with the
+time spent in the database and in the app so far.
+"""
+
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+
+from starlette.datastructures import MutableHeaders
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger("app.sql")
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label_names, buckets):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # labels -> [count per bucket..., sum, count]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            label_text = ",".join(
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.label_names, labels)
+            )
+            prefix = label_text + "," if label_text else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-1]}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_duration = Histogram(
+            "http_request_duration_seconds",
+            "Time to serve a request, by route template.",
+            ("method", "route", "status"),
+            LATENCY_BUCKETS,
+        )
+        self.request_statements = Histogram(
+            "http_request_sql_statements",
+            "SQL statements issued while serving a request, by route template.",
+            ("method", "route"),
+            STATEMENT_BUCKETS,
+        )
+        self.statement_duration = Histogram(
+            "db_statement_duration_seconds",
+            "Time to execute a SQL statement, by kind of statement.",
+            ("operation",),
+            LATENCY_BUCKETS,
+        )
+        self.slow_statements = 0
+        self.startup_seconds = {}  # phase -> seconds, set once by startup.py
+
+    def observe_request(self, method, route, status, seconds, stats):
+        with self._lock:
+            self.request_duration.observe((method, route, str(status)), seconds)
+            self.request_statements.observe((method, route), stats.statements)
+
+    def observe_statement(self, operation, seconds, slow):
+        with self._lock:
+            self.statement_duration.observe((operation,), seconds)
+            if slow:
+                self.slow_statements += 1
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for histogram in (
+                self.request_duration,
+                self.request_statements,
+                self.statement_duration,
+            ):
+                lines += histogram.render()
+            lines += [
+                "# HELP db_slow_statements_total "
+                "SQL statements slower than SLOW_QUERY_MS.",
+                "# TYPE db_slow_statements_total counter",
+                f"db_slow_statements_total {self.slow_statements}",
+            ]
+            if self.startup_seconds:
+                lines += [
+                    "# HELP app_startup_seconds "
+                    "Time spent in each phase of this worker's startup.",
+                    "# TYPE app_startup_seconds gauge",
+                ]
+                lines += [
+                    f'app_startup_seconds{{phase="{phase}"}} {round(seconds, 6)}'
+                    for phase, seconds in self.startup_seconds.items()
+                ]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class RequestStats:
+    # Shared by everything that runs for one request, threadpool included
+    __slots__ = ("statements", "sql_seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+
+# SQLAlchemy cursor hooks, installed on the engines by database.py
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _statement_done(conn, statement, parameters)
+
+
+def handle_error(exception_context):
+    # Failed statements are timed too, so the start times don't pile up
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        _statement_done(conn, exception_context.statement, exception_context.parameters)
+
+
+_OPERATION = re.compile(r"\s*(\w+)")
+
+
+def _statement_done(conn, statement, parameters):
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    slow = seconds * 1000 >= SLOW_QUERY_MS
+    match = _OPERATION.match(statement or "")
+    metrics.observe_statement(
+        match.group(1).upper() if match else "OTHER", seconds, slow
+    )
+
+    stats = _current_request.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.sql_seconds += seconds
+    if slow:
+        logger.warning(
+            "Slow query (%.1f ms): %s parameters=%s",
+            seconds * 1000,
+            " ".join((statement or "").split()),
+            redact(parameters),
+        )
+
+
+def redact(parameters):
+    """
+    `parameters` with every value replaced by its type name, so logs never carry
+    user data.
+    """
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany: just say how many rows there were
+            return f"<{len(parameters)} parameter sets>"
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware feeding `metrics` (and the Server-Timing header). Written
+    against raw ASGI rather than BaseHTTPMiddleware so streamed responses pass
+    straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    elapsed = (time.perf_counter() - start) * 1000
+                    headers = MutableHeaders(scope=message)
+                    headers.append(
+                        "Server-Timing",
+                        f"db;dur={stats.sql_seconds * 1000:.1f};"
+                        f'desc="{stats.statements} queries", '
+                        f"app;dur={elapsed:.1f}",
+                    )
+                    headers.append("Timing-Allow-Origin", "*")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_request.reset(token)
+            metrics.observe_request(
+                scope["method"],
+                self._route(scope),
+                status,
+                time.perf_counter() - start,
+                stats,
+            )
+
+    def _route(self, scope):
+        # The router leaves the matched route in the scope; label by its path
+        # template, not the raw path, to keep the number of series bounded
+        return getattr(scope.get("route"), "path", None) or "unmatched"
@@ -0,0 +1,169 @@
+"""
+Schema revisions that `Base.metadata.create_all` can't apply to a database
+that already has the tables.
+
+Every step checks what is already there, so `upgrade` is safe to run against
+a live database, more than once, and while older workers are still writing.
+Run it by hand with `python -m app.migrations`, which creates missing tables
+too. Deployments with MIGRATE_ON_STARTUP=0 run it once per release, before
+starting the workers, instead of having every worker do it on boot.
+"""
+
+from sqlalchemy import MetaData, bindparam, inspect, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable
+
+from . import change_log, models, search
+
+bets = models.Bet.__table__
+
+
+def _add_missing_columns(engine: Engine, table, names):
+    existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    with engine.begin() as conn:
+        for name in names:
+            if name in existing:
+                continue
+            column_type = table.c[name].type.compile(dialect=engine.dialect)
+            conn.execute(
+                text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}")
+            )
+
+
+def _create_missing_indexes(engine: Engine, table):
+    existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+    # On Postgres the indexes are built CONCURRENTLY so writes to the table aren't
+    # blocked meanwhile. That can't happen inside a transaction, hence AUTOCOMMIT.
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            index.dialect_options["postgresql"]["concurrently"] = True
+            try:
+                index.create(conn)
+            finally:
+                index.dialect_options["postgresql"]["concurrently"] = False
+
+
+def backfill_bet_status(engine: Engine, batch_size: int = 1000):
+    """
+    Fill in `created_at`, `status` and `resolved_at` from the string columns
+    for rows that don't have them yet, one short transaction per batch.
+    Returns the number of rows updated.
+    """
+    select_batch = (
+        select(bets.c.id, bets.c.date_created, bets.c.outcome)
+        .where(bets.c.status.is_(None))
+        .order_by(bets.c.id)
+        .limit(batch_size)
+    )
+    update_row = (
+        update(bets)
+        .where(bets.c.id == bindparam("bet_id"))
+        .values(
+            created_at=bindparam("created_at"),
+            status=bindparam("status"),
+            resolved_at=bindparam("resolved_at"),
+        )
+    )
+
+    updated = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select_batch).all()
+            if not rows:
+                return updated
+            params = []
+            for bet_id, date_created, outcome in rows:
+                try:
+                    status, resolved_at = models.parse_outcome(outcome)
+                except ValueError:
+                    # Unreadable resolution dates still mean the bet was resolved
+                    status, resolved_at = models.BetStatus.resolved, None
+                params.append(
+                    {
+                        "bet_id": bet_id,
+                        "created_at": date_created,
+                        "status": status,
+                        "resolved_at": resolved_at,
+                    }
+                )
+            conn.execute(update_row, params)
+            updated += len(rows)
+
+
+def rebuild_bets_with_autoincrement(engine: Engine):
+    """
+    SQLite only: recreate a `bets` table made without AUTOINCREMENT with it.
+    Without it SQLite hands the ids of the newest bets out again once they are
+    deleted or archived. SQLite can't add it to an existing table, so the rows
+    are copied into a new one, in one transaction that holds the write lock.
+    Triggers using `bets` are dropped with it and created again; the indexes
+    are created by `upgrade` afterwards.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    # Transactions are begun by hand, so the DDL is part of them too
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            schema = conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'bets'"
+            ).scalar()
+            if schema is None or "AUTOINCREMENT" in schema.upper():
+                conn.exec_driver_sql("COMMIT")
+                return
+            triggers = conn.exec_driver_sql(
+                "SELECT name, sql FROM sqlite_master "
+                "WHERE type = 'trigger' AND sql LIKE '%bets%'"
+            ).all()
+            for name, _ in triggers:
+                conn.exec_driver_sql(f'DROP TRIGGER "{name}"')
+            copy = MetaData()
+            models.User.__table__.to_metadata(copy)
+            conn.execute(CreateTable(bets.to_metadata(copy, name="bets_rebuild")))
+            columns = ", ".join(column.name for column in bets.c)
+            conn.exec_driver_sql(
+                f"INSERT INTO bets_rebuild ({columns}) SELECT {columns} FROM bets"
+            )
+            conn.exec_driver_sql("DROP TABLE bets")
+            conn.exec_driver_sql("ALTER TABLE bets_rebuild RENAME TO bets")
+            # Ids already archived count as handed out too
+            conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'bets'")
+            conn.exec_driver_sql("""
+                INSERT INTO sqlite_sequence (name, seq) SELECT 'bets', max(
+                    coalesce((SELECT max(id) FROM bets), 0),
+                    coalesce((SELECT max(id) FROM archived_bets), 0)
+                )
+                """)
+            for _, statement in triggers:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql("COMMIT")
+        except Exception:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+
+
+def upgrade(engine: Engine):
+    # Native timestamp and status columns for bets, then the indexes using them
+    _add_missing_columns(engine, bets, ["created_at", "status", "resolved_at"])
+    # Bet ids that are never reused. Copies the table, so it comes before its indexes
+    rebuild_bets_with_autoincrement(engine)
+    backfill_bet_status(engine)
+    _create_missing_indexes(engine, bets)
+    # Full-text index over descriptions and names, for /bets/search
+    search.install(engine)
+    # The users and bets from before the change log, for /sync
+    change_log.backfill(engine)
+
+
+def migrate(engine: Engine):
+    # New tables first, then the revisions to the tables that were already there
+    models.Base.metadata.create_all(bind=engine)
+    upgrade(engine)
+
+
+if __name__ == "__main__":
+    from .database import get_engine
+
+    migrate(get_engine())
@@ -1,8 +1,18 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Integer,
+    String,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+)
 from sqlalchemy.types import TypeDecorator, String
 from sqlalchemy.orm import relationship
 from .database import Base
 from datetime import datetime
+import enum
 
 
 class SQLiteDateTime(TypeDecorator):
@@ -12,6 +22,7 @@ class SQLiteDateTime(TypeDecorator):
     """
 
     impl = String
+    cache_ok = True
 
     def process_bind_param(self, value, dialect):
         # Convert Python datetime to ISO 8601 string without fractional seconds
@@ -20,9 +31,10 @@ class SQLiteDateTime(TypeDecorator):
         return value
 
     def process_result_value(self, value, dialect):
-        # Convert ISO 8601 string to Python datetime
+        # Convert ISO 8601 string to Python datetime. Values are always written in
+        # the format above, which fromisoformat reads many times faster than strptime
         if isinstance(value, str):
-            return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
+            return datetime.fromisoformat(value)
         return value
 
 
@@ -30,6 +42,10 @@ def utcnow_str():
     return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
 
 
+def utcnow():
+    return datetime.utcnow().replace(microsecond=0)
+
+
 def convert_iso_str_to_sqllite_datetime_str(iso_str) -> str:
     try:
         # First, attempt to parse as ISO 8601 format
@@ -44,6 +60,39 @@ def convert_iso_str_to_sqllite_datetime_str(iso_str) -> str:
     return dt.strftime("%Y-%m-%dT%H:%M:%S")
 
 
+class BetStatus(str, enum.Enum):
+    open = "open"
+    resolved = "resolved"
+    incomplete = "incomplete"
+    expired = "expired"
+
+
+def parse_outcome(outcome):
+    """
+    Split a bet outcome into `(status, resolved_at)`. Outcomes are either empty,
+    a status word or the date the shots were called.
+    """
+    if not outcome:
+        return BetStatus.open, None
+    if outcome.lower() in (BetStatus.incomplete.value, BetStatus.expired.value):
+        return BetStatus(outcome.lower()), None
+    resolved_at = datetime.strptime(
+        convert_iso_str_to_sqllite_datetime_str(outcome), "%Y-%m-%dT%H:%M:%S"
+    )
+    return BetStatus.resolved, resolved_at
+
+
+def outcome_values(outcome):
+    """
+    Column values for storing an outcome: the outcome string (resolution dates in
+    the SQLite time format) along with the status and resolution time it implies.
+    """
+    status, resolved_at = parse_outcome(outcome)
+    if resolved_at:
+        outcome = resolved_at.strftime("%Y-%m-%dT%H:%M:%S")
+    return {"outcome": outcome, "status": status, "resolved_at": resolved_at}
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -70,7 +119,93 @@ class Bet(Base):
     description = Column(String)
     outcome = Column(String)
 
+    # Native, indexable versions of `date_created` and `outcome`. The string
+    # columns are still what the API returns; these are what queries sort and
+    # filter on. See app/migrations.py for how existing rows get them.
+    created_at = Column(DateTime, default=utcnow, index=True)
+    status = Column(
+        Enum(BetStatus, native_enum=False, length=16), default=BetStatus.open
+    )
+    resolved_at = Column(DateTime, nullable=True, index=True)
+
     bettor = relationship("User", back_populates="bets_made", foreign_keys=[bettor_id])
     bettee = relationship(
         "User", back_populates="bets_received", foreign_keys=[bettee_id]
     )
+
+    __table_args__ = (
+        Index("ix_bets_bettor_id_created_at", bettor_id, created_at),
+        Index("ix_bets_bettee_id_created_at", bettee_id, created_at),
+        # Ids of deleted and archived bets are never handed out again
+        {"sqlite_autoincrement": True},
+    )
+
+    def set_outcome(self, outcome):
+        # Keeps `status` and `resolved_at` in step with the outcome string
+        for key, value in outcome_values(outcome).items():
+            setattr(self, key, value)
+
+
+class ArchivedBet(Base):
+    """
+    Bets settled long enough ago to be moved out of `bets` (see app/archive.py).
+    Same columns and ids as Bet; history reads can union the two.
+    """
+
+    __tablename__ = "archived_bets"
+
+    id = Column(Integer, primary_key=True)
+    date_created = Column(SQLiteDateTime)
+    bettor_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+    bettee_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+    shots = Column(Integer)
+    description = Column(String)
+    outcome = Column(String)
+    created_at = Column(DateTime, index=True)
+    status = Column(Enum(BetStatus, native_enum=False, length=16))
+    resolved_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=utcnow)
+
+    __table_args__ = (
+        Index("ix_archived_bets_bettor_id_created_at", bettor_id, created_at),
+        Index("ix_archived_bets_bettee_id_created_at", bettee_id, created_at),
+    )
+
+
+class ArchivedBetTotal(Base):
+    """
+    Number of bets and shots each bettor has bet each bettee in the archive, so
+    lifetime totals don't have to read the archived bets themselves.
+    """
+
+    __tablename__ = "archived_bet_totals"
+
+    bettor_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    bettee_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+    bets = Column(Integer, default=0)
+    shots = Column(Integer, default=0)
+
+
+class ChangeLogEntry(Base):
+    """
+    One user or bet saved or deleted, appended in the same transaction as the
+    change (see app/change_log.py). `seq` only ever goes up.
+    """
+
+    __tablename__ = "change_log"
+
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String(8), nullable=False)  # "user" or "bet"
+    entity_id = Column(Integer, nullable=False)
+    deleted = Column(Boolean, nullable=False, default=False)
+    changed_at = Column(DateTime, default=utcnow)
+
+    # AUTOINCREMENT, so SQLite never hands out a sequence number twice
+    __table_args__ = {"sqlite_autoincrement": True}
@@ -0,0 +1,344 @@
+"""
+Read replicas for the read-only routes.
+
+DATABASE_REPLICA_URLS lists replicas of DATABASE_URL, comma separated. Routes
+that only read take their session from `get_read_db` (or its async and cached
+variants), which hands out sessions on the replicas in turn instead of the
+primary. A replica may be up to REPLICA_MAX_LAG_SECONDS behind, so:
+- read-your-writes: a client that changed something reads from the primary
+  for the next REPLICA_STICKY_SECONDS. StickyReadsMiddleware marks it with a
+  cookie, and with an X-Read-Primary-Until header for clients that don't keep
+  cookies and send the header back themselves.
+- reads whose result outlives the request (the response cache and the
+  in-memory graph, columns, stats and settlements, which changes.py only
+  patches from then on) use `get_cached_read_db`: it stays on the primary
+  until this worker has gone REPLICA_MAX_LAG_SECONDS without seeing a change,
+  so nothing older than a change already applied is kept.
+- a replica that can't be reached, or on Postgres is further behind than
+  REPLICA_MAX_LAG_SECONDS, is left out for REPLICA_RETRY_SECONDS. With no
+  healthy replica, reads go to the primary.
+
+Writes always go to the primary. Without replicas every session is on the primary.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from functools import partial
+
+from fastapi import Request
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from starlette.datastructures import MutableHeaders
+
+from . import database
+from .database import (
+    ASYNC_DATABASE,
+    SessionLocal,
+    async_session_factory,
+    create_async_db_engine,
+    create_db_engine,
+    pool_stats,
+    prewarm_async_pool,
+    prewarm_pool,
+)
+
+DATABASE_REPLICA_URLS = [
+    url.strip()
+    for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+    if url.strip()
+]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+REPLICA_STICKY_SECONDS = float(
+    os.getenv("REPLICA_STICKY_SECONDS", REPLICA_MAX_LAG_SECONDS)
+)
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", 10))
+# How often a Postgres replica's lag is measured, at most
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", 1))
+
+STICKY_COOKIE = "read_primary_until"
+STICKY_HEADER = "X-Read-Primary-Until"
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Seconds since the last replayed transaction, or 0 when there is nothing left
+# to replay (or this isn't a standby at all)
+POSTGRES_LAG = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+            OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """)
+
+logger = logging.getLogger("app.replicas")
+
+
+class ReplicaBehind(Exception):
+    pass
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine = create_db_engine(url)
+        self.Session = sessionmaker(bind=self.engine, autocommit=False, autoflush=False)
+        self.async_engine = None
+        self.AsyncSession = None
+        if ASYNC_DATABASE:
+            self.async_engine = create_async_db_engine(url)
+            self.AsyncSession = async_session_factory(self.async_engine)
+        # SQLite has no way to tell; its replicas are trusted to keep up
+        self.measures_lag = self.engine.dialect.name == "postgresql"
+        self.lag_seconds = None
+        self.lag_checked_at = 0.0
+        self.down_until = 0.0
+        self.reads = 0
+        self.failures = 0
+
+
+def is_sticky(request: Request) -> bool:
+    # Whether the client wrote something recently enough to read from the primary
+    until = request.headers.get(STICKY_HEADER) or request.cookies.get(STICKY_COOKIE)
+    try:
+        return float(until) > time.time()
+    except (TypeError, ValueError):
+        return False
+
+
+class ReplicaSet:
+    def __init__(self, urls):
+        self.urls = urls
+        self._replicas = None
+        self._lock = threading.Lock()
+        self._turn = 0
+        self._changed_at = float("-inf")
+        self.primary_reads = {"sticky": 0, "recent_change": 0, "unavailable": 0}
+
+    @property
+    def enabled(self):
+        return bool(self.urls)
+
+    def replicas(self):
+        # Engines are created on first use, like the primary's
+        with self._lock:
+            if self._replicas is None:
+                self._replicas = [Replica(url) for url in self.urls]
+                for replica in self._replicas:
+                    engines = [replica.engine]
+                    if replica.async_engine is not None:
+                        engines.append(replica.async_engine.sync_engine)
+                    for engine in engines:
+                        event.listen(
+                            engine, "handle_error", partial(self._on_error, replica)
+                        )
+        return self._replicas
+
+    def saw_change(self):
+        # Called by changes.py for every change, made here or by another worker
+        self._changed_at = time.monotonic()
+
+    def _route(self, request: Request, cached: bool):
+        """
+        `(replicas to try in turn, why the read goes to the primary if none works)`.
+        """
+        if is_sticky(request):
+            return [], "sticky"
+        if cached and time.monotonic() - self._changed_at < REPLICA_MAX_LAG_SECONDS:
+            return [], "recent_change"
+        replicas = self.replicas()
+        with self._lock:
+            start = self._turn
+            self._turn = (start + 1) % len(replicas)
+        now = time.monotonic()
+        ordered = replicas[start:] + replicas[:start]
+        return [
+            replica for replica in ordered if replica.down_until <= now
+        ], "unavailable"
+
+    def _lag_due(self, replica: Replica):
+        return (
+            replica.measures_lag
+            and time.monotonic() - replica.lag_checked_at >= REPLICA_LAG_CHECK_SECONDS
+        )
+
+    def _check_lag(self, replica: Replica, lag):
+        replica.lag_seconds = float(lag or 0)
+        replica.lag_checked_at = time.monotonic()
+        if replica.lag_seconds > REPLICA_MAX_LAG_SECONDS:
+            raise ReplicaBehind(f"{replica.lag_seconds:.1f} seconds behind")
+
+    def _failed(self, replica: Replica, error):
+        with self._lock:
+            replica.failures += 1
+            replica.down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+        logger.warning(
+            "Leaving out replica %s for %.0f s: %s",
+            replica.name,
+            REPLICA_RETRY_SECONDS,
+            error,
+        )
+
+    def _on_error(self, replica: Replica, context):
+        # A replica that drops connections mid-query is left out straight away
+        if context.is_disconnect:
+            self._failed(replica, context.original_exception)
+
+    def _served(self, replica: Replica = None, reason: str = None):
+        with self._lock:
+            if replica is not None:
+                replica.reads += 1
+            else:
+                self.primary_reads[reason] += 1
+
+    def session(self, request: Request, cached: bool = False) -> Session:
+        """
+        A session for a read-only route, on a healthy replica if the read may
+        go to one. The connection is checked out (and the lag measured) here,
+        so a dead replica is skipped before the route runs.
+        """
+        if not self.enabled:
+            return SessionLocal()
+        replicas, reason = self._route(request, cached)
+        for replica in replicas:
+            db = replica.Session()
+            try:
+                connection = db.connection()
+                if self._lag_due(replica):
+                    self._check_lag(replica, connection.execute(POSTGRES_LAG).scalar())
+            except Exception as error:
+                db.close()
+                self._failed(replica, error)
+                continue
+            self._served(replica)
+            return db
+        self._served(reason=reason)
+        return SessionLocal()
+
+    async def async_session(self, request: Request, cached: bool = False):
+        # Same as session, for the async routes
+        if not self.enabled:
+            return database.AsyncSessionLocal()
+        replicas, reason = self._route(request, cached)
+        for replica in replicas:
+            db = replica.AsyncSession()
+            try:
+                connection = await db.connection()
+                if self._lag_due(replica):
+                    self._check_lag(
+                        replica, (await connection.execute(POSTGRES_LAG)).scalar()
+                    )
+            except Exception as error:
+                await db.close()
+                self._failed(replica, error)
+                continue
+            self._served(replica)
+            return db
+        self._served(reason=reason)
+        return database.AsyncSessionLocal()
+
+    async def prewarm(self, size: int):
+        # An unreachable replica doesn't hold up startup, it is just left out
+        for replica in self.replicas() if self.enabled else []:
+            try:
+                prewarm_pool(replica.engine, size)
+                if replica.async_engine is not None:
+                    await prewarm_async_pool(replica.async_engine, size)
+            except Exception as error:
+                self._failed(replica, error)
+
+    async def dispose(self):
+        with self._lock:
+            replicas, self._replicas = self._replicas or [], None
+        for replica in replicas:
+            if replica.async_engine is not None:
+                await replica.async_engine.dispose()
+            replica.engine.dispose()
+
+    def stats(self):
+        now = time.monotonic()
+        replicas = []
+        for replica in self._replicas or []:
+            stats = {
+                "replica": replica.name,
+                "healthy": replica.down_until <= now,
+                "lag_seconds": replica.lag_seconds,
+                "reads": replica.reads,
+                "failures": replica.failures,
+            }
+            if isinstance(replica.engine.pool, QueuePool):
+                stats["pool"] = {
+                    key: value
+                    for key, value in pool_stats(replica.engine.pool).items()
+                    if key in ("size", "checked_out", "overflow", "idle")
+                }
+            replicas.append(stats)
+        with self._lock:
+            return {"replicas": replicas, "primary_reads": dict(self.primary_reads)}
+
+
+replica_set = ReplicaSet(DATABASE_REPLICA_URLS)
+
+
+def get_read_db(request: Request):
+    db = replica_set.session(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_cached_read_db(request: Request):
+    # For routes that cache what they read, or build in-memory state from it
+    db = replica_set.session(request, cached=True)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request):
+    async with await replica_set.async_session(request) as db:
+        yield db
+
+
+async def get_async_cached_read_db(request: Request):
+    async with await replica_set.async_session(request, cached=True) as db:
+        yield db
+
+
+class StickyReadsMiddleware:
+    """
+    Marks the response to every successful write, so the client's reads go to
+    the primary for the next REPLICA_STICKY_SECONDS.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] in READ_METHODS
+            or not replica_set.enabled
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_marked(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                until = f"{time.time() + REPLICA_STICKY_SECONDS:.3f}"
+                headers = MutableHeaders(scope=message)
+                headers.append(STICKY_HEADER, until)
+                headers.append(
+                    "Set-Cookie",
+                    f"{STICKY_COOKIE}={until}; "
+                    f"Max-Age={math.ceil(REPLICA_STICKY_SECONDS)}; "
+                    "Path=/; HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_marked)
@@ -0,0 +1,200 @@
+"""
+Async versions of the busiest read routes, used when DATABASE_ASYNC is set.
+
+main.py includes this router ahead of the others, so these handlers take over
+the matching paths. Everything else, including all writes (which also update
+in-process state), keeps going through the sync routers.
+"""
+
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import async_crud, models, schemas
+from ..cache import response_cache
+from ..replicas import get_async_cached_read_db, get_async_read_db
+from .users import BetFilters
+
+router = APIRouter()
+
+
+async def _get_user_or_404(db: AsyncSession, user_id: int):
+    db_user = await async_crud.get_user(db, user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
+@router.get("/users/", response_model=List[schemas.User], tags=["users"])
+async def read_users(
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    users, next_cursor = await async_crud.get_users(
+        db, skip=skip, limit=limit, cursor=cursor
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return users
+
+
+@router.get("/users/{user_id}", response_model=schemas.User, tags=["users"])
+async def read_user(user_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    return await _get_user_or_404(db, user_id)
+
+
+@router.get("/users/{user_id}/shot-balances", response_model=dict, tags=["users"])
+async def get_user_shot_balances(
+    user_id: int, db: AsyncSession = Depends(get_async_read_db)
+):
+    db_user = await _get_user_or_404(db, user_id)
+    shot_balances = await async_crud.user_shot_balances(db, user_id)
+    return {
+        "balance": shot_balances,
+        "user": {"id": db_user.id, "name": db_user.name, "email": db_user.email},
+    }
+
+
+async def _user_bets(db, response, user_id, role, counterparty, cursor, filters):
+    await _get_user_or_404(db, user_id)
+    bets, next_cursor = await async_crud.get_bets(
+        db,
+        limit=filters.limit,
+        cursor=cursor,
+        status=filters.status,
+        created_after=filters.created_after,
+        created_before=filters.created_before,
+        include_archived=filters.include_archived,
+        **{role: user_id, counterparty: filters.counterparty_id},
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return bets
+
+
+@router.get(
+    "/users/{user_id}/bets-owed", response_model=List[schemas.Bet], tags=["users"]
+)
+async def get_user_bets_owed(
+    user_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    filters: BetFilters = Depends(),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    # Bets where the user is the bettor (owes shots)
+    return await _user_bets(
+        db, response, user_id, "bettor_id", "bettee_id", cursor, filters
+    )
+
+
+@router.get(
+    "/users/{user_id}/bets-owned", response_model=List[schemas.Bet], tags=["users"]
+)
+async def get_user_bets_owned(
+    user_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    filters: BetFilters = Depends(),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    # Bets where the user is the bettee (is owed shots)
+    return await _user_bets(
+        db, response, user_id, "bettee_id", "bettor_id", cursor, filters
+    )
+
+
+@router.get(
+    "/users/{user_id}/related-users", response_model=List[schemas.User], tags=["users"]
+)
+async def get_related_users(
+    user_id: int, db: AsyncSession = Depends(get_async_cached_read_db)
+):
+    async def load():
+        await _get_user_or_404(db, user_id)
+        return await async_crud.get_related_users(db, user_id)
+
+    return await response_cache.get_or_set_async(
+        f"related-users:{user_id}", [f"user:{user_id}"], load
+    )
+
+
+@router.get("/bets/search", response_model=List[schemas.Bet], tags=["bets"])
+async def search_bets(
+    q: str,
+    response: Response,
+    limit: int = Query(20, ge=1),
+    cursor: Optional[str] = None,
+    user_id: Optional[int] = None,
+    status: Optional[models.BetStatus] = None,
+    bettor_id: Optional[int] = None,
+    bettee_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    bets, next_cursor = await async_crud.search_bets(
+        db,
+        q,
+        limit=limit,
+        cursor=cursor,
+        user_id=user_id,
+        status=status,
+        bettor_id=bettor_id,
+        bettee_id=bettee_id,
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return bets
+
+
+@router.get("/bets/{bet_id}", response_model=schemas.Bet, tags=["bets"])
+async def read_bet(bet_id: int, db: AsyncSession = Depends(get_async_cached_read_db)):
+    async def load():
+        db_bet = await async_crud.get_bet_with_names(db, bet_id)
+        if not db_bet:
+            raise HTTPException(status_code=404, detail="Bet not found")
+        return db_bet
+
+    return await response_cache.get_or_set_async(
+        f"bet:{bet_id}", [f"bet:{bet_id}"], load
+    )
+
+
+@router.get("/bets/", response_model=List[schemas.Bet], tags=["bets"])
+async def read_bets(
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    status: Optional[models.BetStatus] = None,
+    bettor_id: Optional[int] = None,
+    bettee_id: Optional[int] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    include_archived: bool = False,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    bets, next_cursor = await async_crud.get_bets(
+        db,
+        skip=skip,
+        limit=limit,
+        cursor=cursor,
+        status=status,
+        bettor_id=bettor_id,
+        bettee_id=bettee_id,
+        created_after=created_after,
+        created_before=created_before,
+        include_archived=include_archived,
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return bets
+
+
+@router.get("/data/leaderboard", response_model=list, tags=["data"])
+async def get_leaderboard(db: AsyncSession = Depends(get_async_read_db)):
+    return await async_crud.leaderboard(db)
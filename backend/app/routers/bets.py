@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session, aliased
-from typing import List
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.orm import Session
+from typing import List, Optional
 
-from .. import schemas, crud, models
+from .. import schemas, crud, models, changes, change_log
+from ..cache import response_cache
 from ..database import authenticate_query_param, get_db
+from ..fast_responses import FAST_RESPONSES, bet_dicts, dumps, json_response
+from ..replicas import get_cached_read_db, get_read_db
 
 router = APIRouter(
     prefix="/bets",
@@ -11,79 +15,210 @@ router = APIRouter(
 )
 
 
+def _found(bet) -> bool:
+    # Bets left behind by a deleted user are gone as far as the API is concerned
+    return bet is not None and bet.bettor_id is not None and bet.bettee_id is not None
+
+
 @router.post("/", response_model=schemas.Bet)
 def create_bet(
     bet: schemas.BetCreate,
     db: Session = Depends(get_db),
 ):
     # Bettor and bettee must both exist
-    bettor = crud.get_user(db, bet.bettor_id)
-    bettee = crud.get_user(db, bet.bettee_id)
-    if not bettor or not bettee:
+    users = crud.get_users_by_ids(db, [bet.bettor_id, bet.bettee_id])
+    if bet.bettor_id not in users or bet.bettee_id not in users:
         raise HTTPException(status_code=404, detail="Bettor or Bettee not found")
 
-    return crud.create_bet(db=db, bet=bet)
+    db_bet = crud.create_bet(db=db, bet=bet)
+    changes.bet_created(db, db_bet)
+    return db_bet
 
 
-@router.get("/{bet_id}", response_model=schemas.Bet)
-def read_bet(bet_id: int, db: Session = Depends(get_db)):
-    # Aliases for the bettor and bettee users
-    bettor_alias = aliased(models.User)
-    bettee_alias = aliased(models.User)
-
-    # Join with aliased user tables
-    db_bet = (
-        db.query(
-            models.Bet,
-            bettor_alias.name.label("bettor_name"),
-            bettee_alias.name.label("bettee_name"),
-        )
-        .join(bettor_alias, models.Bet.bettor_id == bettor_alias.id)
-        .join(bettee_alias, models.Bet.bettee_id == bettee_alias.id)
-        .filter(models.Bet.id == bet_id)
-        .first()
+@router.post("/bulk", response_model=schemas.BulkResult)
+def create_bets(
+    bets: List[schemas.BetCreate],
+    db: Session = Depends(get_db),
+):
+    """
+    Create many bets in one transaction. Bets whose bettor or bettee doesn't exist
+    are reported in `results` and skipped; the others are created together.
+    """
+    users = crud.get_users_by_ids(
+        db, [user_id for bet in bets for user_id in (bet.bettor_id, bet.bettee_id)]
+    )
+    results = []
+    valid = []
+    for index, bet in enumerate(bets):
+        if bet.bettor_id not in users or bet.bettee_id not in users:
+            results.append(
+                schemas.BulkItemResult(index=index, error="Bettor or Bettee not found")
+            )
+        else:
+            valid.append((index, bet))
+
+    bet_ids = crud.create_bets(db, [bet for _, bet in valid])
+    for (index, _), bet_id in zip(valid, bet_ids):
+        results.append(schemas.BulkItemResult(index=index, id=bet_id))
+
+    created = crud.get_bets_by_ids(db, bet_ids)
+    with changes.batch():
+        for bet_id in bet_ids:
+            changes.bet_created(db, created[bet_id])
+
+    results.sort(key=lambda result: result.index)
+    return schemas.BulkResult(
+        succeeded=len(bet_ids), failed=len(bets) - len(bet_ids), results=results
     )
 
-    if not db_bet:
-        raise HTTPException(status_code=404, detail="Bet not found")
 
-    # Unpack the result and format response
-    bet, bettor_name, bettee_name = db_bet
-    formatted_bet = {
-        "id": bet.id,
-        "date_created": bet.date_created,
-        "shots": bet.shots,
-        "description": bet.description,
-        "outcome": bet.outcome,
-        "bettor_id": bet.bettor_id,
-        "bettor_name": bettor_name,
-        "bettee_id": bet.bettee_id,
-        "bettee_name": bettee_name,
-    }
+@router.post("/bulk-resolve", response_model=schemas.BulkResult)
+def resolve_bets(
+    resolutions: List[schemas.BetResolve],
+    db: Session = Depends(get_db),
+):
+    """
+    Set the outcome (and optionally the shots) of many bets in one transaction.
+    Unknown bets and unreadable outcomes are reported in `results` and skipped.
+    """
+    existing = crud.get_bets_by_ids(db, [resolution.id for resolution in resolutions])
+    results = []
+    valid = []
+    for index, resolution in enumerate(resolutions):
+        if not _found(existing.get(resolution.id)):
+            results.append(
+                schemas.BulkItemResult(
+                    index=index, id=resolution.id, error="Bet not found"
+                )
+            )
+            continue
+        try:
+            values = models.outcome_values(resolution.outcome)
+        except ValueError as error:
+            results.append(
+                schemas.BulkItemResult(index=index, id=resolution.id, error=str(error))
+            )
+            continue
+        valid.append((resolution.id, values, resolution.shots))
+        results.append(schemas.BulkItemResult(index=index, id=resolution.id))
+
+    crud.resolve_bets(db, valid)
+
+    # Reload the resolved bets in one query for the change hooks
+    resolved = crud.get_bets_by_ids(db, [bet_id for bet_id, _, _ in valid])
+    with changes.batch():
+        for bet in resolved.values():
+            changes.bet_updated(db, bet)
+
+    return schemas.BulkResult(
+        succeeded=len(valid), failed=len(resolutions) - len(valid), results=results
+    )
 
-    return formatted_bet
+
+# Declared before /{bet_id}, which would take "search" for a bet id
+@router.get("/search", response_model=List[schemas.Bet])
+def search_bets(
+    q: str,
+    response: Response,
+    limit: int = Query(20, ge=1),
+    cursor: Optional[str] = None,
+    user_id: Optional[int] = None,
+    status: Optional[models.BetStatus] = None,
+    bettor_id: Optional[int] = None,
+    bettee_id: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+):
+    """
+    Bets whose description or bettor's or bettee's name contain all the words
+    in `q`, best match first. `user_id` keeps the bets a user is on either side
+    of. Pass the X-Next-Cursor header of one page as `cursor` to get the next.
+    """
+    bets, next_cursor = crud.search_bets(
+        db,
+        q,
+        limit=limit,
+        cursor=cursor,
+        user_id=user_id,
+        status=status,
+        bettor_id=bettor_id,
+        bettee_id=bettee_id,
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return bets
+
+
+@router.get("/{bet_id}", response_model=schemas.Bet)
+def read_bet(bet_id: int, db: Session = Depends(get_cached_read_db)):
+    def load():
+        db_bet = crud.get_bet_with_names(db, bet_id)
+        if not db_bet:
+            raise HTTPException(status_code=404, detail="Bet not found")
+        return db_bet
+
+    # Invalidated through the bet's tag, which every change to it (or to its
+    # bettor's and bettee's names) hits
+    return response_cache.get_or_set(f"bet:{bet_id}", [f"bet:{bet_id}"], load)
 
 
 @router.get("/", response_model=List[schemas.Bet])
-def read_bets(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    bets = crud.get_bets(db, skip=skip, limit=limit)
+def read_bets(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    status: Optional[models.BetStatus] = None,
+    bettor_id: Optional[int] = None,
+    bettee_id: Optional[int] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    include_archived: bool = False,
+    db: Session = Depends(get_read_db),
+):
+    # Bets are ordered by creation date. Pass the X-Next-Cursor header of one page
+    # as `cursor` to get the next one. Archived bets are left out unless asked for.
+    bets, next_cursor = crud.get_bets(
+        db,
+        skip=skip,
+        limit=limit,
+        cursor=cursor,
+        status=status,
+        bettor_id=bettor_id,
+        bettee_id=bettee_id,
+        created_after=created_after,
+        created_before=created_before,
+        include_archived=include_archived,
+        as_rows=FAST_RESPONSES,
+    )
+    if FAST_RESPONSES:
+        return json_response(
+            request,
+            dumps(bet_dicts(bets)),
+            {"X-Next-Cursor": next_cursor} if next_cursor else None,
+        )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return bets
 
 
 @router.put("/{bet_id}", response_model=schemas.Bet)
 def update_bet(bet_id: int, bet: schemas.BetUpdate, db: Session = Depends(get_db)):
     db_bet = crud.get_bet(db, bet_id)
-    if not db_bet:
+    if not _found(db_bet):
         raise HTTPException(status_code=404, detail="Bet not found")
 
-    for key, value in bet.dict().items():
-        attr_value = value
-        if key == "outcome" and value.lower() != "incomplete":
-            # Convert the outcome value to SQLite time field format
-            attr_value = models.convert_iso_str_to_sqllite_datetime_str(value)
-        setattr(db_bet, key, attr_value)
+    # Leaving out the shots keeps them as they are, like /bets/bulk-resolve
+    for key, value in bet.dict(exclude_none=True).items():
+        if key == "outcome":
+            # Stores the outcome along with the status and resolution time it implies
+            db_bet.set_outcome(value)
+        else:
+            setattr(db_bet, key, value)
+    change_log.record(db, change_log.BET, [bet_id])
     db.commit()
     db.refresh(db_bet)
+    changes.bet_updated(db, db_bet)
 
     return db_bet
 
@@ -97,6 +232,9 @@ def delete_bet(
     db_bet = crud.get_bet(db, bet_id)
     if not db_bet:
         raise HTTPException(status_code=404, detail="Bet not found")
+    bettor_id, bettee_id = db_bet.bettor_id, db_bet.bettee_id
     db.delete(db_bet)
+    change_log.record(db, change_log.BET, [bet_id], deleted=True)
     db.commit()
+    changes.bet_deleted(db, bet_id, bettor_id, bettee_id)
     return {"message": "Bet deleted successfully"}
@@ -1,9 +1,15 @@
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date, datetime
+import json
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from .. import schemas, crud, models
-from ..database import get_db
+from typing import Optional
+from .. import crud, models, aggregates, event_log, stats
+from ..cache import response_cache
+from ..graph import shot_graph
+from ..limits import expensive, expensive_budget, flights, stale_for
+from ..replicas import get_cached_read_db, replica_set
+from ..settlements import settlement_book
 
 router = APIRouter(
     prefix="/data",
@@ -11,87 +17,139 @@ router = APIRouter(
 )
 
 
-def get_shot_relationships_graph(db: Session):
-    # Get all bets
-    bets = db.query(models.Bet).all()
+@router.get("/graph", response_model=dict, dependencies=[Depends(expensive("graph"))])
+def get_user_shot_relationships(request: Request):
+    # The graph is materialized in memory and only rebuilt when it is invalidated,
+    # and serialized once per version, however many clients ask for it meanwhile.
+    # Clients that send back the ETag of the version they hold get a 304.
+    def serialize():
+        with replica_set.session(request, cached=True) as db:
+            return shot_graph.snapshot_body(db)
 
-    # Create nodes (users) and edges (shot relationships)
-    nodes = {}
-    edges = []
+    body = shot_graph.body() or flights.run(
+        "graph", shot_graph.version, serialize, stale_for(request), expensive_budget
+    )
+    version, content = body
+    etag = shot_graph.etag(version)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content, media_type="application/json", headers={"ETag": etag})
 
-    # Dictionary to track shots owed and shots owed to each user
-    shots_owed_by_user = {}
-    shots_owed_to_user = {}
 
-    # Build the graph data
-    for bet in bets:
-        # Add users as nodes if they don't already exist
-        if bet.bettor_id not in nodes:
-            user = db.query(models.User).filter(models.User.id == bet.bettor_id).first()
-            nodes[bet.bettor_id] = {"id": bet.bettor_id, "name": user.name}
+def _check_user(db: Session, user_id: int):
+    # Users without bets aren't in the graph, so only those hit the database
+    if not shot_graph.has_user(db, user_id) and crud.get_user(db, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
 
-        if bet.bettee_id not in nodes:
-            user = db.query(models.User).filter(models.User.id == bet.bettee_id).first()
-            nodes[bet.bettee_id] = {"id": bet.bettee_id, "name": user.name}
 
-        # Add edges (shots between users)
-        edges.append(
-            {
-                "from": bet.bettor_id,
-                "to": bet.bettee_id,
-                "value": bet.shots,
-                "reason": bet.description,
-                "outcome": bet.outcome,
-                "dateCreated": bet.date_created,
-                "id": bet.id,
-            }
-        )
+@router.get("/graph/neighbors/{user_id}", response_model=list)
+def get_graph_neighbors(user_id: int, db: Session = Depends(get_cached_read_db)):
+    _check_user(db, user_id)
+    return shot_graph.neighbors(db, user_id)
 
-        # Update shot counts for leaderboard
-        if bet.bettor_id not in shots_owed_by_user:
-            shots_owed_by_user[bet.bettor_id] = 0
-        if bet.bettee_id not in shots_owed_to_user:
-            shots_owed_to_user[bet.bettee_id] = 0
-
-        # Skip over bets that have been resolved
-        if bet.outcome:
-            continue
-        shots_owed_by_user[bet.bettor_id] += bet.shots
-        shots_owed_to_user[bet.bettee_id] += bet.shots
-
-    # Convert nodes from dict to a list for better JSON structure
-    nodes_list = list(nodes.values())
-
-    # Build the leaderboard based on shots owed
-    leaderboard = []
-    for user_id, node in nodes.items():
-        leaderboard.append(
-            {
-                "id": user_id,
-                "name": node["name"],
-                "totalShotsOwed": shots_owed_by_user.get(user_id, 0),
-                "totalShotsOwedTo": shots_owed_to_user.get(user_id, 0),
-            }
-        )
 
-    # Sort the leaderboard by the total number of shots owed to the user
-    leaderboard.sort(key=lambda user: user["totalShotsOwedTo"], reverse=True)
+@router.get("/graph/reachable/{user_id}", response_model=list)
+def get_graph_reachable(
+    user_id: int,
+    hops: int = Query(2, ge=1, le=10),
+    db: Session = Depends(get_cached_read_db),
+):
+    _check_user(db, user_id)
+    return shot_graph.reachable(db, user_id, hops)
+
 
+@router.get("/graph/path", response_model=dict)
+def get_graph_path(
+    source_id: int = Query(..., alias="from"),
+    target_id: int = Query(..., alias="to"),
+    db: Session = Depends(get_cached_read_db),
+):
+    # Who owes whom: a chain of open bets leading from one user to the other
+    _check_user(db, source_id)
+    _check_user(db, target_id)
     return {
-        "nodes": nodes_list,
-        "edges": edges,
-        "leaderboard": leaderboard,  # Include the leaderboard in the response
+        "from": source_id,
+        "to": target_id,
+        "path": shot_graph.owes_path(db, source_id, target_id),
     }
 
 
-@router.get("/graph", response_model=dict)
-def get_user_shot_relationships(db: Session = Depends(get_db)):
-    graph_data = get_shot_relationships_graph(db=db)
-    return graph_data
+@router.get("/graph/components", response_model=list)
+def get_graph_components(db: Session = Depends(get_cached_read_db)):
+    return shot_graph.components(db)
+
+
+@router.get("/graph/centrality", response_model=list)
+def get_graph_centrality(
+    metric: str = Query("degree", pattern="^(degree|weighted)$"),
+    limit: int = Query(20, ge=1),
+    db: Session = Depends(get_cached_read_db),
+):
+    return shot_graph.centrality(db, metric)[:limit]
+
+
+@router.get("/leaderboard", response_model=list)
+def get_leaderboard(db: Session = Depends(get_cached_read_db)):
+    # Same rows as the graph's leaderboard, summed over the columnar bet snapshot
+    return aggregates.leaderboard_from_columns(db)
+
+
+@router.get("/settlements", response_model=dict)
+def get_settlements(
+    request: Request,
+    response: Response,
+    scope: str = Query("component", pattern="^(component|global)$"),
+    db: Session = Depends(get_cached_read_db),
+):
+    """
+    The fewest shot transfers that settle every open bet. Opposite bets between two
+    users cancel out, and so do cycles (A owes B, B owes C, C owes A).
+
+    With `scope=component` (the default) each group of users linked by open bets is
+    settled on its own; `scope=global` settles everyone together.
+    """
+    version, settlements = settlement_book.snapshot(db, scope)
+    etag = settlement_book.etag(version)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return settlements
+
+
+@router.get("/stats", response_model=dict)
+def get_stats(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    interval: str = Query("day", pattern="^(day|week|total)$"),
+    user_id: Optional[int] = None,
+    counterparty_id: Optional[int] = None,
+    db: Session = Depends(get_cached_read_db),
+):
+    """
+    Bets created, shots wagered, bets resolved, shots called and average resolution
+    time from `since` up to (not including) `until`, in total and per day or week.
+    Pass `user_id` for one user's bets, and `counterparty_id` as well for the bets
+    between two users.
+    """
+    if counterparty_id is not None and user_id is None:
+        raise HTTPException(status_code=400, detail="counterparty_id needs a user_id")
+    if user_id is None:
+        scope = stats.everyone()
+    else:
+        _check_user(db, user_id)
+        if counterparty_id is None:
+            scope = stats.user_scope(user_id)
+        else:
+            _check_user(db, counterparty_id)
+            scope = stats.pair_scope(user_id, counterparty_id)
+    return {
+        "interval": interval,
+        **stats.stats_book.query(db, scope, since, until, interval),
+    }
 
 
-@router.get("/events", response_model=dict)
-def get_event_log(db: Session = Depends(get_db)):
+@router.get("/events", response_model=dict, dependencies=[Depends(expensive("events"))])
+def get_event_log(request: Request, include_archived: bool = False):
     """
     Simple funtionality to translate the bet data into a list of events.
     Each bet can be transformed into several events. For simplicity, we'll focus on the following two:
@@ -110,10 +168,29 @@ def get_event_log(db: Session = Depends(get_db)):
     The description field will contain the following information:
     - For bet creation events: "User A bet User B N shots: description"
     - For bet resolution events: "User A called N shots on User B"
+
+    Archived bets are only included with `include_archived`.
     """
 
-    # Get all bets
-    bets = db.query(models.Bet).all()
+    # Cached until any bet changes or a user is renamed
+    def compute():
+        # May run after the request is over (see limits.py), so with a session of
+        # its own
+        with replica_set.session(request, cached=True) as db:
+            return _event_log(db, include_archived)
+
+    return response_cache.get_or_set(
+        "events:archived" if include_archived else "events",
+        ["events"],
+        compute,
+        stale_for(request),
+        expensive_budget,
+    )
+
+
+def _event_log(db: Session, include_archived: bool):
+    # Get all bets, along with their bettor's and bettee's names
+    bets = crud.get_bet_rows(db, include_archived)
 
     # Create a list of events
     events = []
@@ -125,26 +202,62 @@ def get_event_log(db: Session = Depends(get_db)):
                 "id": bet.id,
                 "type": "bet_creation",
                 "event_date": bet.date_created,
-                "description": f"{bet.bettor.name} bet {bet.bettee.name} {bet.shots} shot(s): {bet.description}",
+                "description": f"{bet.bettor_name} bet {bet.bettee_name} "
+                f"{bet.shots} shot(s): {bet.description}",
             }
         )
 
-        # Create a bet resolution event if the bet has been resolved
-        if bet.outcome and bet.outcome != "incomplete" and bet.outcome != "expired":
-            try:
-                outcome_date = datetime.strptime(bet.outcome[:-4], "%Y-%m-%dT%H:%M")
-                events.append(
-                    {
-                        "id": bet.id,
-                        "type": "bet_resolution",
-                        "event_date": outcome_date,
-                        "description": f"{bet.bettor.name} called {bet.shots} shot(s) on {bet.bettee.name}",
-                    }
-                )
-            except ValueError:
-                print(f"Invalid date format: {bet.outcome}")
+        # Create a bet resolution event if the bet has been resolved. Legacy rows
+        # whose resolution date couldn't be read have none, like in the stream.
+        if bet.status == models.BetStatus.resolved and bet.resolved_at is not None:
+            events.append(
+                {
+                    "id": bet.id,
+                    "type": "bet_resolution",
+                    "event_date": bet.resolved_at,
+                    "description": f"{bet.bettor_name} called {bet.shots} shot(s) "
+                    f"on {bet.bettee_name}",
+                }
+            )
 
     # Sort the events by date
     events.sort(key=lambda event: event["event_date"], reverse=True)
 
     return {"events": events}
+
+
+@router.get("/events/stream")
+def stream_event_log(
+    request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    include_archived: bool = False,
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    The event log as newline-delimited JSON, oldest first, streamed straight from
+    the database. Every event carries a `cursor`; polling clients pass the last one
+    they saw as `after` (or in a Last-Event-ID header) to receive only newer events.
+    """
+    after = after or last_event_id
+    # Validate the cursor before the response starts streaming
+    if after:
+        event_log.parse_event_cursor(after)
+
+    def generate():
+        # The session lives as long as the stream, not the request handler.
+        # Nothing read here is kept, so it can come from a replica.
+        db = replica_set.session(request)
+        try:
+            for event in event_log.iter_events(
+                db, since, until, after, limit, include_archived
+            ):
+                event["cursor"] = event_log.event_cursor(event)
+                event["event_date"] = event["event_date"].isoformat()
+                yield json.dumps(event) + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
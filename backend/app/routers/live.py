@@ -0,0 +1,49 @@
+import asyncio
+
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+
+from ..hub import hub
+
+router = APIRouter(
+    prefix="/live",
+    tags=["live"],
+)
+
+# Idle connections get a comment line this often, so proxies don't time them out
+KEEP_ALIVE_SECONDS = 15
+
+
+@router.get("/events")
+async def live_events():
+    """
+    Server-Sent Events feed of changes as they are committed:
+    - `edge`: a new bet, in the same shape as the /data/graph edges
+    - `outcome`: a bet's outcome (or shots) changed
+    - `edge_deleted`: a bet was deleted
+    - `leaderboard`: updated leaderboard rows for the users involved
+    - `user` / `user_deleted`: a user was renamed or removed
+    - `resync`: this client fell behind and should refetch /data/graph
+    """
+
+    async def stream():
+        queue = hub.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    sequence, event_type, data = await asyncio.wait_for(
+                        queue.get(), KEEP_ALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {sequence}\nevent: {event_type}\ndata: {data}\n\n"
+        finally:
+            hub.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from .. import crud, change_log
+from ..replicas import get_read_db
+
+router = APIRouter(
+    prefix="/sync",
+    tags=["sync"],
+)
+
+
+@router.get("", response_model=dict)
+def sync(
+    after: int = Query(0, ge=0),
+    limit: int = Query(change_log.SYNC_PAGE_SIZE, ge=1, le=10000),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Users and bets that changed after sequence number `after`, from the change
+    log (see change_log.py): the current version of each one saved, and the ids
+    of those deleted. Start with `after=0`, then pass back `seq` until `more`
+    is false; keep the last `seq` to poll for later changes.
+    """
+    changes, seq, more = change_log.read(db, after, limit)
+    saved = {change_log.USER: [], change_log.BET: []}
+    deleted = {change_log.USER: [], change_log.BET: []}
+    for (entity, entity_id), is_deleted in changes.items():
+        (deleted if is_deleted else saved)[entity].append(entity_id)
+
+    users = crud.get_users_by_ids(db, saved[change_log.USER])
+    bets = {bet.id: bet for bet in crud.get_bet_rows_by_ids(db, saved[change_log.BET])}
+    # Anything gone by now has a tombstone further on, but clients may as well drop
+    # it now
+    deleted[change_log.USER] += [
+        user_id for user_id in saved[change_log.USER] if user_id not in users
+    ]
+    deleted[change_log.BET] += [
+        bet_id
+        for bet_id in saved[change_log.BET]
+        if bet_id not in bets
+        or bets[bet_id].bettor_id is None
+        or bets[bet_id].bettee_id is None
+    ]
+    dropped = set(deleted[change_log.BET])
+
+    return {
+        "seq": seq,
+        "more": more,
+        "users": [
+            {"id": user.id, "name": user.name, "email": user.email}
+            for user_id, user in sorted(users.items())
+        ],
+        "bets": [
+            {
+                "id": bet.id,
+                "bettor_id": bet.bettor_id,
+                "bettee_id": bet.bettee_id,
+                "shots": bet.shots,
+                "description": bet.description,
+                "outcome": bet.outcome,
+                "date_created": bet.date_created,
+            }
+            for bet_id, bet in sorted(bets.items())
+            if bet_id not in dropped
+        ],
+        "deleted_users": sorted(deleted[change_log.USER]),
+        "deleted_bets": sorted(dropped),
+    }
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from typing import List
-from .. import schemas, crud, models
+from typing import List, Optional
+from .. import schemas, crud, models, aggregates, changes, change_log
+from ..cache import response_cache
 from ..database import authenticate_query_param, get_db
+from ..fast_responses import FAST_RESPONSES, bet_dicts, dumps, json_response
+from ..replicas import get_cached_read_db, get_read_db
 
 router = APIRouter(
     prefix="/users",
@@ -22,7 +26,7 @@ def create_user(
 
 
 @router.get("/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
+def read_user(user_id: int, db: Session = Depends(get_read_db)):
     db_user = crud.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
@@ -30,8 +34,16 @@ def read_user(user_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
+def read_users(
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+):
+    users, next_cursor = crud.get_users(db, skip=skip, limit=limit, cursor=cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return users
 
 
@@ -47,8 +59,10 @@ def update_user(
         raise HTTPException(status_code=404, detail="User not found")
     db_user.name = user.name
     db_user.email = user.email
+    change_log.record(db, change_log.USER, [user_id])
     db.commit()
     db.refresh(db_user)
+    changes.user_updated(db, db_user)
     return db_user
 
 
@@ -61,77 +75,213 @@ def delete_user(
     db_user = crud.get_user(db, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
+    # Their bets go with them, as far as the API (and /sync) is concerned
+    bet_ids = crud.get_user_bet_ids(db, user_id)
     db.delete(db_user)
+    change_log.record(db, change_log.USER, [user_id], deleted=True)
+    change_log.record(db, change_log.BET, bet_ids, deleted=True)
     db.commit()
+    changes.user_deleted(db, user_id)
     return {"message": "User deleted successfully"}
 
 
 @router.get("/{user_id}/shot-balances", response_model=dict)
-def get_user_shot_balances(user_id: int, db: Session = Depends(get_db)):
+def get_user_shot_balances(user_id: int, db: Session = Depends(get_cached_read_db)):
     db_user = crud.get_user(db, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    shot_balances = crud.get_user_shot_balances(db=db, user_id=user_id)
-    return {"balance": shot_balances, "user": db_user}
+    shot_balances = aggregates.user_shot_balances_from_columns(db=db, user_id=user_id)
+    return {
+        "balance": shot_balances,
+        "user": {"id": db_user.id, "name": db_user.name, "email": db_user.email},
+    }
+
+
+class BetFilters:
+    """
+    Query parameters shared by the per-user bet listings. Without a `limit`, every
+    matching bet is returned; with one, pages are walked with opaque cursors.
+    Archived bets are left out unless `include_archived` is set; `bets` is what
+    to query either way.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1),
+        status: Optional[models.BetStatus] = None,
+        counterparty_id: Optional[int] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        include_archived: bool = False,
+    ):
+        self.limit = limit
+        self.status = status
+        self.counterparty_id = counterparty_id
+        self.created_after = created_after
+        self.created_before = created_before
+        self.include_archived = include_archived
+        self.bets = crud.bet_source(include_archived)
+
+    def apply(self, query, counterparty_column):
+        query = crud.filter_bets(
+            query,
+            status=self.status,
+            created_after=self.created_after,
+            created_before=self.created_before,
+            bets=self.bets,
+        )
+        if self.counterparty_id is not None:
+            query = query.filter(counterparty_column == self.counterparty_id)
+        return query
+
+
+def _bets_query(db: Session, bets):
+    # The fast response path only needs plain rows
+    if FAST_RESPONSES:
+        return db.query(*crud.bet_row_columns(bets))
+    return db.query(bets)
+
+
+def _fast_bets(request: Request, bets, next_cursor):
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return json_response(request, dumps(bet_dicts(bets)), headers)
 
 
 @router.get("/{user_id}/bets-owed", response_model=List[schemas.Bet])
-def get_user_bets_owed(user_id: int, db: Session = Depends(get_db)):
+def get_user_bets_owed(
+    user_id: int,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    filters: BetFilters = Depends(),
+    db: Session = Depends(get_read_db),
+):
     db_user = crud.get_user(db, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Get all bets where the user is the bettor (owes shots)
-    bets_owed = db.query(models.Bet).filter(models.Bet.bettor_id == user_id).all()
+    bets = filters.bets
+    query = _bets_query(db, bets).filter(bets.bettor_id == user_id)
+    bets_owed, next_cursor = crud.paginate(
+        filters.apply(query, bets.bettee_id),
+        crud.bet_order(bets),
+        filters.limit,
+        cursor,
+        key=crud.bet_key,
+    )
+    if FAST_RESPONSES:
+        return _fast_bets(request, bets_owed, next_cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
     return bets_owed
 
 
 @router.get("/{user_id}/bets-owned", response_model=List[schemas.Bet])
-def get_user_bets_owned(user_id: int, db: Session = Depends(get_db)):
+def get_user_bets_owned(
+    user_id: int,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    filters: BetFilters = Depends(),
+    db: Session = Depends(get_read_db),
+):
     db_user = crud.get_user(db, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Get all bets where the user is the bettee (is owed shots)
-    bets_owned = db.query(models.Bet).filter(models.Bet.bettee_id == user_id).all()
+    bets = filters.bets
+    query = _bets_query(db, bets).filter(bets.bettee_id == user_id)
+    bets_owned, next_cursor = crud.paginate(
+        filters.apply(query, bets.bettor_id),
+        crud.bet_order(bets),
+        filters.limit,
+        cursor,
+        key=crud.bet_key,
+    )
+    if FAST_RESPONSES:
+        return _fast_bets(request, bets_owned, next_cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
     return bets_owned
 
 
 @router.get("/{user_id}/bet-summary")
-def get_user_bet_summary(user_id: int, db: Session = Depends(get_db)):
+def get_user_bet_summary(
+    user_id: int,
+    request: Request,
+    owed_cursor: Optional[str] = None,
+    owned_cursor: Optional[str] = None,
+    filters: BetFilters = Depends(),
+    db: Session = Depends(get_cached_read_db),
+):
+    # Cached per user and query string, until one of the user's bets changes
+    if FAST_RESPONSES:
+        # The fast path caches the serialized JSON instead
+        body = response_cache.get_or_set(
+            f"bet-summary-json:{user_id}:{request.url.query}",
+            [f"user:{user_id}"],
+            lambda: dumps(
+                _bet_summary(db, user_id, owed_cursor, owned_cursor, filters)
+            ).decode(),
+        )
+        return json_response(request, body.encode())
+    return response_cache.get_or_set(
+        f"bet-summary:{user_id}:{request.url.query}",
+        [f"user:{user_id}"],
+        lambda: _bet_summary(db, user_id, owed_cursor, owned_cursor, filters),
+    )
+
+
+def _bet_summary(db: Session, user_id: int, owed_cursor, owned_cursor, filters):
     db_user = crud.get_user(db, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    bets = filters.bets
+
     # Get all bets where the user is the bettor (owes shots)
-    bets_owed = (
-        db.query(models.Bet, models.User.name.label("bettee_name"))
-        .join(models.User, models.Bet.bettee_id == models.User.id)
-        .filter(models.Bet.bettor_id == user_id)
-        .all()
+    bets_owed, next_owed_cursor = crud.paginate(
+        filters.apply(
+            db.query(*crud.bet_row_columns(bets), models.User.name.label("bettee_name"))
+            .join(models.User, bets.bettee_id == models.User.id)
+            .filter(bets.bettor_id == user_id),
+            bets.bettee_id,
+        ),
+        crud.bet_order(bets),
+        filters.limit,
+        owed_cursor,
+        key=crud.bet_key,
     )
 
     # Get all bets where the user is the bettee (is owed shots)
-    bets_owned = (
-        db.query(models.Bet, models.User.name.label("bettor_name"))
-        .join(models.User, models.Bet.bettor_id == models.User.id)
-        .filter(models.Bet.bettee_id == user_id)
-        .all()
+    bets_owned, next_owned_cursor = crud.paginate(
+        filters.apply(
+            db.query(*crud.bet_row_columns(bets), models.User.name.label("bettor_name"))
+            .join(models.User, bets.bettor_id == models.User.id)
+            .filter(bets.bettee_id == user_id),
+            bets.bettor_id,
+        ),
+        crud.bet_order(bets),
+        filters.limit,
+        owned_cursor,
+        key=crud.bet_key,
     )
 
     # Format the response to include bettor and bettee names
     formatted_bets_owed = [
         {
-            "id": bet.Bet.id,
-            "date_created": bet.Bet.date_created,
-            "shots": bet.Bet.shots,
-            "description": bet.Bet.description,
-            "outcome": bet.Bet.outcome,
-            "bettor_id": bet.Bet.bettor_id,
-            "bettee_id": bet.Bet.bettee_id,
+            "id": bet.id,
+            "date_created": bet.date_created,
+            "shots": bet.shots,
+            "description": bet.description,
+            "outcome": bet.outcome,
+            "bettor_id": bet.bettor_id,
+            "bettee_id": bet.bettee_id,
             "bettee_name": bet.bettee_name,
         }
         for bet in bets_owed
@@ -139,13 +289,13 @@ def get_user_bet_summary(user_id: int, db: Session = Depends(get_db)):
 
     formatted_bets_owned = [
         {
-            "id": bet.Bet.id,
-            "date_created": bet.Bet.date_created,
-            "shots": bet.Bet.shots,
-            "description": bet.Bet.description,
-            "outcome": bet.Bet.outcome,
-            "bettor_id": bet.Bet.bettor_id,
-            "bettee_id": bet.Bet.bettee_id,
+            "id": bet.id,
+            "date_created": bet.date_created,
+            "shots": bet.shots,
+            "description": bet.description,
+            "outcome": bet.outcome,
+            "bettor_id": bet.bettor_id,
+            "bettee_id": bet.bettee_id,
             "bettor_name": bet.bettor_name,
         }
         for bet in bets_owned
@@ -159,27 +309,21 @@ def get_user_bet_summary(user_id: int, db: Session = Depends(get_db)):
         },
         "bets_owed": formatted_bets_owed,
         "bets_owned": formatted_bets_owned,
+        "next_owed_cursor": next_owed_cursor,
+        "next_owned_cursor": next_owned_cursor,
     }
 
 
 @router.get("/{user_id}/related-users", response_model=List[schemas.User])
-def get_related_users(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id)
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found")
+def get_related_users(user_id: int, db: Session = Depends(get_cached_read_db)):
+    def load():
+        db_user = crud.get_user(db, user_id)
+        if not db_user:
+            raise HTTPException(status_code=404, detail="User not found")
 
-    # Get all users who have been involved in bets with the current user
-    related_user_ids = (
-        db.query(models.Bet.bettor_id, models.Bet.bettee_id)
-        .filter((models.Bet.bettor_id == user_id) | (models.Bet.bettee_id == user_id))
-        .distinct()
-    )
+        # Get all users who have been involved in bets with the current user
+        return crud.get_related_users(db, user_id)
 
-    related_users = set()
-    for bettor_id, bettee_id in related_user_ids:
-        if bettor_id != user_id:
-            related_users.add(bettor_id)
-        if bettee_id != user_id:
-            related_users.add(bettee_id)
-
-    return [crud.get_user(db, user_id) for user_id in related_users]
+    return response_cache.get_or_set(
+        f"related-users:{user_id}", [f"user:{user_id}"], load
+    )
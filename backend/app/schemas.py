@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -35,6 +35,22 @@ class BetUpdate(BaseModel):
     shots: Optional[int] = None
 
 
+class BetResolve(BetUpdate):
+    id: int
+
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class BulkResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
+
+
 class Bet(BetBase):
     id: int
     date_created: datetime
@@ -0,0 +1,200 @@
+"""
+Full-text index over bet descriptions and the names of the bettor and bettee,
+behind GET /bets/search.
+
+The index is a table of its own, kept up to date by triggers on `bets` and
+`users`. Every way a bet or a name changes (single and bulk routes, renames,
+deletes) updates it in the same transaction as the change itself:
+- SQLite: an FTS5 table `bet_search` whose rowid is the bet id, ranked by bm25
+- Postgres: `bet_search(bet_id, document)` with a GIN index on the tsvector,
+  ranked by ts_rank
+
+Neither stems words, so names match as they are spelled. The last word of a
+query matches as a prefix; FTS5 keeps prefix indexes for the short ones, which
+otherwise expand to many terms.
+
+`install` (run by migrations.upgrade) creates the index and fills it in for
+the bets already there.
+"""
+
+import os
+import re
+
+from sqlalchemy import column, func, inspect, literal_column, table, text
+from sqlalchemy.engine import Engine
+
+# Matches are ranked among the most recent SEARCH_CANDIDATES bets they are in,
+# which bounds the cost of very common words
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", 5000))
+
+SQLITE_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE bet_search USING fts5(
+        description, bettor_name, bettee_name,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3 4'
+    )
+    """,
+    """
+    CREATE TRIGGER bet_search_insert AFTER INSERT ON bets BEGIN
+        INSERT INTO bet_search (rowid, description, bettor_name, bettee_name)
+        VALUES (
+            NEW.id,
+            NEW.description,
+            (SELECT name FROM users WHERE id = NEW.bettor_id),
+            (SELECT name FROM users WHERE id = NEW.bettee_id)
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER bet_search_update
+    AFTER UPDATE OF description, bettor_id, bettee_id ON bets BEGIN
+        UPDATE bet_search SET
+            description = NEW.description,
+            bettor_name = (SELECT name FROM users WHERE id = NEW.bettor_id),
+            bettee_name = (SELECT name FROM users WHERE id = NEW.bettee_id)
+        WHERE rowid = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER bet_search_delete AFTER DELETE ON bets BEGIN
+        DELETE FROM bet_search WHERE rowid = OLD.id;
+    END
+    """,
+    """
+    CREATE TRIGGER bet_search_rename AFTER UPDATE OF name ON users
+    WHEN OLD.name IS NOT NEW.name BEGIN
+        UPDATE bet_search SET bettor_name = NEW.name
+        WHERE rowid IN (SELECT id FROM bets WHERE bettor_id = NEW.id);
+        UPDATE bet_search SET bettee_name = NEW.name
+        WHERE rowid IN (SELECT id FROM bets WHERE bettee_id = NEW.id);
+    END
+    """,
+]
+
+SQLITE_BACKFILL = """
+    INSERT INTO bet_search (rowid, description, bettor_name, bettee_name)
+    SELECT bets.id, bets.description, bettor.name, bettee.name
+    FROM bets
+    LEFT JOIN users AS bettor ON bettor.id = bets.bettor_id
+    LEFT JOIN users AS bettee ON bettee.id = bets.bettee_id
+    WHERE bets.id > :after AND bets.id <= :until
+    AND NOT EXISTS (SELECT 1 FROM bet_search WHERE rowid = bets.id)
+"""
+
+POSTGRES_SCHEMA = [
+    """
+    CREATE TABLE bet_search (
+        bet_id integer PRIMARY KEY REFERENCES bets (id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_bet_search_document ON bet_search USING gin (document)",
+    """
+    CREATE OR REPLACE FUNCTION bet_search_document(text, integer, integer)
+    RETURNS tsvector AS $$
+        SELECT to_tsvector('simple', coalesce($1, '') || ' ' ||
+            coalesce((SELECT name FROM users WHERE id = $2), '') || ' ' ||
+            coalesce((SELECT name FROM users WHERE id = $3), ''))
+    $$ LANGUAGE sql STABLE
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bet_search_bet_saved() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO bet_search (bet_id, document)
+        VALUES (
+            NEW.id,
+            bet_search_document(NEW.description, NEW.bettor_id, NEW.bettee_id)
+        )
+        ON CONFLICT (bet_id) DO UPDATE SET document = EXCLUDED.document;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER bet_search_bet_saved
+    AFTER INSERT OR UPDATE OF description, bettor_id, bettee_id ON bets
+    FOR EACH ROW EXECUTE FUNCTION bet_search_bet_saved()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bet_search_user_renamed() RETURNS trigger AS $$
+    BEGIN
+        UPDATE bet_search
+        SET document = bet_search_document(
+            bets.description, bets.bettor_id, bets.bettee_id
+        )
+        FROM bets
+        WHERE bets.id = bet_search.bet_id
+        AND (bets.bettor_id = NEW.id OR bets.bettee_id = NEW.id);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER bet_search_user_renamed AFTER UPDATE OF name ON users
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION bet_search_user_renamed()
+    """,
+]
+
+POSTGRES_BACKFILL = """
+    INSERT INTO bet_search (bet_id, document)
+    SELECT id, bet_search_document(description, bettor_id, bettee_id)
+    FROM bets
+    WHERE id > :after AND id <= :until
+    ON CONFLICT (bet_id) DO NOTHING
+"""
+
+
+def install(engine: Engine, batch_size: int = 10000):
+    """
+    Create the index and its triggers if they aren't there yet, then index the
+    bets that existed before, one short transaction per batch of ids. Bets
+    written meanwhile are indexed by the triggers.
+    """
+    if inspect(engine).has_table("bet_search"):
+        return
+    postgres = engine.dialect.name == "postgresql"
+    with engine.begin() as conn:
+        for statement in POSTGRES_SCHEMA if postgres else SQLITE_SCHEMA:
+            conn.execute(text(statement))
+        last_id = conn.execute(text("SELECT max(id) FROM bets")).scalar() or 0
+
+    backfill = text(POSTGRES_BACKFILL if postgres else SQLITE_BACKFILL)
+    for after in range(0, last_id, batch_size):
+        with engine.begin() as conn:
+            conn.execute(backfill, {"after": after, "until": after + batch_size})
+
+
+def terms(query: str):
+    # Words only, so whatever is typed can't be read as query syntax
+    return re.findall(r"[^\W_]+", query.lower())
+
+
+def matching(dialect: str, query: str):
+    """
+    How to find bets matching `query` on this dialect: `(index table, bet id
+    column, match condition, rank)`, where a lower rank is a better match, or
+    None if the query has no words. All the words must match, the last one as
+    a prefix, so results show up while it is being typed.
+    """
+    words = terms(query)
+    if not words:
+        return None
+    if dialect == "postgresql":
+        index = table("bet_search", column("bet_id"), column("document"))
+        tsquery = func.to_tsquery("simple", " & ".join(words) + ":*")
+        return (
+            index,
+            index.c.bet_id,
+            index.c.document.op("@@")(tsquery),
+            -func.ts_rank(index.c.document, tsquery),
+        )
+    index = table("bet_search", column("rowid"), column("rank"))
+    expression = " ".join(f'"{word}"' for word in words) + "*"
+    return (
+        index,
+        index.c.rowid,
+        literal_column("bet_search").op("MATCH")(expression),
+        index.c.rank,
+    )
@@ -0,0 +1,357 @@
+"""
+Debt simplification: the fewest shot transfers that square everyone up.
+
+Only open bets count, as on the leaderboard. Each user's net balance is what they
+are owed minus what they owe; shots are fungible, so any set of transfers that
+zeroes every balance settles the group. Users are split into connected components
+(people linked by open bets), and each component is settled on its own, exactly
+when it is small and with the greedy min-cash-flow heuristic otherwise.
+
+Like the materialized graph, the book is built from the database once and kept up
+to date by the mutation hooks in changes.py. Only the components a change touches
+are settled again, on the next read; every other one keeps its cached transfers.
+"""
+
+import heapq
+import os
+import threading
+import uuid
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .columnar import bet_columns
+
+# Components with up to this many non-zero balances are settled exactly. The exact
+# search is exponential in that number, so keep it small.
+SETTLEMENT_EXACT_LIMIT = int(os.getenv("SETTLEMENT_EXACT_LIMIT", 12))
+
+
+def _transfer(debtor, creditor, shots):
+    return {"from": debtor, "to": creditor, "shots": shots}
+
+
+def greedy_transfers(balances: dict):
+    """
+    Settle `balances` (user id -> net shots, summing to 0) by repeatedly having the
+    biggest debtor pay the biggest creditor. Every transfer zeroes at least one of
+    the two, so there are at most n - 1 transfers, and it runs in O(n log n).
+    """
+    creditors = [
+        (-amount, user_id) for user_id, amount in balances.items() if amount > 0
+    ]
+    debtors = [(amount, user_id) for user_id, amount in balances.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        shots = min(-credit, -debt)
+        transfers.append(_transfer(debtor, creditor, shots))
+        if -credit > shots:
+            heapq.heappush(creditors, (credit + shots, creditor))
+        if -debt > shots:
+            heapq.heappush(debtors, (debt + shots, debtor))
+    return transfers
+
+
+def exact_transfers(balances: dict):
+    """
+    Minimal settlement of `balances`. n non-zero balances need n - k transfers,
+    where k is the largest number of disjoint zero-sum groups they split into; that
+    k is found by a DP over subsets, then each group is settled greedily (a group
+    of m needs m - 1 transfers, which greedy achieves).
+    """
+    users = [user_id for user_id, amount in balances.items() if amount]
+    amounts = [balances[user_id] for user_id in users]
+    full = (1 << len(users)) - 1
+
+    # sums[mask] is the total balance of the users in mask; best[mask] is the most
+    # zero-sum groups an ordering of mask can be cut into
+    sums = [0] * (full + 1)
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + amounts[low.bit_length() - 1]
+        best[mask] = max(
+            best[mask ^ (1 << i)] for i in range(len(users)) if mask >> i & 1
+        )
+        if sums[mask] == 0:
+            best[mask] += 1
+
+    # Walk back down, cutting a group every time the remaining users sum to zero
+    transfers = []
+    group = {}
+    mask = full
+    while mask:
+        closes = 1 if sums[mask] == 0 else 0
+        i = next(
+            i
+            for i in range(len(users))
+            if mask >> i & 1 and best[mask ^ (1 << i)] + closes == best[mask]
+        )
+        group[users[i]] = amounts[i]
+        mask ^= 1 << i
+        if sums[mask] == 0:
+            transfers.extend(greedy_transfers(group))
+            group = {}
+    return transfers
+
+
+def settle(balances: dict):
+    """
+    Return `(transfers, exact)` settling `balances`.
+    """
+    if sum(1 for amount in balances.values() if amount) <= SETTLEMENT_EXACT_LIMIT:
+        return exact_transfers(balances), True
+    return greedy_transfers(balances), False
+
+
+class SettlementBook:
+    """
+    Net balances and pairwise links from open bets, plus the settlement of every
+    connected component, computed lazily and cached until one of its users changes.
+
+    A new link merges two components and a changed balance only re-settles its
+    component; the graph is only walked again when the last open bet between two
+    users goes away, as that can split their component in two.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._built = False
+        self._reset()
+
+    def _reset(self):
+        self._bets = {}  # bet id -> (bettor id, bettee id, shots), open bets only
+        self._balances = {}  # user id -> shots owed to them minus shots they owe
+        # user id -> {counterparty id: number of open bets between them}
+        self._links = {}
+        self._component_of = {}  # user id -> component id
+        # component id -> {"users", "view"}, view being what is served
+        self._components = {}
+        self._stale = set()  # components whose transfers need working out again
+        self._dirty = set()  # users that need to be regrouped into components
+        self._next_component = 0
+        self._payloads = {}
+
+    def etag(self, version: int):
+        return f'"{self.epoch}-{version}"'
+
+    def build(self, db: Session):
+        with self._lock:
+            self._reset()
+            for bet_id, bettor_id, bettee_id, shots in bet_columns.open_bets(db):
+                self._add(bet_id, bettor_id, bettee_id, shots)
+            self._built = True
+            self.version += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+            self._reset()
+            self.version += 1
+
+    def ensure_built(self, db: Session):
+        with self._lock:
+            if not self._built:
+                self.build(db)
+
+    def snapshot(self, db: Session, scope: str = "component"):
+        """
+        Return `(version, payload)` for `scope`, either "component" (each connected
+        group settled on its own) or "global" (everyone settled together, which can
+        pair up users who never bet against each other).
+        """
+        with self._lock:
+            self.ensure_built(db)
+            if scope not in self._payloads:
+                self._payloads[scope] = self._render(scope)
+            return self.version, self._payloads[scope]
+
+    # Mutation hooks
+
+    def bet_saved(self, bet: models.Bet):
+        with self._lock:
+            if not self._built:
+                return
+            changed = self._remove(bet.id)
+            if bet.status == models.BetStatus.open:
+                self._add(bet.id, bet.bettor_id, bet.bettee_id, bet.shots)
+                changed = True
+            if changed:
+                self._changed()
+
+    def bet_deleted(self, bet_id: int):
+        with self._lock:
+            if self._built and self._remove(bet_id):
+                self._changed()
+
+    # Internals
+
+    def _changed(self):
+        self.version += 1
+        self._payloads = {}
+
+    def _add(self, bet_id, bettor_id, bettee_id, shots):
+        shots = shots or 0
+        self._bets[bet_id] = (bettor_id, bettee_id, shots)
+        self._balances[bettor_id] = self._balances.get(bettor_id, 0) - shots
+        self._balances[bettee_id] = self._balances.get(bettee_id, 0) + shots
+        if bettor_id == bettee_id:
+            self._mark(bettor_id)
+            return
+        new_link = bettee_id not in self._links.get(bettor_id, ())
+        for user_id, other_id in ((bettor_id, bettee_id), (bettee_id, bettor_id)):
+            links = self._links.setdefault(user_id, {})
+            links[other_id] = links.get(other_id, 0) + 1
+        if new_link:
+            self._join(bettor_id, bettee_id)
+        else:
+            self._mark(bettor_id)
+
+    def _remove(self, bet_id):
+        bet = self._bets.pop(bet_id, None)
+        if bet is None:
+            return False
+        bettor_id, bettee_id, shots = bet
+        self._balances[bettor_id] += shots
+        self._balances[bettee_id] -= shots
+        unlinked = False
+        if bettor_id != bettee_id:
+            for user_id, other_id in ((bettor_id, bettee_id), (bettee_id, bettor_id)):
+                links = self._links[user_id]
+                links[other_id] -= 1
+                if not links[other_id]:
+                    del links[other_id]
+                    unlinked = True
+        if unlinked:
+            # The component may have split in two
+            self._dissolve(bettor_id)
+            self._dissolve(bettee_id)
+        else:
+            self._mark(bettor_id)
+        for user_id in (bettor_id, bettee_id):
+            if (
+                user_id in self._balances
+                and not self._links.get(user_id)
+                and not self._balances[user_id]
+            ):
+                # Nothing left open for this user
+                self._dissolve(user_id)
+                self._links.pop(user_id, None)
+                del self._balances[user_id]
+        return True
+
+    def _mark(self, user_id):
+        # The user's balance changed; their component keeps its members
+        component_id = self._component_of.get(user_id)
+        if component_id is None:
+            self._dirty.add(user_id)
+        else:
+            self._stale.add(component_id)
+
+    def _dissolve(self, user_id):
+        component = self._components.pop(self._component_of.get(user_id), None)
+        if component is not None:
+            for member in component["users"]:
+                del self._component_of[member]
+            self._dirty.update(component["users"])
+        self._dirty.add(user_id)
+
+    def _join(self, user_id, other_id):
+        # A first open bet between two users merges their components
+        for member in (user_id, other_id):
+            if member not in self._component_of and member not in self._dirty:
+                self._new_component({member})
+        if user_id in self._dirty or other_id in self._dirty:
+            self._dissolve(user_id)
+            self._dissolve(other_id)
+            return
+        keep, merge = self._component_of[user_id], self._component_of[other_id]
+        if keep != merge:
+            if len(self._components[keep]["users"]) < len(
+                self._components[merge]["users"]
+            ):
+                keep, merge = merge, keep
+            members = self._components.pop(merge)["users"]
+            self._stale.discard(merge)
+            for member in members:
+                self._component_of[member] = keep
+            self._components[keep]["users"] |= members
+        self._stale.add(keep)
+
+    def _new_component(self, users):
+        component_id = self._next_component
+        self._next_component += 1
+        self._components[component_id] = {"users": users, "view": None}
+        for user_id in users:
+            self._component_of[user_id] = component_id
+        self._stale.add(component_id)
+
+    def _settle(self):
+        # Regroup users whose components were dissolved, walking the open-bet links
+        while self._dirty:
+            start = self._dirty.pop()
+            if start in self._component_of or start not in self._balances:
+                continue
+            users = {start}
+            frontier = [start]
+            while frontier:
+                for other_id in self._links.get(frontier.pop(), ()):
+                    if other_id not in users:
+                        users.add(other_id)
+                        frontier.append(other_id)
+            self._dirty.difference_update(users)
+            self._new_component(users)
+
+        for component_id in self._stale:
+            component = self._components.get(component_id)
+            if component is not None:
+                transfers, exact = settle(
+                    {user_id: self._balances[user_id] for user_id in component["users"]}
+                )
+                component["view"] = {
+                    "users": sorted(component["users"]),
+                    "transfers": transfers,
+                    "exact": exact,
+                }
+        self._stale.clear()
+
+    def _render(self, scope):
+        if scope == "global":
+            transfers, exact = settle(self._balances)
+            return {
+                "version": self.version,
+                "scope": scope,
+                "transfers": transfers,
+                "exact": exact,
+            }
+
+        self._settle()
+        # Components that are already square need no transfers and aren't listed
+        components = sorted(
+            (
+                component["view"]
+                for component in self._components.values()
+                if component["view"]["transfers"]
+            ),
+            key=lambda component: component["users"][0],
+        )
+        return {
+            "version": self.version,
+            "scope": scope,
+            "transfers": [
+                transfer
+                for component in components
+                for transfer in component["transfers"]
+            ],
+            "components": components,
+        }
+
+
+settlement_book = SettlementBook()
@@ -0,0 +1,398 @@
+"""
+Keeps the in-memory state of every worker in step: the shot graph, columnar
+snapshot, stats, settlements, memory response cache and live feed.
+
+The mutation hooks in changes.py publish what they changed (bet and user ids)
+once it is committed, and every other worker applies the same hooks to its own
+state, loading only the rows that changed. SHARED_STATE picks how:
+- `none` (the default): a single worker, nothing is published
+- `mmap`: workers on one host append to a journal in a memory-mapped file
+  (SHARED_STATE_PATH) and poll it every SHARED_STATE_POLL_MS
+- `postgres`: NOTIFY on the app's database, for workers on several hosts
+
+A worker that may have missed changes (it fell a whole journal behind, or lost
+its LISTEN connection) drops its in-memory state so it is rebuilt from the
+database. The mmap journal also holds counters shared by the workers on the
+host; with `postgres` the counters are per worker.
+"""
+
+import contextvars
+import fcntl
+import json
+import logging
+import mmap
+import os
+import select
+import socket
+import struct
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+SHARED_STATE = os.getenv("SHARED_STATE", "none").lower()
+SHARED_STATE_PATH = os.getenv(
+    "SHARED_STATE_PATH", os.path.join(tempfile.gettempdir(), "call-your-shot.journal")
+)
+SHARED_STATE_SIZE = int(os.getenv("SHARED_STATE_SIZE", 4 * 1024 * 1024))
+SHARED_STATE_POLL_MS = int(os.getenv("SHARED_STATE_POLL_MS", 50))
+
+NOTIFY_CHANNEL = "call_your_shot_changes"
+# Postgres caps NOTIFY payloads at 8000 bytes
+NOTIFY_MAX_BYTES = 7000
+
+logger = logging.getLogger("app.shared_state")
+
+
+class Journal:
+    """
+    Append-only log of messages in a ring buffer inside a memory-mapped file,
+    written under an exclusive flock. Readers remember the absolute offset they
+    have read up to; once writers have wrapped past it, `read` reports the gap.
+
+    Layout: header (magic, data size, end offset, sequence), then COUNTER_SLOTS
+    named counters, then the ring of `[sequence, length, payload]` records.
+    """
+
+    MAGIC = b"CYSJRNL1"
+    HEADER = struct.Struct("<8sQQQ")
+    RECORD = struct.Struct("<QI")
+    COUNTER = struct.Struct("<24sq")
+    COUNTER_SLOTS = 32
+
+    def __init__(self, path: str, size: int):
+        self._data_start = self.HEADER.size + self.COUNTER.size * self.COUNTER_SLOTS
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), "r+b")
+        with self._locked(fcntl.LOCK_EX):
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() < self._data_start:
+                # A new journal; the first worker to get the lock lays it out
+                self._file.truncate(self._data_start + size)
+                self._file.seek(0)
+                self._file.write(self.HEADER.pack(self.MAGIC, size, 0, 0))
+                self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            magic, self.size, _, _ = self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a shared state journal")
+
+    @contextmanager
+    def _locked(self, operation):
+        fcntl.flock(self._file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _header(self):
+        _, _, end, sequence = self.HEADER.unpack_from(self._map, 0)
+        return end, sequence
+
+    def _write(self, offset: int, data: bytes):
+        position = offset % self.size
+        first = min(len(data), self.size - position)
+        start = self._data_start + position
+        self._map[start : start + first] = data[:first]
+        if first < len(data):
+            self._map[self._data_start : self._data_start + len(data) - first] = data[
+                first:
+            ]
+
+    def _read(self, offset: int, length: int) -> bytes:
+        position = offset % self.size
+        first = min(length, self.size - position)
+        start = self._data_start + position
+        data = self._map[start : start + first]
+        if first < length:
+            data += self._map[self._data_start : self._data_start + length - first]
+        return data
+
+    def end(self) -> int:
+        with self._locked(fcntl.LOCK_SH):
+            return self._header()[0]
+
+    def append(self, payload: bytes) -> int:
+        if self.RECORD.size + len(payload) > self.size:
+            raise ValueError("Message is larger than the journal")
+        with self._locked(fcntl.LOCK_EX):
+            end, sequence = self._header()
+            sequence += 1
+            self._write(end, self.RECORD.pack(sequence, len(payload)) + payload)
+            end += self.RECORD.size + len(payload)
+            self.HEADER.pack_into(self._map, 0, self.MAGIC, self.size, end, sequence)
+            return sequence
+
+    def read(self, offset: int):
+        """
+        Return `(payloads, new offset, missed)` for the records after `offset`.
+        `missed` is True if some were overwritten before they could be read.
+        """
+        with self._locked(fcntl.LOCK_SH):
+            end, _ = self._header()
+            missed = end - offset > self.size
+            if missed:
+                return [], end, True
+            payloads = []
+            while offset < end:
+                _, length = self.RECORD.unpack(self._read(offset, self.RECORD.size))
+                offset += self.RECORD.size
+                payloads.append(self._read(offset, length))
+                offset += length
+            return payloads, offset, False
+
+    def add(self, name: str, amount: int = 1):
+        key = name.encode()[: self.COUNTER.size - 8].ljust(self.COUNTER.size - 8, b"\0")
+        with self._locked(fcntl.LOCK_EX):
+            for slot in range(self.COUNTER_SLOTS):
+                position = self.HEADER.size + slot * self.COUNTER.size
+                slot_key, value = self.COUNTER.unpack_from(self._map, position)
+                if slot_key in (key, b"\0" * len(key)):
+                    self.COUNTER.pack_into(self._map, position, key, value + amount)
+                    return
+        raise ValueError("No free counter slots in the journal")
+
+    def counters(self):
+        with self._locked(fcntl.LOCK_SH):
+            counters = {}
+            for slot in range(self.COUNTER_SLOTS):
+                key, value = self.COUNTER.unpack_from(
+                    self._map, self.HEADER.size + slot * self.COUNTER.size
+                )
+                if key.strip(b"\0"):
+                    counters[key.rstrip(b"\0").decode()] = value
+            return counters
+
+
+class MmapTransport:
+    def __init__(self, path: str, size: int, poll_ms: int):
+        self.journal = Journal(path, size)
+        self.poll_seconds = poll_ms / 1000
+
+    def publish(self, payload: bytes):
+        self.journal.append(payload)
+
+    def prepare(self):
+        # Only what is appended from now on is for us
+        self._offset = self.journal.end()
+
+    def listen(self, deliver, missed, stopping: threading.Event):
+        offset = self._offset
+        while not stopping.wait(self.poll_seconds):
+            payloads, offset, lost = self.journal.read(offset)
+            if lost:
+                missed()
+            for payload in payloads:
+                deliver(payload)
+
+    def add(self, name: str, amount: int = 1):
+        self.journal.add(name, amount)
+
+    def counters(self):
+        return self.journal.counters()
+
+
+class PostgresTransport:
+    def __init__(self, database_url: str):
+        from sqlalchemy.engine import make_url
+
+        # A libpq URI, for connections of our own outside the pool
+        self.dsn = (
+            make_url(database_url)
+            .set(drivername="postgresql")
+            .render_as_string(hide_password=False)
+        )
+        self._lock = threading.Lock()
+        self._connection = None
+        self._counters = {}
+
+    def _connect(self):
+        import psycopg2
+
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        return connection
+
+    def publish(self, payload: bytes):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._connection is None or self._connection.closed:
+                        self._connection = self._connect()
+                    with self._connection.cursor() as cursor:
+                        cursor.execute(
+                            "SELECT pg_notify(%s, %s)",
+                            (NOTIFY_CHANNEL, payload.decode()),
+                        )
+                    return
+                except Exception:
+                    # Reconnect once, e.g. after the server closed an idle connection
+                    self._connection = None
+                    if attempt:
+                        raise
+
+    def _listen_connection(self):
+        connection = self._connect()
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        return connection
+
+    def prepare(self):
+        # Listening before returning, so nothing sent from now on is missed
+        self._listening = self._listen_connection()
+
+    def listen(self, deliver, missed, stopping: threading.Event):
+        connection = self._listening
+        while not stopping.is_set():
+            try:
+                if connection is None:
+                    connection = self._listen_connection()
+                if select.select([connection], [], [], 1)[0]:
+                    connection.poll()
+                    while connection.notifies:
+                        deliver(connection.notifies.pop(0).payload.encode())
+            except Exception:
+                logger.exception("Lost the LISTEN connection for shared state")
+                if connection is not None:
+                    connection.close()
+                connection = None
+                # NOTIFYs sent meanwhile are gone for good
+                missed()
+                stopping.wait(1)
+        if connection is not None:
+            connection.close()
+
+    def add(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class SharedState:
+    def __init__(self, transport=None):
+        self.transport = transport
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._batch = contextvars.ContextVar("shared_state_batch", default=None)
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.transport is not None
+
+    def publish(self, event: dict):
+        """
+        Send `event` to the other workers, or add it to the batch being collected.
+        """
+        if self.transport is None:
+            return
+        batch = self._batch.get()
+        if batch is not None:
+            batch.append(event)
+        else:
+            self._send([event])
+
+    @contextmanager
+    def batch(self):
+        # Events published inside go out together at the end, as few messages
+        if self.transport is None or self._batch.get() is not None:
+            yield
+            return
+        events = []
+        token = self._batch.set(events)
+        try:
+            yield
+        finally:
+            self._batch.reset(token)
+            if events:
+                self._send(events)
+
+    def _send(self, events):
+        # Split so each message fits into a NOTIFY payload
+        message = []
+        size = 0
+        for event in events:
+            encoded = json.dumps(event, separators=(",", ":"))
+            if message and size + len(encoded) > NOTIFY_MAX_BYTES:
+                self._send_message(message)
+                message, size = [], 0
+            message.append(encoded)
+            size += len(encoded) + 1
+        self._send_message(message)
+
+    def _send_message(self, encoded_events):
+        payload = (
+            f'{{"origin":"{self.worker_id}","events":[{",".join(encoded_events)}]}}'
+        )
+        try:
+            self.transport.publish(payload.encode())
+            self.transport.add("published", len(encoded_events))
+        except Exception:
+            # The change is committed either way; don't fail the request over it
+            logger.exception("Could not publish changes to the other workers")
+
+    def start(self, apply, resync):
+        """
+        Start applying other workers' events in a background thread:
+        `apply(events)` for each message, `resync()` after possibly missing some.
+        """
+        if self.transport is None or self._thread is not None:
+            return
+
+        def deliver(payload: bytes):
+            message = json.loads(payload)
+            if message["origin"] == self.worker_id:
+                return
+            try:
+                apply(message["events"])
+                self.transport.add("applied", len(message["events"]))
+            except Exception:
+                logger.exception("Could not apply changes from %s", message["origin"])
+                missed()
+
+        def missed():
+            logger.warning(
+                "May have missed changes from other workers, rebuilding state"
+            )
+            self.transport.add("resyncs")
+            resync()
+
+        self._stopping.clear()
+        self.transport.prepare()
+        self._thread = threading.Thread(
+            target=self.transport.listen,
+            args=(deliver, missed, self._stopping),
+            name="shared-state",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def stats(self):
+        stats = {"backend": SHARED_STATE, "worker": self.worker_id}
+        if self.transport is not None:
+            stats["counters"] = self.transport.counters()
+        return stats
+
+
+def _transport():
+    if SHARED_STATE == "mmap":
+        return MmapTransport(SHARED_STATE_PATH, SHARED_STATE_SIZE, SHARED_STATE_POLL_MS)
+    if SHARED_STATE == "postgres":
+        from .database import DATABASE_URL
+
+        return PostgresTransport(DATABASE_URL)
+    if SHARED_STATE != "none":
+        raise ValueError(f"Unknown SHARED_STATE backend: {SHARED_STATE}")
+    return None
+
+
+shared_state = SharedState(_transport())
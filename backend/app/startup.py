@@ -0,0 +1,140 @@
+"""
+Worker startup, run by the lifespan handler of the app.
+
+On boot a worker creates its engines, optionally migrates the schema, opens its
+pooled connections and builds the in-memory state the read routes serve from, so
+none of that lands on the first requests it takes. Each phase is timed; the
+timings are on /stats/startup and /metrics, and a warning is logged when a cold
+start (from the first app import to ready) goes over COLD_START_TARGET_MS.
+
+With MIGRATE_ON_STARTUP=0 workers leave the schema alone, and migrations are an
+explicit deploy step (`python -m app.migrations`) instead of every worker
+reflecting the database each time one boots.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from . import STARTED, archive, changes, migrations
+from .columnar import bet_columns
+from .database import (
+    DB_POOL_SIZE,
+    SessionLocal,
+    dispose_engines,
+    get_async_engine,
+    get_engine,
+    prewarm_async_pool,
+    prewarm_pool,
+)
+from .graph import shot_graph
+from .metrics import metrics
+from .replicas import replica_set
+from .settlements import settlement_book
+from .shared_state import shared_state
+from .stats import stats_book
+
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Connections opened per pool before serving (at most the pool size)
+DB_POOL_PREWARM = int(os.getenv("DB_POOL_PREWARM", DB_POOL_SIZE))
+# In-memory state built before serving, in this order; "none" builds nothing
+PREWARM = os.getenv("PREWARM", "graph,columns,stats,settlements")
+COLD_START_TARGET_MS = float(os.getenv("COLD_START_TARGET_MS", 3000))
+
+logger = logging.getLogger("app.startup")
+
+PREWARM_STEPS = {
+    "graph": shot_graph.snapshot,
+    "columns": bet_columns.ensure_built,
+    "stats": stats_book.ensure_built,
+    "settlements": settlement_book.snapshot,
+}
+
+# phase -> seconds, for this worker's last startup
+startup_timings = {}
+
+
+@contextmanager
+def _phase(name):
+    start = time.perf_counter()
+    yield
+    startup_timings[name] = time.perf_counter() - start
+
+
+def prewarm_steps():
+    names = [name.strip() for name in PREWARM.split(",") if name.strip()]
+    if names == ["none"]:
+        return []
+    unknown = set(names) - set(PREWARM_STEPS)
+    if unknown:
+        raise ValueError(f"Unknown PREWARM steps: {', '.join(sorted(unknown))}")
+    return names
+
+
+async def start():
+    startup_timings.clear()
+    # Everything from the first app import up to here
+    startup_timings["imports"] = time.perf_counter() - STARTED
+
+    with _phase("engine"):
+        engine = get_engine()
+        async_engine = get_async_engine()
+        replica_set.replicas()
+    if MIGRATE_ON_STARTUP:
+        with _phase("migrations"):
+            migrations.migrate(engine)
+    with _phase("pool"):
+        prewarm_pool(engine, min(DB_POOL_PREWARM, DB_POOL_SIZE))
+        if async_engine is not None:
+            await prewarm_async_pool(async_engine, min(DB_POOL_PREWARM, DB_POOL_SIZE))
+        await replica_set.prewarm(min(DB_POOL_PREWARM, DB_POOL_SIZE))
+
+    # Listen for other workers' changes before building anything from the
+    # database, so none committed meanwhile are missed
+    shared_state.start(changes.apply, changes.resync)
+
+    with SessionLocal() as db:
+        for name in prewarm_steps():
+            with _phase(name):
+                PREWARM_STEPS[name](db)
+
+    startup_timings["total"] = time.perf_counter() - STARTED
+    metrics.startup_seconds = dict(startup_timings)
+
+    total_ms = startup_timings["total"] * 1000
+    phases = ", ".join(
+        f"{name} {seconds * 1000:.0f} ms"
+        for name, seconds in startup_timings.items()
+        if name != "total"
+    )
+    if COLD_START_TARGET_MS and total_ms > COLD_START_TARGET_MS:
+        logger.warning(
+            "Cold start took %.0f ms, over the %.0f ms target (%s)",
+            total_ms,
+            COLD_START_TARGET_MS,
+            phases,
+        )
+    else:
+        logger.info("Ready in %.0f ms (%s)", total_ms, phases)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await start()
+    archiving = None
+    if archive.ARCHIVE_INTERVAL_MINUTES:
+        archiving = asyncio.create_task(
+            archive.archive_periodically(get_engine(), changes.bets_archived)
+        )
+    yield
+    if archiving is not None:
+        archiving.cancel()
+    shared_state.stop()
+    await replica_set.dispose()
+    await dispose_engines()
@@ -0,0 +1,188 @@
+"""
+Pre-aggregated bet statistics behind /data/stats.
+
+Every bet adds to daily buckets for three kinds of scope: everyone, each of the two
+users taking part, and their pair. A bucket holds the bets created and shots
+wagered that day, and the bets resolved, shots called and total resolution time
+(creation to resolution) of the bets resolved that day. Range queries add up
+buckets, so they cost the number of days in the window (or the number of buckets
+there are, if fewer), never the number of bets.
+
+The buckets are built from the columnar snapshot and the archived bets once, and
+kept up to date by the mutation hooks in changes.py, which hand over the bet's
+previous row so its old contribution can be taken out. Archiving a bet doesn't
+change them.
+"""
+
+import math
+import threading
+from datetime import date, timedelta
+
+from sqlalchemy.orm import Session
+
+from . import archive, models
+from .columnar import RESOLVED, bet_columns, bet_row
+
+DAY = 86400
+
+CREATED, WAGERED, RESOLVED_BETS, CALLED, RESOLUTION_SECONDS = range(5)
+
+_EPOCH = date(1970, 1, 1)
+
+
+def everyone():
+    return ("all",)
+
+
+def user_scope(user_id: int):
+    return ("user", user_id)
+
+
+def pair_scope(user_id: int, other_id: int):
+    return ("pair", min(user_id, other_id), max(user_id, other_id))
+
+
+def day_number(value: date) -> int:
+    return (value - _EPOCH).days
+
+
+def _week_start(day: int) -> int:
+    # Weeks start on Monday; day 0 (1970-01-01) was a Thursday
+    return day - (day + 3) % 7
+
+
+def _summary(counts):
+    return {
+        "bets_created": counts[CREATED],
+        "shots_wagered": counts[WAGERED],
+        "bets_resolved": counts[RESOLVED_BETS],
+        "shots_called": counts[CALLED],
+        "avg_resolution_hours": (
+            round(counts[RESOLUTION_SECONDS] / counts[RESOLVED_BETS] / 3600, 2)
+            if counts[RESOLVED_BETS]
+            else None
+        ),
+    }
+
+
+class StatsBook:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        # scope -> {day number: [created, wagered, resolved, called, seconds]}
+        self._buckets = {}
+
+    def build(self, db: Session):
+        with self._lock:
+            self._buckets = {}
+            for row in bet_columns.rows(db):
+                self._apply(row, 1)
+            # Archived bets are history too. Any the snapshot still has (archived
+            # since it was loaded) were counted above.
+            for bet_id, row in archive.archived_rows(db):
+                if bet_columns.row(bet_id) is None:
+                    self._apply(row, 1)
+            self._built = True
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+            self._buckets = {}
+
+    def ensure_built(self, db: Session):
+        with self._lock:
+            if not self._built:
+                self.build(db)
+
+    # Mutation hooks. `previous` is the bet's row before the change (see
+    # BetColumns.row), or None for a new bet.
+
+    def bet_saved(self, bet: models.Bet, previous):
+        with self._lock:
+            if not self._built:
+                return
+            if previous is not None:
+                self._apply(previous, -1)
+            self._apply(bet_row(bet), 1)
+
+    def bet_deleted(self, previous):
+        with self._lock:
+            if self._built and previous is not None:
+                self._apply(previous, -1)
+
+    def query(self, db: Session, scope, since=None, until=None, interval="day"):
+        """
+        Totals for `scope` over the days from `since` up to (not including) `until`,
+        plus one entry per `interval` ("day" or "week", none for "total") that has
+        any activity.
+        Open-ended windows run from the first to the last bucket of the scope.
+        """
+        with self._lock:
+            self.ensure_built(db)
+            buckets = self._buckets.get(scope, {})
+            first = day_number(since) if since is not None else min(buckets, default=0)
+            last = (
+                day_number(until) if until is not None else max(buckets, default=-1) + 1
+            )
+            if last - first <= len(buckets):
+                days = [day for day in range(first, last) if day in buckets]
+            else:
+                days = sorted(day for day in buckets if first <= day < last)
+
+            totals = [0] * 5
+            series = {}
+            for day in days:
+                for index, value in enumerate(buckets[day]):
+                    totals[index] += value
+                if interval != "total":
+                    entry = series.setdefault(
+                        _week_start(day) if interval == "week" else day, [0] * 5
+                    )
+                    for index, value in enumerate(buckets[day]):
+                        entry[index] += value
+
+        return {
+            "totals": _summary(totals),
+            "buckets": [
+                {"start": _EPOCH + timedelta(days=key), **_summary(counts)}
+                for key, counts in series.items()
+            ],
+        }
+
+    # Internals
+
+    def _apply(self, row, sign):
+        bettor_id, bettee_id, shots, status, created, resolved = row
+        scopes = [everyone(), user_scope(bettor_id)]
+        if bettee_id != bettor_id:
+            scopes += [user_scope(bettee_id), pair_scope(bettor_id, bettee_id)]
+
+        changes = []
+        if not math.isnan(created):
+            changes.append((int(created // DAY), ((CREATED, 1), (WAGERED, shots))))
+        if status == RESOLVED and not math.isnan(resolved):
+            seconds = int(max(resolved - created, 0)) if not math.isnan(created) else 0
+            changes.append(
+                (
+                    int(resolved // DAY),
+                    (
+                        (RESOLVED_BETS, 1),
+                        (CALLED, shots),
+                        (RESOLUTION_SECONDS, seconds),
+                    ),
+                )
+            )
+
+        for scope in scopes:
+            buckets = self._buckets.setdefault(scope, {})
+            for day, values in changes:
+                counts = buckets.setdefault(day, [0] * 5)
+                for index, value in values:
+                    counts[index] += sign * value
+                if not any(counts):
+                    del buckets[day]
+            if not buckets:
+                del self._buckets[scope]
+
+
+stats_book = StatsBook()
@@ -1,3 +1,39 @@
 # # #
 # Utility methods
 # # #
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*values) -> str:
+    """
+    Pack the sort key of the last row on a page into an opaque, URL safe token.
+    Datetimes are tagged so they come back as datetimes.
+    """
+    payload = [
+        {"dt": value.isoformat()} if isinstance(value, datetime) else value
+        for value in values
+    ]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, size: int) -> list:
+    """
+    Unpack a token made by `encode_cursor` holding `size` values.
+    Malformed tokens are a client error.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = [
+            datetime.fromisoformat(value["dt"]) if isinstance(value, dict) else value
+            for value in json.loads(raw)
+        ]
+    except (ValueError, TypeError, KeyError):
+        values = None
+    if not values or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
@@ -0,0 +1,121 @@
+"""
+How much archiving long-settled bets shrinks the hot bets table and its indexes,
+and what that does for the paths reading the live working set.
+
+Seeds a throwaway SQLite database through bench.seed (or uses --database-url,
+SQLite or Postgres), measures the size of `bets` and each of its indexes and
+times the hot paths, archives bets settled more than `--older-than-days` ago
+with app.archive, then measures again.
+
+    python -m bench.archive --users 1000 --bets 1000000 --older-than-days 90
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from bench.seed import populate
+
+
+def sizes(engine):
+    # Bytes used by the bets table and each of its indexes
+    from sqlalchemy import inspect
+
+    indexes = [index["name"] for index in inspect(engine).get_indexes("bets")]
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            # Dead tuples only give their space back once vacuumed
+            conn.exec_driver_sql("COMMIT")
+            conn.exec_driver_sql("VACUUM bets")
+            measure = lambda name: conn.exec_driver_sql(
+                "SELECT pg_relation_size(%s)", (name,)
+            ).scalar()
+        else:
+            measure = lambda name: conn.exec_driver_sql(
+                "SELECT coalesce(sum(pgsize), 0) FROM dbstat WHERE name = ?", (name,)
+            ).scalar()
+        result = {name: measure(name) for name in ["bets", *indexes]}
+    result["total"] = sum(result.values())
+    return result
+
+
+def timed(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 1)
+
+
+def hot_paths(runs):
+    # The reads that only see live bets: building the in-memory state, and the
+    # queries the async routes run
+    from app import aggregates, crud
+    from app.columnar import BetColumns
+    from app.database import SessionLocal
+    from app.graph import ShotGraph
+
+    with SessionLocal() as db:
+        busiest = aggregates.leaderboard(db)[0]["id"]
+        return {
+            "live_bets": db.query(crud.models.Bet).count(),
+            "graph_build_ms": timed(lambda: ShotGraph().build(db), runs),
+            "columns_build_ms": timed(lambda: BetColumns().build(db), runs),
+            "leaderboard_sql_ms": timed(lambda: aggregates.leaderboard(db), runs),
+            "busiest_user_bets_ms": timed(
+                lambda: crud.get_bets(db, limit=None, bettor_id=busiest), runs
+            ),
+            "busiest_user_balances_ms": timed(
+                lambda: aggregates.user_shot_balances(db, busiest), runs
+            ),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database-url", help="defaults to a throwaway SQLite file")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--bets", type=int, default=200000)
+    parser.add_argument("--older-than-days", type=float, default=90)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = (
+            args.database_url or f"sqlite:///{directory}/bench.sqlite"
+        )
+        seeded = populate(args.users, args.bets)
+
+        from app import archive
+        from app.database import get_engine
+
+        engine = get_engine()
+        before = {"sizes": sizes(engine), **hot_paths(args.runs)}
+        start = time.perf_counter()
+        archived = archive.archive_bets(engine, args.older_than_days)
+        seconds = time.perf_counter() - start
+        after = {"sizes": sizes(engine), **hot_paths(args.runs)}
+
+    print(
+        json.dumps(
+            {
+                "seeded": seeded,
+                "archived": archived,
+                "archive_seconds": round(seconds, 1),
+                "before": before,
+                "after": after,
+                "hot_size_ratio": round(
+                    after["sizes"]["total"] / before["sizes"]["total"], 3
+                ),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Throughput of the read routes with the sync stack vs DATABASE_ASYNC=1.
+
+Seeds a throwaway SQLite database through bench.seed, then for each mode starts
+uvicorn on it and keeps `--concurrency` requests in flight for `--duration`
+seconds.
+
+    python -m bench.async_vs_sync --users 200 --bets 20000 --concurrency 64
+
+Needs httpx, uvicorn and aiosqlite on top of the app's requirements.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench.seed import populate
+
+ENDPOINTS = [
+    "/users/{user}",
+    "/users/{user}/shot-balances",
+    "/users/{user}/bets-owed?limit=50",
+    "/users/{user}/related-users",
+    "/bets/{bet}",
+    "/bets/?limit=50",
+]
+
+
+async def load(base_url: str, users: int, bets: int, concurrency: int, duration: float):
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def worker(client):
+        while time.perf_counter() < deadline:
+            path = random.choice(ENDPOINTS).format(
+                user=random.randint(1, users), bet=random.randint(1, bets)
+            )
+            start = time.perf_counter()
+            response = await client.get(path)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=30
+    ) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / duration, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+    }
+
+
+def run_mode(database_url, async_mode, args):
+    env = dict(
+        os.environ, DATABASE_URL=database_url, DATABASE_ASYNC="1" if async_mode else "0"
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(args.port),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(base_url + "/")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        return asyncio.run(
+            load(base_url, args.users, args.bets, args.concurrency, args.duration)
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--bets", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8099)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{directory}/bench.sqlite"
+        os.environ["DATABASE_URL"] = database_url
+        populate(args.users, args.bets)
+        results = {
+            "sync": run_mode(database_url, False, args),
+            "async": run_mode(database_url, True, args),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
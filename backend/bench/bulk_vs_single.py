@@ -0,0 +1,113 @@
+"""
+Creating and resolving bets one request at a time vs through /bets/bulk and
+/bets/bulk-resolve.
+
+Runs the app in-process with TestClient against a throwaway SQLite database.
+
+    python -m bench.bulk_vs_single --users 50 --bets 500 --batch 100
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--bets", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.sqlite"
+        os.environ.setdefault("CACHE_BACKEND", "none")
+        from fastapi.testclient import TestClient
+
+        from app import models
+        from app.database import get_engine
+        from app.main import app
+
+        with TestClient(app) as client:
+            with get_engine().begin() as conn:
+                conn.execute(
+                    models.User.__table__.insert(),
+                    [
+                        {"id": i, "name": f"user {i}", "email": f"{i}@example.com"}
+                        for i in range(1, args.users + 1)
+                    ],
+                )
+
+            def new_bets():
+                bets = []
+                for _ in range(args.bets):
+                    bettor, bettee = random.sample(range(1, args.users + 1), 2)
+                    bets.append(
+                        {
+                            "bettor_id": bettor,
+                            "bettee_id": bettee,
+                            "shots": random.randint(1, 3),
+                            "description": "benchmark",
+                        }
+                    )
+                return bets
+
+            single_ids = []
+
+            def create_single():
+                for bet in new_bets():
+                    single_ids.append(client.post("/bets/", json=bet).json()["id"])
+
+            def resolve_single():
+                for bet_id in single_ids:
+                    client.put(
+                        f"/bets/{bet_id}", json={"outcome": "expired", "shots": 1}
+                    )
+
+            bulk_ids = []
+
+            def create_bulk():
+                bets = new_bets()
+                for i in range(0, len(bets), args.batch):
+                    result = client.post(
+                        "/bets/bulk", json=bets[i : i + args.batch]
+                    ).json()
+                    bulk_ids.extend(item["id"] for item in result["results"])
+
+            def resolve_bulk():
+                for i in range(0, len(bulk_ids), args.batch):
+                    client.post(
+                        "/bets/bulk-resolve",
+                        json=[
+                            {"id": bet_id, "outcome": "expired", "shots": 1}
+                            for bet_id in bulk_ids[i : i + args.batch]
+                        ],
+                    )
+
+            results = {}
+            for name, create, resolve in (
+                ("single", create_single, resolve_single),
+                ("bulk", create_bulk, resolve_bulk),
+            ):
+                create_seconds = timed(create)
+                resolve_seconds = timed(resolve)
+                results[name] = {
+                    "create_s": round(create_seconds, 3),
+                    "create_bets_per_s": round(args.bets / create_seconds, 1),
+                    "resolve_s": round(resolve_seconds, 3),
+                    "resolve_bets_per_s": round(args.bets / resolve_seconds, 1),
+                }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
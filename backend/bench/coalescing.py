@@ -0,0 +1,170 @@
+"""
+Concurrency check for the expensive aggregate routes (see app/limits.py).
+
+Seeds a throwaway SQLite database through bench.seed, then, through the app:
+- coalescing: `--clients` threads ask for /data/events (and /data/graph) at
+  the same moment, right after a write made them out of date, over `--rounds`
+  rounds. Each round should compute the result once, not once per client.
+- stale-while-revalidate: the same, with and without a stale window. With one,
+  readers get the previous result straight away instead of waiting.
+- shedding: with a budget of one computation at a time and a short wait, the
+  three expensive results are asked for at once after a write; what doesn't
+  get a slot in time is shed with a 503.
+- rate limits: one client asks more often than RATE_LIMIT_BURST allows.
+
+    python -m bench.coalescing --users 1000 --bets 20000 --clients 32
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from itertools import count
+
+from bench.seed import populate
+
+CLIENT_HEADER = "X-Bench-Client"
+RATE_LIMIT_BURST = 5
+STALE_SECONDS = 5
+
+
+def storm(client, paths, clients, ids):
+    # Every client asks at the same moment; returns (status, milliseconds) per request
+    barrier = threading.Barrier(clients)
+    results = [None] * clients
+
+    def ask(index):
+        headers = {CLIENT_HEADER: f"client-{next(ids)}"}
+        barrier.wait()
+        start = time.perf_counter()
+        status = client.get(paths[index % len(paths)], headers=headers).status_code
+        results[index] = (status, (time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=ask, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def counters(client, name):
+    return client.get("/stats/limits").json().get(name, {})
+
+
+def delta(after, before):
+    return {key: value - before.get(key, 0) for key, value in after.items()}
+
+
+def latencies(results):
+    timings = sorted(ms for _, ms in results)
+    return {
+        "p50_ms": round(statistics.median(timings), 1),
+        "max_ms": round(timings[-1], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--bets", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{directory}/bench.sqlite",
+            PREWARM="graph",
+            EXPENSIVE_CONCURRENCY="1",
+            EXPENSIVE_WAIT_MS="50",
+            RATE_LIMIT_PER_MINUTE="60",
+            RATE_LIMIT_BURST=str(RATE_LIMIT_BURST),
+            RATE_LIMIT_CLIENT_HEADER=CLIENT_HEADER,
+        )
+        seeded = populate(args.users, args.bets)
+
+        from fastapi.testclient import TestClient
+
+        from app import limits
+        from app.main import app
+
+        ids = count()
+        results = {"seeded": seeded, "clients": args.clients, "rounds": args.rounds}
+        with TestClient(app) as client:
+
+            def write():
+                client.post(
+                    "/bets/",
+                    json={
+                        "bettor_id": 1,
+                        "bettee_id": 2,
+                        "shots": 1,
+                        "description": "storm",
+                    },
+                    headers={CLIENT_HEADER: f"writer-{next(ids)}"},
+                ).raise_for_status()
+                # Otherwise the client's own reads would skip stale results
+                client.cookies.clear()
+
+            for path, name in (("/data/events", "events"), ("/data/graph", "graph")):
+                client.get(path)
+                for stale_seconds in (0, STALE_SECONDS):
+                    limits.STALE_WHILE_REVALIDATE_SECONDS = stale_seconds
+                    before = counters(client, name)
+                    runs = []
+                    for _ in range(args.rounds):
+                        write()
+                        runs += storm(client, [path], args.clients, ids)
+                        # Let a background recomputation finish before the next round
+                        time.sleep(0.5)
+                    after = delta(counters(client, name), before)
+                    results[f"{name}_stale_{stale_seconds}s"] = {
+                        "requests": after["requests"],
+                        "computed": after["computed"],
+                        "coalesced": after["coalesced"],
+                        "stale_served": after["stale_served"],
+                        "errors": sum(status != 200 for status, _ in runs),
+                        **latencies(runs),
+                    }
+            limits.STALE_WHILE_REVALIDATE_SECONDS = 0
+
+            # Three different expensive results at once, one slot with a 50 ms wait
+            shed = []
+            for _ in range(args.rounds):
+                write()
+                shed += storm(
+                    client,
+                    [
+                        "/data/events",
+                        "/data/events?include_archived=true",
+                        "/data/graph",
+                    ],
+                    args.clients,
+                    ids,
+                )
+            results["shedding"] = {
+                "ok": sum(status == 200 for status, _ in shed),
+                "shed_503": sum(status == 503 for status, _ in shed),
+                "other": sum(status not in (200, 503) for status, _ in shed),
+            }
+
+            # One client, well over its burst
+            statuses = [
+                client.get("/data/graph", headers={CLIENT_HEADER: "greedy"}).status_code
+                for _ in range(RATE_LIMIT_BURST * 3)
+            ]
+            results["rate_limit"] = {
+                "ok": statuses.count(200),
+                "rate_limited_429": statuses.count(429),
+            }
+            results["limits"] = client.get("/stats/limits").json()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
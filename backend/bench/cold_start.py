@@ -0,0 +1,117 @@
+"""
+Cold start of a worker: from spawning uvicorn to serving, with and without
+building the in-memory state at startup (PREWARM).
+
+Seeds a throwaway SQLite database through bench.seed and migrates it once, as a
+deploy would, then for each mode starts uvicorn `--runs` times with
+MIGRATE_ON_STARTUP=0 and times how long until it answers `/`, and how long the
+first requests to the routes serving from memory then take. The startup phases
+the worker reports on /stats/startup are included.
+
+    python -m bench.cold_start --users 1000 --bets 100000 --runs 3
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench.seed import populate
+
+FIRST_REQUESTS = [
+    "/data/graph",
+    "/data/leaderboard",
+    "/data/settlements",
+    "/data/stats",
+]
+
+
+def cold_start(database_url: str, prewarm: str, port: int):
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        MIGRATE_ON_STARTUP="0",
+        PREWARM=prewarm,
+    )
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        while True:
+            try:
+                httpx.get(base_url + "/")
+                break
+            except httpx.TransportError:
+                if server.poll() is not None:
+                    raise RuntimeError("uvicorn exited during startup")
+                time.sleep(0.01)
+        ready = time.perf_counter() - start
+        first = {}
+        for path in FIRST_REQUESTS:
+            request_start = time.perf_counter()
+            httpx.get(base_url + path, timeout=300).raise_for_status()
+            first[path] = round((time.perf_counter() - request_start) * 1000, 1)
+        phases = httpx.get(base_url + "/stats/startup").json()
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "ready_ms": round(ready * 1000, 1),
+        "first_request_ms": first,
+        "phases_ms": phases,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--bets", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8098)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{directory}/bench.sqlite"
+        os.environ["DATABASE_URL"] = database_url
+        populate(args.users, args.bets)
+        for mode, prewarm in (
+            ("lazy", "none"),
+            ("prewarmed", "graph,columns,stats,settlements"),
+        ):
+            runs = [
+                cold_start(database_url, prewarm, args.port) for _ in range(args.runs)
+            ]
+            results[mode] = {
+                "ready_ms": statistics.median(run["ready_ms"] for run in runs),
+                "first_request_ms": {
+                    path: statistics.median(
+                        run["first_request_ms"][path] for run in runs
+                    )
+                    for path in FIRST_REQUESTS
+                },
+                "phases_ms": runs[-1]["phases_ms"],
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Memory and CPU of the analytics computations done over ORM Bet instances vs over
+the columnar snapshot in app/columnar.py.
+
+Seeds a throwaway SQLite database through bench.seed, then for each path loads
+the bets and computes leaderboard totals, per-pair balances and daily bucket
+counts. Time and peak memory are measured in separate passes, as tracemalloc
+slows everything down.
+
+    python -m bench.columnar_vs_orm --users 1000 --bets 1000000
+"""
+
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench.seed import populate
+
+DAY = 86400
+
+
+def orm_path(db):
+    # What the analytics code used to do: one Bet instance and one dict per bet
+    from app import models
+    from app.columnar import timestamp
+
+    bets = [
+        {
+            "from": bet.bettor_id,
+            "to": bet.bettee_id,
+            "value": bet.shots,
+            "status": bet.status,
+            "created": bet.created_at,
+            "resolved": bet.resolved_at,
+        }
+        for bet in db.query(models.Bet).all()
+    ]
+    owed, owed_to, pairs, buckets = {}, {}, {}, {}
+    for bet in bets:
+        is_open = bet["status"] == models.BetStatus.open
+        shots = bet["value"] if is_open else 0
+        owed[bet["from"]] = owed.get(bet["from"], 0) + shots
+        owed_to[bet["to"]] = owed_to.get(bet["to"], 0) + shots
+        if is_open:
+            low, high = sorted((bet["from"], bet["to"]))
+            signed = shots if bet["from"] == low else -shots
+            pairs[low, high] = pairs.get((low, high), 0) + signed
+        day = int(timestamp(bet["created"]) // DAY)
+        buckets[day] = buckets.get(day, 0) + 1
+    return bets, owed, owed_to, pairs, buckets
+
+
+def columnar_path(db):
+    from app.columnar import BetColumns
+
+    columns = BetColumns()
+    columns.build(db)
+    return (
+        columns,
+        columns.leaderboard_totals(db),
+        columns.pair_balances(db),
+        columns.bucket_counts(db, DAY),
+    )
+
+
+def measure(fn, db):
+    gc.collect()
+    start = time.perf_counter()
+    result = fn(db)
+    seconds = time.perf_counter() - start
+    del result
+    db.expunge_all()
+    gc.collect()
+
+    tracemalloc.start()
+    result = fn(db)
+    _, peak = tracemalloc.get_traced_memory()
+    # What stays resident once the computation is done
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    db.expunge_all()
+    return {
+        "seconds": round(seconds, 3),
+        "peak_mb": round(peak / 2**20, 1),
+        "retained_mb": round(retained / 2**20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--bets", type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.sqlite"
+        populate(args.users, args.bets)
+
+        from app import columnar
+        from app.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            results = {
+                "bets": args.bets,
+                "numpy": columnar.numpy is not None,
+                "orm": measure(orm_path, db),
+                "columnar": measure(columnar_path, db),
+            }
+            # Once loaded, the snapshot answers from memory
+            columns = columnar.BetColumns()
+            columns.build(db)
+            kernels = {}
+            for name, kernel in (
+                ("leaderboard_totals", lambda: columns.leaderboard_totals(db)),
+                ("pair_balances", lambda: columns.pair_balances(db)),
+                ("bucket_counts", lambda: columns.bucket_counts(db, DAY)),
+                ("counterparty_totals", lambda: columns.counterparty_totals(db, 1)),
+            ):
+                start = time.perf_counter()
+                kernel()
+                kernels[name] = round((time.perf_counter() - start) * 1000, 2)
+            results["columnar"]["snapshot_mb"] = round(columns.nbytes / 2**20, 1)
+            results["columnar"]["kernel_ms"] = kernels
+        finally:
+            db.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Serializing 10k bets through the response models vs the fast path in
+app/fast_responses.py, for schemas.Bet and schemas.BetDetail.
+
+The default path is what FastAPI does for a response_model route: ORM instances
+are validated into the model, run through jsonable_encoder and dumped by
+JSONResponse. The fast path selects plain rows, shapes them into dicts and dumps
+them with orjson. Both must produce byte-identical bodies.
+
+    python -m bench.fast_json --rows 10000
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+from typing import List
+
+
+def seed(rows: int):
+    from app import migrations, models
+    from app.database import get_engine
+
+    engine = get_engine()
+    migrations.migrate(engine)
+    now = models.utcnow()
+    with engine.begin() as conn:
+        conn.execute(
+            models.User.__table__.insert(),
+            [
+                {"id": i, "name": f"user {i} ✓", "email": f"{i}@example.com"}
+                for i in range(1, 101)
+            ],
+        )
+        conn.execute(
+            models.Bet.__table__.insert(),
+            [
+                {
+                    "id": i,
+                    "date_created": now,
+                    "created_at": now,
+                    "bettor_id": random.randint(1, 100),
+                    "bettee_id": random.randint(1, 100),
+                    "shots": random.randint(1, 5),
+                    "description": f'benchmark bet "{i}" 🍻',
+                    "outcome": random.choice([None, "expired", "2024-01-01T10:00:00"]),
+                    "status": models.BetStatus.open,
+                }
+                for i in range(1, rows + 1)
+            ],
+        )
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.sqlite"
+        seed(args.rows)
+
+        from fastapi.responses import JSONResponse
+        from fastapi.routing import serialize_response
+        from fastapi.utils import create_response_field
+
+        from app import crud, fast_responses, models, schemas
+        from app.database import SessionLocal
+
+        db = SessionLocal()
+
+        def model_path(response_model, load):
+            field = create_response_field(name="response", type_=response_model)
+
+            def run():
+                db.expunge_all()
+                content = asyncio.run(
+                    serialize_response(
+                        field=field, response_content=load(), is_coroutine=True
+                    )
+                )
+                return JSONResponse(content).body
+
+            return run
+
+        def bet_details():
+            return [
+                schemas.BetDetail(
+                    id=bet.id,
+                    shots=bet.shots,
+                    description=bet.description,
+                    outcome=bet.outcome,
+                    date_created=bet.date_created,
+                    counterparty=schemas.UserBasic(id=user.id, name=user.name),
+                )
+                for bet, user in db.query(models.Bet, models.User)
+                .join(models.User, models.Bet.bettee_id == models.User.id)
+                .order_by(models.Bet.id)
+            ]
+
+        def bet_detail_rows():
+            return (
+                db.query(
+                    *crud.BET_ROW_COLUMNS,
+                    models.User.id.label("counterparty_id"),
+                    models.User.name.label("counterparty_name"),
+                )
+                .join(models.User, models.Bet.bettee_id == models.User.id)
+                .order_by(models.Bet.id)
+                .all()
+            )
+
+        cases = {
+            "Bet": (
+                model_path(
+                    List[schemas.Bet],
+                    lambda: db.query(models.Bet).order_by(models.Bet.id).all(),
+                ),
+                lambda: fast_responses.dumps(
+                    fast_responses.bet_dicts(
+                        db.query(*crud.BET_ROW_COLUMNS).order_by(models.Bet.id).all()
+                    )
+                ),
+            ),
+            "BetDetail": (
+                model_path(List[schemas.BetDetail], bet_details),
+                lambda: fast_responses.dumps(
+                    fast_responses.bet_detail_dicts(bet_detail_rows())
+                ),
+            ),
+        }
+
+        results = {"rows": args.rows, "orjson": fast_responses.orjson is not None}
+        for name, (model_run, fast_run) in cases.items():
+            model_seconds, model_body = best_of(args.repeat, model_run)
+            fast_seconds, fast_body = best_of(args.repeat, fast_run)
+            if model_body != fast_body:
+                raise SystemExit(
+                    f"{name}: the fast path's output differs from the response model's"
+                )
+            results[name] = {
+                "identical": True,
+                "bytes": len(fast_body),
+                "model_ms": round(model_seconds * 1000, 1),
+                "fast_ms": round(fast_seconds * 1000, 1),
+                "speedup": round(model_seconds / fast_seconds, 1),
+            }
+
+        body = fast_body
+        compression = {}
+        codecs = [("gzip", lambda: gzip.compress(body, compresslevel=5))]
+        if fast_responses.brotli is not None:
+            codecs.append(
+                ("br", lambda: fast_responses.brotli.compress(body, quality=4))
+            )
+        for codec, compress in codecs:
+            seconds, compressed = best_of(args.repeat, compress)
+            compression[codec] = {
+                "bytes": len(compressed),
+                "ms": round(seconds * 1000, 1),
+            }
+        results["compression"] = compression
+        db.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Read-replica routing checked end to end, with two SQLite files standing in for a
+primary and its replica.
+
+Seeds the primary through bench.seed and copies it to the replica, then keeps
+copying it over every `--lag` seconds in a background thread (the replica is
+that far behind, at most). Through the app, it then checks:
+- read-your-writes: after creating a bet, the writer finds it in /bets/search
+  straight away (with its cookie, or with the X-Read-Primary-Until header sent
+  back), while a client that didn't write may not until the next copy
+- routing: a mix of reads with a write every `--write-every` requests, and
+  which reads the replica served (/stats/replicas), then the same reads once
+  writes have stopped for longer than the replica's maximum lag
+- failover: with the replica gone, reads still succeed from the primary, and
+  go back to the replica once it is back and REPLICA_RETRY_SECONDS have passed
+
+    python -m bench.replicas --users 1000 --bets 20000 --lag 1
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from bench.seed import populate
+
+READS = [
+    "/bets/?limit=50",
+    "/bets/search?q=marathon",
+    "/users/3/bets-owed?limit=20",
+    "/users/3/bet-summary?limit=20",
+    "/data/events",
+    "/data/leaderboard",
+]
+
+
+def copy(source: str, target: str):
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+
+
+def replicate(
+    source: str,
+    target: str,
+    lag: float,
+    paused: threading.Event,
+    stopping: threading.Event,
+):
+    while not stopping.wait(lag):
+        if not paused.is_set():
+            copy(source, target)
+
+
+def routed(client, before):
+    # Reads served since `before`, by where they went, and how long that took
+    stats = client.get("/stats/replicas").json()
+    after = {
+        "replica": sum(replica["reads"] for replica in stats["replicas"]),
+        **stats["primary_reads"],
+        "seconds": time.perf_counter(),
+    }
+    if before is None:
+        return after
+    return {key: round(after[key] - before[key], 1) for key in after}
+
+
+def read_all(client, runs):
+    failed = 0
+    for _ in range(runs):
+        for path in READS:
+            failed += client.get(path).status_code >= 500
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--bets", type=int, default=20000)
+    parser.add_argument(
+        "--lag", type=float, default=1, help="seconds between copies to the replica"
+    )
+    parser.add_argument("--writes", type=int, default=20)
+    parser.add_argument("--write-every", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        primary = f"{directory}/primary.sqlite"
+        replica_dir = f"{directory}/replica"
+        os.mkdir(replica_dir)
+        replica = f"{replica_dir}/replica.sqlite"
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{primary}",
+            DATABASE_REPLICA_URLS=f"sqlite:///{replica}",
+            REPLICA_MAX_LAG_SECONDS=str(args.lag * 2),
+            REPLICA_RETRY_SECONDS=str(args.lag),
+            PREWARM="none",
+        )
+        seeded = populate(args.users, args.bets)
+        copy(primary, replica)
+
+        from fastapi.testclient import TestClient
+
+        from app.main import app
+        from app.replicas import (
+            REPLICA_MAX_LAG_SECONDS,
+            REPLICA_RETRY_SECONDS,
+            STICKY_HEADER,
+            replica_set,
+        )
+
+        paused, stopping = threading.Event(), threading.Event()
+        copier = threading.Thread(
+            target=replicate,
+            args=(primary, replica, args.lag, paused, stopping),
+            daemon=True,
+        )
+        copier.start()
+        results = {"seeded": seeded}
+        with TestClient(app) as client:
+            # The writer has a cookie jar of its own
+            writer = TestClient(app)
+
+            def write(word):
+                response = writer.post(
+                    "/bets/",
+                    json={
+                        "bettor_id": 1,
+                        "bettee_id": 2,
+                        "shots": 1,
+                        "description": f"replica {word}",
+                    },
+                )
+                response.raise_for_status()
+                return response
+
+            def found(reader, word, **kwargs):
+                return bool(
+                    reader.get("/bets/search", params={"q": word}, **kwargs).json()
+                )
+
+            consistency = {
+                "writes": args.writes,
+                "missed_by_writer": 0,
+                "missed_with_header": 0,
+                "missed_by_others": 0,
+            }
+            for index in range(args.writes):
+                word = f"ryw{index}check"
+                token = write(word).headers[STICKY_HEADER]
+                consistency["missed_by_writer"] += not found(writer, word)
+                consistency["missed_with_header"] += not found(
+                    client, word, headers={STICKY_HEADER: token}
+                )
+                consistency["missed_by_others"] += not found(client, word)
+            results["read_your_writes"] = consistency
+
+            before = routed(client, None)
+            failed = 0
+            for index in range(args.writes * args.write_every):
+                if index % args.write_every == 0:
+                    write(f"mixed{index}")
+                failed += client.get(READS[index % len(READS)]).status_code >= 500
+            results["with_writes"] = {"failed": failed, **routed(client, before)}
+
+            # Once nothing has changed for longer than a replica can lag,
+            # cached reads may come from the replica too
+            time.sleep(REPLICA_MAX_LAG_SECONDS)
+            before = routed(client, None)
+            failed = read_all(client, args.writes)
+            results["without_writes"] = {"failed": failed, **routed(client, before)}
+
+            # The replica goes away: stop copying, move the file out of reach and
+            # drop its pooled connections, as a restarting server would
+            paused.set()
+            time.sleep(args.lag)
+            os.rename(replica_dir, replica_dir + "-down")
+            replica_set.replicas()[0].engine.dispose()
+            before = routed(client, None)
+            failed = read_all(client, args.writes)
+            results["replica_down"] = {"failed": failed, **routed(client, before)}
+
+            os.rename(replica_dir + "-down", replica_dir)
+            paused.clear()
+            time.sleep(REPLICA_RETRY_SECONDS)
+            before = routed(client, None)
+            failed = read_all(client, args.writes)
+            results["replica_back"] = {"failed": failed, **routed(client, before)}
+            results["replicas"] = client.get("/stats/replicas").json()["replicas"]
+        stopping.set()
+        copier.join()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Latency of GET /bets/search over the full-text index, for queries from rare to
+very common words, against a LIKE scan of the descriptions for the same word.
+
+Seeds a throwaway SQLite database through bench.seed (the index is filled in
+by its triggers as bets are inserted), then times each query `--runs` times
+through the app. For each query it reports how many bets match, the median and
+p95 latency, and whether the query plan scans the bets table.
+
+    python -m bench.search --users 1000 --bets 1000000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from bench.seed import populate
+
+QUERIES = [
+    {"q": "Skyler 317"},
+    {"q": "marathon", "user_id": 317},
+    {"q": "rains", "status": "open"},
+    {"q": "bears playoffs"},
+    {"q": "mara"},
+    {"q": "the"},
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--bets", type=int, default=1000000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.sqlite"
+        # Search doesn't use the in-memory state, so don't spend startup on it
+        os.environ["PREWARM"] = "none"
+        seeded = populate(args.users, args.bets)
+
+        from fastapi.testclient import TestClient
+        from sqlalchemy import event, func, select
+
+        from app import search
+        from app.database import get_engine
+        from app.main import app
+
+        engine = get_engine()
+        statements = []
+
+        def explain(conn, cursor, statement, parameters, context, executemany):
+            if "bet_search" in statement and not statement.startswith("EXPLAIN"):
+                statements.append((statement, parameters))
+
+        event.listen(engine, "before_cursor_execute", explain)
+
+        results = {"seeded": seeded, "queries": {}}
+        with TestClient(app) as client:
+            for params in QUERIES:
+                word = search.terms(params["q"])[0]
+                index, _, condition, _ = search.matching(
+                    engine.dialect.name, params["q"]
+                )
+                with engine.connect() as conn:
+                    matches = conn.execute(
+                        select(func.count()).select_from(index).where(condition)
+                    ).scalar()
+                    start = time.perf_counter()
+                    conn.exec_driver_sql(
+                        "SELECT count(*) FROM bets WHERE description LIKE ?",
+                        (f"%{word}%",),
+                    ).scalar()
+                    like_ms = (time.perf_counter() - start) * 1000
+
+                timings = []
+                for _ in range(args.runs):
+                    statements.clear()
+                    start = time.perf_counter()
+                    client.get("/bets/search", params=params).raise_for_status()
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+
+                statement, parameters = statements[-1]
+                with engine.connect() as conn:
+                    plan = [
+                        row[-1]
+                        for row in conn.exec_driver_sql(
+                            "EXPLAIN QUERY PLAN " + statement, parameters
+                        )
+                    ]
+                results["queries"][json.dumps(params)] = {
+                    "matches": matches,
+                    "p50_ms": round(statistics.median(timings), 2),
+                    "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+                    "like_scan_ms": round(like_ms, 1),
+                    "scans_bets": any(step.startswith("SCAN bets") for step in plan),
+                }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
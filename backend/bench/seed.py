@@ -0,0 +1,226 @@
+"""
+Synthetic populations for the benchmarks, written through the app's models into
+whatever DATABASE_URL points at (SQLite or Postgres).
+
+The data is shaped like real use rather than uniform noise:
+- a few users take part in most bets (activity follows a Zipf-like curve), and
+  most bets are between friends who bet each other again and again
+- most bets are for one or two shots, with a long tail
+- bets are spread over `--days`, and are resolved after a log-normally
+  distributed delay (a few days typically); the latest ones are still open
+- of the bets that are closed, most are resolved, the rest expired or incomplete
+
+Seeding is deterministic for a given `--seed`.
+
+    python -m bench.seed --users 1000 --bets 1000000 \
+        --database-url sqlite:///bench.sqlite
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import time
+from datetime import timedelta
+
+DAY = 86400
+
+FIRST_NAMES = (
+    "Alex",
+    "Sam",
+    "Jordan",
+    "Taylor",
+    "Casey",
+    "Riley",
+    "Morgan",
+    "Jamie",
+    "Avery",
+    "Quinn",
+    "Drew",
+    "Reese",
+    "Skyler",
+    "Charlie",
+    "Rowan",
+    "Emerson",
+    "Finley",
+    "Hayden",
+)
+DESCRIPTIONS = (
+    "{team} win tonight",
+    "{team} cover the spread",
+    "I finish the marathon under four hours",
+    "it rains on Saturday",
+    "you can't go a week without coffee",
+    "the new season is better than the last",
+    "{team} make the playoffs",
+    "I get to the gym five days this week",
+    "you're late to dinner again",
+    "the movie is over two hours",
+)
+TEAMS = ("the Bears", "the Cubs", "the Bulls", "the Sox", "the Hawks", "the Fire")
+
+SHOTS = (1, 2, 3, 4, 5, 10)
+SHOT_WEIGHTS = (48, 26, 12, 6, 5, 3)
+
+# How closed bets end up, and the share of bets that are never closed at all
+CLOSED_WEIGHTS = {"resolved": 75, "expired": 15, "incomplete": 10}
+NEVER_CLOSED = 0.1
+# Median time to close a bet, and how widely it varies (log-normal)
+CLOSE_MEDIAN_HOURS = 72
+CLOSE_SIGMA = 1.2
+
+
+def activity_weights(rng: random.Random, users: int):
+    # Zipf-like: the user ranked r takes part in bets in proportion to 1 / r.
+    # Cumulative, so each draw is a bisection rather than a pass over every user
+    weights = [1 / rank for rank in range(1, users + 1)]
+    rng.shuffle(weights)
+    return list(itertools.accumulate(weights))
+
+
+def friend_lists(rng: random.Random, users: int, cum_weights, friends: int):
+    # Everyone bets mostly with a small circle, which also favours busy users
+    population = range(1, users + 1)
+    circles = {}
+    for user_id in population:
+        circle = set()
+        while len(circle) < min(friends, users - 1):
+            other = rng.choices(population, cum_weights=cum_weights)[0]
+            if other != user_id:
+                circle.add(other)
+        circles[user_id] = list(circle)
+    return circles
+
+
+def generate_users(users: int):
+    for user_id in range(1, users + 1):
+        name = f"{FIRST_NAMES[user_id % len(FIRST_NAMES)]} {user_id}"
+        yield {"id": user_id, "name": name, "email": f"user{user_id}@example.com"}
+
+
+def generate_bets(
+    rng: random.Random, users: int, bets: int, days: int, now, friends: int = 12
+):
+    """
+    Bet rows in id (and creation) order, with the status, resolution time and
+    outcome string the app would have stored for them.
+    """
+    from app import models
+
+    if users < 2:
+        raise ValueError("Bets need at least two users")
+    cum_weights = activity_weights(rng, users)
+    circles = friend_lists(rng, users, cum_weights, friends)
+    population = range(1, users + 1)
+    closed = list(CLOSED_WEIGHTS)
+    closed_weights = list(CLOSED_WEIGHTS.values())
+    start = now - timedelta(days=days)
+    step = days * DAY / max(bets, 1)
+
+    for bet_id in range(1, bets + 1):
+        bettor = rng.choices(population, cum_weights=cum_weights)[0]
+        if rng.random() < 0.85:
+            bettee = rng.choice(circles[bettor])
+        else:
+            bettee = bettor
+            while bettee == bettor:
+                bettee = rng.choice(population)
+        # Creation times increase with the id, with some jitter
+        created = start + timedelta(seconds=(bet_id - rng.random()) * step)
+
+        status, resolved_at, outcome = models.BetStatus.open, None, None
+        if rng.random() >= NEVER_CLOSED:
+            hours = rng.lognormvariate(math.log(CLOSE_MEDIAN_HOURS), CLOSE_SIGMA)
+            closed_at = created + timedelta(hours=hours)
+            if closed_at < now:
+                status = models.BetStatus(rng.choices(closed, closed_weights)[0])
+                if status == models.BetStatus.resolved:
+                    resolved_at = closed_at.replace(microsecond=0)
+                    outcome = resolved_at.strftime("%Y-%m-%dT%H:%M:%S")
+                else:
+                    outcome = status.value
+
+        yield {
+            "id": bet_id,
+            "bettor_id": bettor,
+            "bettee_id": bettee,
+            "shots": rng.choices(SHOTS, SHOT_WEIGHTS)[0],
+            "description": rng.choice(DESCRIPTIONS).format(team=rng.choice(TEAMS)),
+            "date_created": created,
+            "created_at": created,
+            "outcome": outcome,
+            "status": status,
+            "resolved_at": resolved_at,
+        }
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def populate(
+    users: int, bets: int, days: int = 365, seed: int = 0, chunk_size: int = 20000
+):
+    """
+    Create the schema in the app's database and fill it with `users` users and
+    `bets` bets. Returns a summary of what was written.
+    """
+    from app import migrations, models
+    from app.database import get_engine
+
+    engine = get_engine()
+    migrations.migrate(engine)
+    rng = random.Random(seed)
+    now = models.utcnow().replace(microsecond=0)
+    statuses = dict.fromkeys((status.value for status in models.BetStatus), 0)
+
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for rows in _chunks(generate_users(users), chunk_size):
+            conn.execute(models.User.__table__.insert(), rows)
+        for rows in _chunks(generate_bets(rng, users, bets, days, now), chunk_size):
+            for row in rows:
+                statuses[row["status"].value] += 1
+            conn.execute(models.Bet.__table__.insert(), rows)
+        if engine.dialect.name == "postgresql":
+            # Ids were given explicitly, so move the sequences past them
+            for table in ("users", "bets"):
+                conn.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {table}), 1))"
+                )
+
+    return {
+        "users": users,
+        "bets": bets,
+        "days": days,
+        "seed": seed,
+        "statuses": statuses,
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--bets", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url
+    print(json.dumps(populate(args.users, args.bets, args.days, args.seed), indent=2))
+
+
+if __name__ == "__main__":
+    main()
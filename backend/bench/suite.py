@@ -0,0 +1,439 @@
+"""
+Latency and throughput of every route in app/routers/, driven in-process.
+
+`run` seeds a database through bench.seed (a throwaway SQLite file unless
+`--database-url` is given; `--no-seed` reuses one seeded before), then sends
+`--requests` requests to each endpoint in turn with TestClient and writes the
+throughput and p50/p95/p99 latency of each to `--output` as JSON. The first
+request to an endpoint is timed on its own (`first_ms`), as it pays for building
+whatever the route keeps in memory, and is left out of the percentiles.
+
+`compare` reads two result files and flags the endpoints whose p95 grew by more
+than `--threshold`, exiting with status 1 if there are any.
+
+    python -m bench.suite run --users 1000 --bets 1000000 --output after.json
+    python -m bench.suite compare before.json after.json --threshold 0.15
+
+Writes run after the reads, so the read numbers are for the seeded data. Set
+DATABASE_ASYNC, FAST_RESPONSES, CACHE_BACKEND etc. in the environment as for the
+app; the ones that were set are recorded with the results.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from bench.seed import populate
+
+# Environment variables that change what is measured
+SETTINGS = (
+    "DATABASE_ASYNC",
+    "FAST_RESPONSES",
+    "CACHE_BACKEND",
+    "CACHE_TTL",
+    "DB_POOL_SIZE",
+    "COMPRESS_MIN_SIZE",
+    "SERVER_TIMING",
+    "SETTLEMENT_EXACT_LIMIT",
+)
+
+# Routes answering with every bet (or event) at once run this much less often
+HEAVY_SHARE = 10
+
+
+class Endpoint:
+    def __init__(self, router, method, path, body=None, heavy=False, stream=False):
+        self.router = router
+        self.method = method
+        self.path = path
+        self.body = body
+        self.heavy = heavy
+        self.stream = stream
+
+    @property
+    def name(self):
+        return f"{self.method} {self.path}"
+
+
+class Population:
+    """What the requests pick their ids from, and what the writes created."""
+
+    def __init__(self, users, bets, seed):
+        self.users = users
+        self.bets = bets
+        self.rng = random.Random(seed)
+        self.new_bets = []
+        self.new_users = []
+        self.created_users = 0
+
+    def values(self, endpoint):
+        user, other = self.rng.sample(range(1, self.users + 1), 2)
+        values = {
+            "user": user,
+            "other": other,
+            "bet": self.rng.randint(1, self.bets),
+            "key": os.environ["DATA_UPDATE_KEY"],
+        }
+        # Deletes take up the ids the writes created, other routes just pick one
+        for name, created in (("new_bet", self.new_bets), ("new_user", self.new_users)):
+            if f"{{{name}}}" not in endpoint.path:
+                continue
+            if not created:
+                values[name] = 0
+            elif endpoint.method == "DELETE":
+                values[name] = created.pop()
+            else:
+                values[name] = self.rng.choice(created)
+        return values
+
+    def new_bet(self, _values=None):
+        bettor, bettee = self.rng.sample(range(1, self.users + 1), 2)
+        return {
+            "bettor_id": bettor,
+            "bettee_id": bettee,
+            "shots": self.rng.randint(1, 3),
+            "description": "benchmark",
+        }
+
+    def outcome(self):
+        if self.rng.random() < 0.8:
+            resolved = datetime.now(timezone.utc) - timedelta(
+                minutes=self.rng.randint(0, 10000)
+            )
+            return resolved.strftime("%Y-%m-%dT%H:%M:%S")
+        return self.rng.choice(("expired", "incomplete"))
+
+    def new_user(self, _values=None):
+        self.created_users += 1
+        return {
+            "name": f"bench {self.created_users}",
+            "email": f"bench{self.created_users}@example.com",
+        }
+
+
+def endpoints(population):
+    p = population
+    return [
+        # Reads
+        Endpoint("users", "GET", "/users/?limit=100"),
+        Endpoint("users", "GET", "/users/{user}"),
+        Endpoint("users", "GET", "/users/{user}/shot-balances"),
+        Endpoint("users", "GET", "/users/{user}/bets-owed?limit=50"),
+        Endpoint("users", "GET", "/users/{user}/bets-owned?limit=50"),
+        Endpoint("users", "GET", "/users/{user}/bet-summary?limit=50"),
+        Endpoint("users", "GET", "/users/{user}/related-users"),
+        Endpoint("bets", "GET", "/bets/?limit=100"),
+        Endpoint("bets", "GET", "/bets/?limit=100&status=open&bettor_id={user}"),
+        Endpoint("bets", "GET", "/bets/{bet}"),
+        Endpoint("bets", "GET", "/bets/search?q=playoffs"),
+        Endpoint("bets", "GET", "/bets/search?q=mara&user_id={user}"),
+        Endpoint("data", "GET", "/data/graph", heavy=True),
+        Endpoint("data", "GET", "/data/graph/neighbors/{user}"),
+        Endpoint("data", "GET", "/data/graph/reachable/{user}?hops=2"),
+        Endpoint("data", "GET", "/data/graph/path?from={user}&to={other}"),
+        Endpoint("data", "GET", "/data/graph/components"),
+        Endpoint("data", "GET", "/data/graph/centrality?metric=weighted"),
+        Endpoint("data", "GET", "/data/leaderboard"),
+        Endpoint("data", "GET", "/data/settlements"),
+        Endpoint("data", "GET", "/data/settlements?scope=global"),
+        Endpoint("data", "GET", "/data/stats?interval=week"),
+        Endpoint("data", "GET", "/data/stats?user_id={user}&counterparty_id={other}"),
+        Endpoint("data", "GET", "/data/events", heavy=True),
+        Endpoint("data", "GET", "/data/events/stream?limit=1000", stream=True),
+        Endpoint("live", "GET", "/live/events", stream=True),
+        Endpoint("sync", "GET", "/sync?limit=1000"),
+        # Writes, creating what the deletes below remove
+        Endpoint("users", "POST", "/users/", body=p.new_user),
+        Endpoint("users", "PUT", "/users/{new_user}?secret_key={key}", body=p.new_user),
+        Endpoint("bets", "POST", "/bets/", body=p.new_bet),
+        Endpoint(
+            "bets",
+            "POST",
+            "/bets/bulk",
+            body=lambda _: [p.new_bet() for _ in range(50)],
+        ),
+        Endpoint("bets", "PUT", "/bets/{bet}", body=lambda _: {"outcome": p.outcome()}),
+        Endpoint(
+            "bets",
+            "POST",
+            "/bets/bulk-resolve",
+            body=lambda _: [
+                {"id": p.rng.randint(1, p.bets), "outcome": p.outcome()}
+                for _ in range(50)
+            ],
+        ),
+        Endpoint("bets", "DELETE", "/bets/{new_bet}?secret_key={key}"),
+        Endpoint("users", "DELETE", "/users/{new_user}?secret_key={key}"),
+    ]
+
+
+def percentile(ordered, share):
+    # Nearest rank
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+async def first_chunk(app, path):
+    """
+    GET a streamed route and hang up after the first chunk of the body, returning
+    the status. Done over raw ASGI: TestClient only disconnects once a response
+    is complete, and the live feed never completes.
+    """
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    requested = False
+    received = asyncio.Event()
+    status = None
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await received.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message.get("body") or not message.get("more_body"):
+            received.set()
+
+    await app(scope, receive, send)
+    return status
+
+
+def request(client, endpoint, population):
+    values = population.values(endpoint)
+    path = endpoint.path.format(**values)
+    body = endpoint.body(values) if endpoint.body else None
+    start = time.perf_counter()
+    if endpoint.stream:
+        # Streams are timed to their first chunk; the live feed never ends
+        status = client.portal.call(first_chunk, client.app, path)
+        return time.perf_counter() - start, status
+    response = client.request(endpoint.method, path, json=body)
+    seconds = time.perf_counter() - start
+
+    if response.is_success and endpoint.method == "POST":
+        if endpoint.path == "/bets/":
+            population.new_bets.append(response.json()["id"])
+        elif endpoint.path == "/users/":
+            population.new_users.append(response.json()["id"])
+    return seconds, response.status_code
+
+
+def measure(client, endpoint, population, requests):
+    first, status = request(client, endpoint, population)
+    errors = int(status >= 400)
+    latencies = []
+    for _ in range(requests - 1):
+        seconds, status = request(client, endpoint, population)
+        latencies.append(seconds)
+        errors += status >= 400
+    total = sum(latencies)
+    latencies.sort()
+
+    def ms(seconds):
+        return None if seconds is None else round(seconds * 1000, 3)
+
+    return {
+        "router": endpoint.router,
+        "requests": requests,
+        "errors": errors,
+        "rps": round(len(latencies) / total, 1) if total else None,
+        "first_ms": ms(first),
+        "mean_ms": ms(total / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 0.5)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("DATA_UPDATE_KEY", "bench")
+    seeded = None
+    if not args.no_seed:
+        seeded = populate(args.users, args.bets, args.days, args.seed)
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, select
+
+    from app import models
+    from app.database import SessionLocal, get_engine
+    from app.main import app
+
+    get_engine()
+    with SessionLocal() as db:
+        users = db.scalar(select(func.max(models.User.id)))
+        bets = db.scalar(select(func.max(models.Bet.id)))
+    population = Population(users, bets, args.seed)
+
+    routers = set(args.routers.split(",")) if args.routers else None
+    results = {}
+    with TestClient(app) as client:
+        for endpoint in endpoints(population):
+            if routers and endpoint.router not in routers:
+                continue
+            requests = max(
+                2, args.requests // HEAVY_SHARE if endpoint.heavy else args.requests
+            )
+            results[endpoint.name] = measure(client, endpoint, population, requests)
+            if not args.quiet:
+                result = results[endpoint.name]
+                print(
+                    f"{endpoint.name:55} p50 {result['p50_ms']:>9} ms  "
+                    f"p95 {result['p95_ms']:>9} ms  "
+                    f"{result['rps']:>8} req/s",
+                    file=sys.stderr,
+                )
+
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "database": args.database_url.split(":")[0],
+            "users": users,
+            "bets": bets,
+            "seeded": seeded,
+            "requests": args.requests,
+            "settings": {
+                name: os.environ[name] for name in SETTINGS if name in os.environ
+            },
+        },
+        "endpoints": results,
+    }
+
+
+def compare(before, after, threshold, min_ms):
+    """
+    Rows comparing two result files, and whether each endpoint regressed: its p95
+    grew by more than `threshold` (and by at least `min_ms`, to ignore jitter on
+    fast routes) or it started failing.
+    """
+    rows = []
+    for name, new in after["endpoints"].items():
+        old = before["endpoints"].get(name)
+        if old is None or old["p95_ms"] is None or new["p95_ms"] is None:
+            continue
+        change = new["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0
+        regressed = (
+            change > threshold and new["p95_ms"] - old["p95_ms"] >= min_ms
+        ) or new["errors"] > old["errors"]
+        rows.append(
+            {
+                "endpoint": name,
+                "p95_before_ms": old["p95_ms"],
+                "p95_after_ms": new["p95_ms"],
+                "p95_change": round(change, 3),
+                "rps_before": old["rps"],
+                "rps_after": new["rps"],
+                "errors_before": old["errors"],
+                "errors_after": new["errors"],
+                "regressed": regressed,
+            }
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="seed, measure and write results")
+    run_parser.add_argument(
+        "--database-url", help="defaults to a throwaway SQLite file"
+    )
+    run_parser.add_argument(
+        "--no-seed", action="store_true", help="use the data already there"
+    )
+    run_parser.add_argument("--users", type=int, default=1000)
+    run_parser.add_argument("--bets", type=int, default=100000)
+    run_parser.add_argument("--days", type=int, default=365)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--requests", type=int, default=200, help="per endpoint")
+    run_parser.add_argument("--routers", help="comma separated, e.g. users,data")
+    run_parser.add_argument("--output", help="results file (default: stdout)")
+    run_parser.add_argument("--quiet", action="store_true")
+
+    compare_parser = commands.add_parser(
+        "compare", help="flag regressions between two runs"
+    )
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed p95 growth"
+    )
+    compare_parser.add_argument(
+        "--min-ms", type=float, default=1.0, help="ignore smaller changes"
+    )
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.before) as before, open(args.after) as after:
+            rows = compare(
+                json.load(before), json.load(after), args.threshold, args.min_ms
+            )
+        for row in rows:
+            print(
+                f"{'REGRESSED' if row['regressed'] else 'ok':10}{row['endpoint']:55}"
+                f"p95 {row['p95_before_ms']:>9} -> {row['p95_after_ms']:>9} ms "
+                f"({row['p95_change']:+.0%})"
+            )
+        sys.exit(1 if any(row["regressed"] for row in rows) else 0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if not args.database_url:
+            if args.no_seed:
+                parser.error("--no-seed needs a --database-url")
+            args.database_url = f"sqlite:///{directory}/bench.sqlite"
+        results = run(args)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
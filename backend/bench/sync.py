@@ -0,0 +1,220 @@
+"""
+Keeping a copy of the users and bets up to date through /sync, against
+refetching everything.
+
+Seeds a throwaway SQLite database through bench.seed, then, through the app:
+- pulls everything with /sync from `after=0`, page by page, into a local copy
+- makes `--changes` mixed writes (new users and bets, bulk creates, updates,
+  bulk resolutions, renames, bet and user deletions)
+- pulls just the delta, and checks the copy against the database
+- times the delta and the full pull, and counts the bytes each sent
+
+    python -m bench.sync --users 1000 --bets 100000 --changes 500
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from bench.seed import populate
+
+AUTH = {"secret_key": "bench"}
+
+
+def pull(client, copy, after, page_size):
+    # Applies /sync pages after `after` to `copy`; returns (seq, pages, bytes)
+    pages = size = 0
+    while True:
+        response = client.get("/sync", params={"after": after, "limit": page_size})
+        response.raise_for_status()
+        page = response.json()
+        pages += 1
+        size += len(response.content)
+        for user in page["users"]:
+            copy["users"][user["id"]] = user
+        for bet in page["bets"]:
+            copy["bets"][bet["id"]] = bet
+        for user_id in page["deleted_users"]:
+            copy["users"].pop(user_id, None)
+        for bet_id in page["deleted_bets"]:
+            copy["bets"].pop(bet_id, None)
+        after = page["seq"]
+        if not page["more"]:
+            return after, pages, size
+
+
+def ok(response):
+    response.raise_for_status()
+    return response
+
+
+def write(client, rng, users, changes):
+    # `changes` writes of every kind the change log records
+    user_ids = list(range(1, users + 1))
+    bet_ids = []
+    bet_users = {}  # bet id -> (bettor id, bettee id), for the bets made here
+
+    def bet():
+        bettor, bettee = rng.sample(user_ids, 2)
+        return {
+            "bettor_id": bettor,
+            "bettee_id": bettee,
+            "shots": rng.randint(1, 5),
+            "description": "sync",
+        }
+
+    def made_bets(bets, bet_ids_made):
+        for made, bet_id in zip(bets, bet_ids_made):
+            bet_ids.append(bet_id)
+            bet_users[bet_id] = (made["bettor_id"], made["bettee_id"])
+
+    for index in range(changes):
+        kind = index % 8
+        if kind == 0:
+            user = ok(
+                client.post(
+                    "/users/",
+                    json={
+                        "name": f"sync-{index}",
+                        "email": f"sync-{index}@example.com",
+                    },
+                )
+            ).json()
+            user_ids.append(user["id"])
+        elif kind in (1, 2):
+            made = bet()
+            made_bets([made], [ok(client.post("/bets/", json=made)).json()["id"]])
+        elif kind == 3:
+            made = [bet() for _ in range(5)]
+            results = ok(client.post("/bets/bulk", json=made)).json()["results"]
+            made_bets(made, [result["id"] for result in results])
+        elif kind == 4 and bet_ids:
+            ok(
+                client.put(
+                    f"/bets/{rng.choice(bet_ids)}",
+                    json={"outcome": "2024-01-01T00:00:00"},
+                )
+            )
+        elif kind == 5 and bet_ids:
+            resolutions = [
+                {"id": bet_id, "outcome": "expired"}
+                for bet_id in rng.sample(bet_ids, min(3, len(bet_ids)))
+            ]
+            ok(client.post("/bets/bulk-resolve", json=resolutions))
+        elif kind == 6 and bet_ids:
+            bet_id = bet_ids.pop(rng.randrange(len(bet_ids)))
+            ok(client.delete(f"/bets/{bet_id}", params=AUTH))
+        elif kind == 7:
+            user_id = rng.choice(user_ids)
+            if index % 16 == 7:
+                renamed = {
+                    "name": f"renamed-{index}",
+                    "email": f"renamed-{index}@example.com",
+                }
+                ok(client.put(f"/users/{user_id}", params=AUTH, json=renamed))
+            else:
+                user_ids.remove(user_id)
+                ok(client.delete(f"/users/{user_id}", params=AUTH))
+                # Their bets are gone as far as the API is concerned
+                bet_ids[:] = [
+                    bet_id for bet_id in bet_ids if user_id not in bet_users[bet_id]
+                ]
+
+
+def database_state():
+    # What the API holds now: every user, and every bet with both users still there
+    from app import crud, models
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        users = {
+            user.id: {"id": user.id, "name": user.name, "email": user.email}
+            for user in db.query(models.User)
+        }
+        bets = {
+            bet.id: (
+                bet.bettor_id,
+                bet.bettee_id,
+                bet.shots,
+                bet.description,
+                bet.outcome,
+            )
+            for bet in db.query(*crud.bet_row_columns(crud.all_bets))
+            if bet.bettor_id is not None and bet.bettee_id is not None
+        }
+    finally:
+        db.close()
+    return users, bets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--bets", type=int, default=100000)
+    parser.add_argument("--changes", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{directory}/bench.sqlite",
+            DATA_UPDATE_KEY=AUTH["secret_key"],
+            PREWARM="none",
+        )
+        seeded = populate(args.users, args.bets)
+
+        from fastapi.testclient import TestClient
+
+        from app.main import app
+
+        results = {"seeded": seeded, "changes": args.changes}
+        copy = {"users": {}, "bets": {}}
+        # Startup logs the seeded rows, which went in before the change log was there
+        with TestClient(app) as client:
+            start = time.perf_counter()
+            seq, pages, size = pull(client, copy, 0, args.page_size)
+            results["full"] = {
+                "seq": seq,
+                "pages": pages,
+                "bytes": size,
+                "ms": round((time.perf_counter() - start) * 1000, 1),
+            }
+
+            write(client, random.Random(0), args.users, args.changes)
+
+            start = time.perf_counter()
+            last_seq, pages, size = pull(client, copy, seq, args.page_size)
+            results["delta"] = {
+                "log_entries": last_seq - seq,
+                "pages": pages,
+                "bytes": size,
+                "ms": round((time.perf_counter() - start) * 1000, 1),
+            }
+
+            users, bets = database_state()
+            copied_bets = {
+                bet["id"]: (
+                    bet["bettor_id"],
+                    bet["bettee_id"],
+                    bet["shots"],
+                    bet["description"],
+                    bet["outcome"],
+                )
+                for bet in copy["bets"].values()
+            }
+            results["copy_matches"] = {
+                "users": copy["users"] == users,
+                "bets": copied_bets == bets,
+                "user_count": len(users),
+                "bet_count": len(bets),
+            }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
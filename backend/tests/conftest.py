@@ -0,0 +1,95 @@
+"""
+Each test gets the app on a SQLite database of its own, migrated by the
+lifespan handler like a real worker, with the in-memory state left by earlier
+tests dropped. Run the tests from backend/ with `python -m pytest`.
+"""
+
+import os
+
+# Read when the app is imported
+os.environ.setdefault("DATA_UPDATE_KEY", "test")
+os.environ["PREWARM"] = "none"
+
+from contextlib import contextmanager  # noqa: E402
+from itertools import count  # noqa: E402
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app import changes, database  # noqa: E402
+from app.main import app  # noqa: E402
+
+SECRET = {"secret_key": os.environ["DATA_UPDATE_KEY"]}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_URL", f"sqlite:///{tmp_path}/test.sqlite")
+    changes.resync()
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def make_users(client):
+    numbers = count()
+
+    def make(users):
+        made = []
+        for _ in range(users):
+            number = next(numbers)
+            response = client.post(
+                "/users/",
+                json={"name": f"user {number}", "email": f"user{number}@example.com"},
+            )
+            assert response.status_code == 200
+            made.append(response.json()["id"])
+        return made
+
+    return make
+
+
+@pytest.fixture
+def make_bets(client):
+    def make(pairs, shots=1):
+        # One bet per (bettor id, bettee id)
+        response = client.post(
+            "/bets/bulk",
+            json=[
+                {
+                    "bettor_id": bettor,
+                    "bettee_id": bettee,
+                    "shots": shots,
+                    "description": "test",
+                }
+                for bettor, bettee in pairs
+            ],
+        )
+        assert response.status_code == 200
+        return [result["id"] for result in response.json()["results"]]
+
+    return make
+
+
+@pytest.fixture
+def statements(client):
+    """
+    `with statements() as executed:` collects the SQL statements run inside the block.
+    """
+
+    @contextmanager
+    def collect():
+        executed = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            executed.append(statement)
+
+        engine = database.get_engine()
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield executed
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+    return collect
@@ -0,0 +1,130 @@
+"""
+Archived bets keep their ids: no bet created afterwards is given one of them,
+on new databases and on ones from before bets.id never reused ids.
+"""
+
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert, text, update
+from sqlalchemy.schema import CreateTable
+
+from app import archive, changes, database, models, search
+from app.main import app
+from conftest import SECRET
+
+SETTLED = "2020-01-01T00:00:00"
+
+
+def _archive_all_settled():
+    return archive.archive_bets(
+        database.get_engine(), older_than_days=30, on_batch=changes.bets_archived
+    )
+
+
+def test_new_bets_never_take_archived_ids(client, make_users, make_bets):
+    first, second = make_users(2)
+    bet_ids = make_bets([(first, second)] * 4)
+    client.post(
+        "/bets/bulk-resolve",
+        json=[{"id": bet_id, "outcome": SETTLED} for bet_id in bet_ids[:3]],
+    )
+    # Made long enough ago to be archived
+    with database.get_engine().begin() as conn:
+        conn.execute(
+            update(models.Bet.__table__).values(created_at=datetime(2019, 1, 1))
+        )
+    assert _archive_all_settled() == 3
+    # The newest bet goes too, so nothing is left above the archived ids
+    assert client.delete(f"/bets/{bet_ids[3]}", params=SECRET).status_code == 200
+
+    new_bet = client.post(
+        "/bets/",
+        json={
+            "bettor_id": second,
+            "bettee_id": first,
+            "shots": 7,
+            "description": "new",
+        },
+    ).json()
+    assert new_bet["id"] > bet_ids[3]
+    assert client.get(f"/bets/{bet_ids[0]}").json()["description"] == "test"
+    listed = client.get("/bets/", params={"include_archived": True}).json()
+    assert sorted(bet["id"] for bet in listed) == [*bet_ids[:3], new_bet["id"]]
+
+
+def test_migration_rebuilds_a_bets_table_without_autoincrement(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path}/legacy.sqlite"
+    # The schema as it was: bets without AUTOINCREMENT, indexed for search
+    engine = create_engine(url)
+    models.Base.metadata.create_all(engine, tables=[models.User.__table__])
+    legacy_bets = str(CreateTable(models.Bet.__table__).compile(engine))
+    with engine.begin() as conn:
+        conn.exec_driver_sql(legacy_bets.replace(" AUTOINCREMENT", ""))
+    models.Base.metadata.create_all(engine)
+    search.install(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(models.User.__table__),
+            [
+                {"id": 1, "name": "ann", "email": "ann@example.com"},
+                {"id": 2, "name": "bo", "email": "bo@example.com"},
+            ],
+        )
+        conn.execute(
+            insert(models.Bet.__table__),
+            [
+                {
+                    "id": 1,
+                    "bettor_id": 1,
+                    "bettee_id": 2,
+                    "shots": 1,
+                    "description": "kept",
+                },
+                {
+                    "id": 2,
+                    "bettor_id": 2,
+                    "bettee_id": 1,
+                    "shots": 2,
+                    "description": "dropped",
+                },
+            ],
+        )
+        # Archived above the live ids, as if the newest bets had been archived
+        conn.execute(
+            insert(models.ArchivedBet.__table__),
+            [
+                {
+                    "id": 9,
+                    "bettor_id": 1,
+                    "bettee_id": 2,
+                    "shots": 3,
+                    "description": "archived",
+                }
+            ],
+        )
+    engine.dispose()
+
+    monkeypatch.setattr(database, "DATABASE_URL", url)
+    changes.resync()
+    with TestClient(app) as client:
+        with database.get_engine().connect() as conn:
+            schema = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE name = 'bets'")
+            ).scalar()
+        assert "AUTOINCREMENT" in schema
+
+        new_bet = client.post(
+            "/bets/",
+            json={"bettor_id": 1, "bettee_id": 2, "shots": 1, "description": "fresh"},
+        ).json()
+        assert new_bet["id"] == 10
+        assert client.get("/bets/1").json()["description"] == "kept"
+        # The search triggers came back with the table
+        client.put(
+            "/users/2", params=SECRET, json={"name": "bob", "email": "bo@example.com"}
+        )
+        found = client.get("/bets/search", params={"q": "bob fresh"}).json()
+        assert [bet["id"] for bet in found] == [10]
+        assert client.delete("/bets/2", params=SECRET).status_code == 200
+        assert client.get("/bets/search", params={"q": "dropped"}).json() == []
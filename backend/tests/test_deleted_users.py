@@ -0,0 +1,91 @@
+"""
+Deleting a user leaves their bets without a bettor or bettee. The analytics
+routes leave those bets out instead of failing for everyone else.
+"""
+
+import pytest
+
+from conftest import SECRET
+
+
+@pytest.fixture
+def one_deleted(client, make_users, make_bets):
+    # Three users with open bets among them, then the first one deleted
+    first, second, third = make_users(3)
+    make_bets(
+        [(first, second), (second, third), (third, first), (second, third)], shots=2
+    )
+    # Build the in-memory state before the delete, and again after it
+    assert client.get("/data/leaderboard").status_code == 200
+    assert client.delete(f"/users/{first}", params=SECRET).status_code == 200
+    return first, second, third
+
+
+@pytest.mark.parametrize("rebuilt", [False, True])
+def test_analytics_routes_survive_a_deleted_user(client, one_deleted, rebuilt):
+    first, second, third = one_deleted
+    if rebuilt:
+        from app import changes
+
+        changes.resync()
+
+    leaderboard = client.get("/data/leaderboard")
+    assert leaderboard.status_code == 200
+    assert {row["id"] for row in leaderboard.json()} == {second, third}
+
+    balances = client.get(f"/users/{second}/shot-balances")
+    assert balances.status_code == 200
+    balance = balances.json()["balance"]
+    assert (balance["outward"], balance["inward"]) == ({str(third): 4}, {})
+
+    for path in (
+        "/data/settlements",
+        "/data/stats?interval=total",
+        "/data/graph",
+        "/data/events",
+    ):
+        assert client.get(path).status_code == 200, path
+
+
+@pytest.fixture
+def orphaned(client, make_users, make_bets):
+    # A bet left behind by a deleted user and one that isn't, with the graph
+    # built after the delete, so saving a bet patches it
+    first, second, third = make_users(3)
+    kept, orphaned = make_bets([(second, third), (first, second)])
+    assert client.delete(f"/users/{first}", params=SECRET).status_code == 200
+    assert client.get("/data/graph").status_code == 200
+    return kept, orphaned
+
+
+def _edges(client):
+    return [edge["id"] for edge in client.get("/data/graph").json()["edges"]]
+
+
+def test_bets_of_a_deleted_user_cannot_be_updated(client, orphaned):
+    kept, orphaned = orphaned
+    seq = client.get("/sync").json()["seq"]
+
+    update = {"outcome": "expired"}
+    assert client.put(f"/bets/{orphaned}", json=update).status_code == 404
+    resolved = client.post("/bets/bulk-resolve", json=[dict(update, id=orphaned)])
+    assert resolved.status_code == 200
+    assert resolved.json()["succeeded"] == 0
+    assert resolved.json()["results"][0]["error"] == "Bet not found"
+    # Nothing was committed
+    assert client.get("/sync").json()["seq"] == seq
+    assert client.put(f"/bets/{kept}", json=update).status_code == 200
+    assert _edges(client) == [kept]
+
+
+def test_the_graph_drops_saved_bets_of_a_deleted_user(client, orphaned):
+    from app import crud, database
+    from app.graph import shot_graph
+
+    kept, orphaned = orphaned
+    db = database.SessionLocal()
+    try:
+        shot_graph.bet_saved(crud.get_bet(db, orphaned))
+    finally:
+        db.close()
+    assert _edges(client) == [kept]
@@ -0,0 +1,43 @@
+"""
+Bets resolved on a date that couldn't be read (legacy outcomes, see
+migrations.backfill_bet_status) have a creation event but no resolution event.
+"""
+
+from sqlalchemy import insert
+
+from app import database, migrations, models
+
+
+def test_unreadable_resolution_dates_are_left_out(client, make_users, make_bets):
+    first, second = make_users(2)
+    (readable,) = make_bets([(first, second)])
+    client.put(f"/bets/{readable}", json={"outcome": "2024-03-01T12:00:00"})
+    engine = database.get_engine()
+    with engine.begin() as conn:
+        legacy = conn.execute(
+            insert(models.Bet.__table__).returning(models.Bet.id),
+            {
+                "bettor_id": second,
+                "bettee_id": first,
+                "shots": 2,
+                "description": "legacy",
+                "date_created": "2023-05-01T10:00:00",
+                "outcome": "sometime last week",
+                # As rows from before these columns were there
+                "created_at": None,
+                "status": None,
+            },
+        ).scalar()
+    assert migrations.backfill_bet_status(engine) == 1
+
+    for path in ("/data/events", "/data/events?include_archived=true"):
+        response = client.get(path)
+        assert response.status_code == 200
+        events = {(event["id"], event["type"]) for event in response.json()["events"]}
+        assert events == {
+            (readable, "bet_creation"),
+            (readable, "bet_resolution"),
+            (legacy, "bet_creation"),
+        }
+    streamed = client.get("/data/events/stream").text.splitlines()
+    assert len(streamed) == 3
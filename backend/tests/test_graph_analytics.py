@@ -0,0 +1,126 @@
+"""
+The /data/graph analytics routes, answered from the adjacency index of the
+materialized graph (see app/graph.py), on a small graph worked out by hand.
+"""
+
+import pytest
+
+from conftest import SECRET
+
+
+@pytest.fixture
+def graph(client, make_users, make_bets):
+    # a owes b 2 + 3 shots and b owes c 1, all open; c's bet on d is resolved.
+    # e owes f 5, apart from the rest, and g has no bets at all.
+    a, b, c, d, e, f, g = make_users(7)
+    make_bets([(a, b)], shots=2)
+    make_bets([(a, b)], shots=3)
+    (b_c,) = make_bets([(b, c)], shots=1)
+    (c_d,) = make_bets([(c, d)], shots=4)
+    make_bets([(e, f)], shots=5)
+    resolved = {"outcome": "expired"}
+    assert client.put(f"/bets/{c_d}", json=resolved).status_code == 200
+    return dict(a=a, b=b, c=c, d=d, e=e, f=f, g=g, b_c=b_c)
+
+
+def _ids(rows):
+    return [row["id"] for row in rows]
+
+
+def test_neighbors(client, graph):
+    neighbors = client.get(f"/data/graph/neighbors/{graph['b']}").json()
+    assert [
+        (row["id"], row["bets"], row["shots"], row["shotsOwed"], row["shotsOwedTo"])
+        for row in neighbors
+    ] == [(graph["a"], 2, 5, 0, 5), (graph["c"], 1, 1, 1, 0)]
+    # Resolved bets still link users, with nothing open between them
+    neighbors = client.get(f"/data/graph/neighbors/{graph['d']}").json()
+    assert [(row["id"], row["shotsOwed"], row["shotsOwedTo"]) for row in neighbors] == [
+        (graph["c"], 0, 0)
+    ]
+    assert client.get(f"/data/graph/neighbors/{graph['g']}").json() == []
+
+
+def test_reachable(client, graph):
+    def reachable(user, hops):
+        rows = client.get(
+            f"/data/graph/reachable/{graph[user]}", params={"hops": hops}
+        ).json()
+        return [(row["id"], row["distance"]) for row in rows]
+
+    assert reachable("a", 1) == [(graph["b"], 1)]
+    assert reachable("a", 2) == [(graph["b"], 1), (graph["c"], 2)]
+    assert reachable("a", 10) == [(graph["b"], 1), (graph["c"], 2), (graph["d"], 3)]
+    assert reachable("e", 10) == [(graph["f"], 1)]
+
+
+def test_path_follows_open_debts(client, graph):
+    def path(source, target):
+        response = client.get(
+            "/data/graph/path", params={"from": graph[source], "to": graph[target]}
+        )
+        assert response.status_code == 200
+        return response.json()["path"]
+
+    steps = path("a", "c")
+    assert _ids(steps) == [graph["a"], graph["b"], graph["c"]]
+    assert [step.get("shotsOwedToNext") for step in steps] == [5, 1, None]
+    # Debts only lead one way, and c's bet on d is resolved
+    assert path("c", "a") is None
+    assert path("a", "d") is None
+    assert path("a", "e") is None
+
+
+def test_components(client, graph):
+    components = client.get("/data/graph/components").json()
+    assert components == [
+        {"size": 4, "users": [graph["a"], graph["b"], graph["c"], graph["d"]]},
+        {"size": 2, "users": [graph["e"], graph["f"]]},
+    ]
+
+
+def test_centrality(client, graph):
+    degree = client.get("/data/graph/centrality").json()
+    assert [(row["id"], row["degree"]) for row in degree] == [
+        (graph["b"], 2),
+        (graph["c"], 2),
+        (graph["a"], 1),
+        (graph["d"], 1),
+        (graph["e"], 1),
+        (graph["f"], 1),
+    ]
+    weighted = client.get(
+        "/data/graph/centrality", params={"metric": "weighted", "limit": 3}
+    ).json()
+    assert [(row["id"], row["weighted"]) for row in weighted] == [
+        (graph["b"], 6),
+        (graph["a"], 5),
+        (graph["c"], 5),
+    ]
+
+
+def test_analytics_follow_changes(client, graph):
+    # Built before the delete, which splits the first component
+    assert len(client.get("/data/graph/components").json()) == 2
+    assert client.delete(f"/bets/{graph['b_c']}", params=SECRET).status_code == 200
+
+    components = client.get("/data/graph/components").json()
+    assert [component["users"] for component in components] == [
+        [graph["a"], graph["b"]],
+        [graph["c"], graph["d"]],
+        [graph["e"], graph["f"]],
+    ]
+    path = client.get("/data/graph/path", params={"from": graph["a"], "to": graph["c"]})
+    assert path.json()["path"] is None
+    reachable = client.get(
+        f"/data/graph/reachable/{graph['a']}", params={"hops": 10}
+    ).json()
+    assert [(row["id"], row["distance"]) for row in reachable] == [(graph["b"], 1)]
+
+
+def test_unknown_users_are_not_found(client, graph):
+    missing = graph["g"] + 100
+    assert client.get(f"/data/graph/neighbors/{missing}").status_code == 404
+    assert client.get(f"/data/graph/reachable/{missing}").status_code == 404
+    path = client.get("/data/graph/path", params={"from": graph["a"], "to": missing})
+    assert path.status_code == 404
@@ -0,0 +1,48 @@
+"""
+Every /live/events subscriber gets each change published to the hub, and
+disconnecting unsubscribes it (see app/hub.py and app/routers/live.py).
+"""
+
+import asyncio
+
+from app.hub import Hub, hub
+from app.routers.live import live_events
+
+SUBSCRIBERS = 5000
+
+
+def test_every_subscriber_gets_the_delta_and_disconnects_unsubscribe():
+    async def run():
+        streams = [(await live_events()).body_iterator for _ in range(SUBSCRIBERS)]
+        # The first line of each stream comes once it has subscribed
+        assert {await stream.__anext__() for stream in streams} == {"retry: 5000\n\n"}
+        assert len(hub._subscribers) == SUBSCRIBERS
+
+        # Published from a worker thread, like the mutation routes do
+        await asyncio.to_thread(hub.publish, "edge_deleted", {"id": 7})
+        received = await asyncio.gather(*(stream.__anext__() for stream in streams))
+        assert len(received) == SUBSCRIBERS
+        assert {message.split("\n", 1)[1] for message in received} == {
+            'event: edge_deleted\ndata: {"id": 7}\n\n'
+        }
+
+        # Client disconnects close the streams
+        for stream in streams:
+            await stream.aclose()
+        assert not hub.has_subscribers
+
+    asyncio.run(run())
+
+
+def test_subscribers_that_fall_behind_are_told_to_resync():
+    small = Hub(queue_size=2)
+
+    async def run():
+        slow = small.subscribe()
+        for index in range(3):
+            small.publish("edge_deleted", {"id": index})
+        # Lets the loop run the fan-outs
+        await asyncio.sleep(0)
+        return [slow.get_nowait() for _ in range(slow.qsize())]
+
+    assert [event_type for _, event_type, _ in asyncio.run(run())] == ["resync"]
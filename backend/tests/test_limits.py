@@ -0,0 +1,115 @@
+"""
+The expensive aggregate routes share one computation between concurrent
+requests, shed what doesn't fit the concurrency budget and rate limit clients
+(see app/limits.py).
+"""
+
+import threading
+import time
+
+import pytest
+
+from app import limits
+from app.graph import shot_graph
+from app.routers import data
+
+CLIENTS = 8
+# Long enough for every client to ask while the first computation is running
+SLOW_SECONDS = 0.5
+
+
+@pytest.fixture
+def slow(monkeypatch):
+    # Makes the computations behind /data/events and /data/graph take a while
+    event_log = data._event_log
+    snapshot_body = shot_graph.snapshot_body
+
+    def slow_event_log(*args):
+        time.sleep(SLOW_SECONDS)
+        return event_log(*args)
+
+    def slow_snapshot_body(*args):
+        time.sleep(SLOW_SECONDS)
+        return snapshot_body(*args)
+
+    monkeypatch.setattr(data, "_event_log", slow_event_log)
+    monkeypatch.setattr(shot_graph, "snapshot_body", slow_snapshot_body)
+
+
+@pytest.fixture
+def populated(make_users, make_bets):
+    first, second, third = make_users(3)
+    make_bets([(first, second), (second, third), (third, first)])
+
+
+def _at_once(client, paths):
+    # GETs every path from its own thread, all at the same moment
+    barrier = threading.Barrier(len(paths))
+    responses = [None] * len(paths)
+
+    def get(index):
+        barrier.wait()
+        responses[index] = client.get(paths[index])
+
+    threads = [
+        threading.Thread(target=get, args=(index,)) for index in range(len(paths))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def _counts(name):
+    return limits.limit_stats.snapshot().get(name, dict.fromkeys(limits.COUNTERS, 0))
+
+
+@pytest.mark.parametrize(
+    "path, name", [("/data/events", "events"), ("/data/graph", "graph")]
+)
+def test_concurrent_requests_share_one_computation(client, populated, slow, path, name):
+    before = _counts(name)
+    responses = _at_once(client, [path] * CLIENTS)
+    after = _counts(name)
+
+    assert [response.status_code for response in responses] == [200] * CLIENTS
+    assert len({response.content for response in responses}) == 1
+    assert after["requests"] - before["requests"] == CLIENTS
+    assert after["computed"] - before["computed"] == 1
+    assert after["coalesced"] - before["coalesced"] == CLIENTS - 1
+
+
+def test_work_over_the_concurrency_budget_is_shed(client, populated, slow, monkeypatch):
+    # EXPENSIVE_CONCURRENCY=1, EXPENSIVE_WAIT_MS=50
+    monkeypatch.setattr(data, "expensive_budget", limits.ConcurrencyBudget(1, 50))
+    before = _counts("graph")
+    events = threading.Thread(target=client.get, args=("/data/events",))
+    events.start()
+    # The events computation holds the only slot for SLOW_SECONDS
+    time.sleep(SLOW_SECONDS / 5)
+    response = client.get("/data/graph")
+    events.join()
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert _counts("graph")["shed"] - before["shed"] == 1
+    # Once the slot is free again the graph is served
+    assert client.get("/data/graph").status_code == 200
+
+
+def test_clients_over_their_rate_are_limited(client, populated, monkeypatch):
+    # RATE_LIMIT_PER_MINUTE=60, RATE_LIMIT_BURST=2
+    monkeypatch.setattr(limits, "rate_limiter", limits.RateLimiter(60, 2))
+    before = _counts("graph")
+    statuses = [client.get("/data/graph").status_code for _ in range(2)]
+    limited = client.get("/data/graph")
+
+    assert statuses == [200, 200]
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+    assert _counts("graph")["rate_limited"] - before["rate_limited"] == 1
+    # Other clients have buckets of their own
+    other = limits.client_key
+    monkeypatch.setattr(limits, "client_key", lambda request: "other " + other(request))
+    assert client.get("/data/graph").status_code == 200
@@ -0,0 +1,37 @@
+"""
+Requests are labelled in /metrics by the path template of the route they
+matched, including the routes of the included routers (see app/metrics.py).
+"""
+
+
+def _counts(client, name):
+    # {labels: value} of one metric; the metrics are shared by every test
+    counts = {}
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith(name + "{"):
+            labels, value = line[len(name) + 1 :].rsplit("} ", 1)
+            counts[labels] = float(value)
+    return counts
+
+
+def test_requests_are_labelled_by_route_template(client, make_users, make_bets):
+    first, second = make_users(2)
+    (bet_id,) = make_bets([(first, second)])
+    name = "http_request_duration_seconds_count"
+    before = _counts(client, name)
+    assert client.get(f"/bets/{bet_id}").status_code == 200
+    assert client.get(f"/users/{first}").status_code == 200
+    assert client.get("/no-such-route").status_code == 404
+    after = _counts(client, name)
+
+    for labels in (
+        'method="GET",route="/bets/{bet_id}",status="200"',
+        'method="GET",route="/users/{user_id}",status="200"',
+        'method="GET",route="unmatched",status="404"',
+    ):
+        assert after[labels] - before.get(labels, 0) == 1
+    # Raw paths never become labels
+    assert not any(f"/bets/{bet_id}" in labels for labels in after)
+
+    statements = _counts(client, "http_request_sql_statements_count")
+    assert 'method="GET",route="/bets/{bet_id}"' in statements
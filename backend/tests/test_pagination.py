@@ -0,0 +1,43 @@
+"""
+Paginated routes reject page sizes below one, and their cursors walk every row once.
+"""
+
+import pytest
+
+PATHS = [
+    "/bets/",
+    "/bets/search?q=test",
+    "/users/",
+    "/users/1/bets-owed",
+    "/users/1/bets-owned",
+    "/users/1/bet-summary",
+    "/data/events/stream",
+]
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+@pytest.mark.parametrize("path", PATHS)
+def test_limits_below_one_are_rejected(client, make_users, path, limit):
+    make_users(1)
+    response = client.get(path, params={"limit": limit})
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("path", ["/bets/", "/users/"])
+def test_negative_skip_is_rejected(client, path):
+    assert client.get(path, params={"skip": -1}).status_code == 422
+
+
+def test_cursor_walks_every_bet(client, make_users, make_bets):
+    first, second = make_users(2)
+    bet_ids = make_bets([(first, second)] * 7)
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/bets/", params=params)
+        assert response.status_code == 200
+        seen += [bet["id"] for bet in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert sorted(seen) == bet_ids
@@ -0,0 +1,53 @@
+"""
+Each engine's pool keeps counters of its own, and only checkouts that gave up
+waiting for a connection count as timeouts (see PoolMetrics in app/database.py).
+"""
+
+import pytest
+from sqlalchemy import exc, text
+
+from app import database
+from app.database import create_db_engine, pool_stats
+
+
+@pytest.fixture
+def one_connection(monkeypatch):
+    monkeypatch.setattr(database, "DB_POOL_SIZE", 1)
+    monkeypatch.setattr(database, "DB_MAX_OVERFLOW", 0)
+    monkeypatch.setattr(database, "DB_POOL_TIMEOUT", 1)
+
+
+def test_pools_have_counters_of_their_own(tmp_path):
+    first = create_db_engine(f"sqlite:///{tmp_path}/first.sqlite")
+    second = create_db_engine(f"sqlite:///{tmp_path}/second.sqlite")
+    for _ in range(3):
+        with first.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    assert pool_stats(first.pool)["checkouts"] == 3
+    assert pool_stats(second.pool)["checkouts"] == 0
+    # Disposing of the connections keeps the counts
+    first.dispose()
+    assert pool_stats(first.pool)["checkouts"] == 3
+    with first.connect():
+        pass
+    assert pool_stats(first.pool)["checkouts"] == 4
+
+
+def test_checkouts_that_give_up_waiting_are_timeouts(tmp_path, one_connection):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/test.sqlite")
+    with engine.connect():
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+
+    stats = pool_stats(engine.pool)
+    assert stats["timeouts"] == 1
+    assert stats["wait_seconds_max"] >= 1
+
+
+def test_failing_to_connect_is_not_a_timeout(tmp_path, one_connection):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/missing/test.sqlite")
+    with pytest.raises(exc.OperationalError):
+        engine.connect()
+
+    assert pool_stats(engine.pool)["timeouts"] == 0
@@ -0,0 +1,65 @@
+"""
+The bet and related-user reads resolve users in bulk, so the statements they run
+don't grow with the number of bets or users involved.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def populated(make_users, make_bets):
+    def populate(bets):
+        # `bets` bets among 5 users, every one of them involving the first
+        first, *others = make_users(5)
+        pairs = [(first, others[index % 4]) for index in range(bets)]
+        # Half of them the other way round
+        make_bets(
+            [pair if index % 2 else pair[::-1] for index, pair in enumerate(pairs)]
+        )
+        return [first, *others]
+
+    return populate
+
+
+def _count(client, statements, path):
+    with statements() as executed:
+        response = client.get(path)
+    assert response.status_code == 200
+    return len(executed)
+
+
+@pytest.mark.parametrize(
+    "path",
+    ["/bets/?limit=100", "/bets/{bet}", "/users/{user}/related-users"],
+)
+def test_statements_do_not_grow_with_the_data(client, statements, populated, path):
+    user_ids = populated(4)
+    few = _count(client, statements, path.format(bet=1, user=user_ids[0]))
+
+    more_user_ids = populated(60)
+    many = _count(client, statements, path.format(bet=7, user=more_user_ids[0]))
+
+    assert few == many
+    assert many <= 2
+
+
+def test_bet_listing_is_one_statement(client, statements, populated):
+    populated(30)
+    assert _count(client, statements, "/bets/?limit=100") == 1
+
+
+@pytest.mark.parametrize("path", ["/data/graph", "/data/events"])
+def test_data_statements_do_not_grow_with_the_data(client, statements, populated, path):
+    from app import changes
+
+    populated(4)
+    # Drops the materialized graph and the cached responses, so they are rebuilt
+    changes.resync()
+    few = _count(client, statements, path)
+
+    populated(60)
+    changes.resync()
+    many = _count(client, statements, path)
+
+    # The bets with their bettor's and bettee's names, in one query
+    assert few == many == 1
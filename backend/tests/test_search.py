@@ -0,0 +1,99 @@
+"""
+/bets/search finds bets by the words of their description and the names of
+their bettor and bettee, through the full-text index (see app/search.py).
+"""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import update
+
+from app import archive, changes, database, models
+
+from conftest import SECRET
+
+
+@pytest.fixture
+def bets(client):
+    users = {}
+    for name in ("alice", "bob", "carol"):
+        response = client.post(
+            "/users/", json={"name": name, "email": f"{name}@example.com"}
+        )
+        users[name] = response.json()["id"]
+    made = {}
+    for bettor, bettee, description in (
+        ("alice", "bob", "rain on saturday"),
+        ("bob", "carol", "the train is late"),
+        ("carol", "alice", "rain before the match"),
+    ):
+        response = client.post(
+            "/bets/",
+            json={
+                "bettor_id": users[bettor],
+                "bettee_id": users[bettee],
+                "shots": 1,
+                "description": description,
+            },
+        )
+        made[description] = response.json()["id"]
+    return made
+
+
+def _search(client, q, **params):
+    response = client.get("/bets/search", params=dict(params, q=q))
+    assert response.status_code == 200
+    return sorted(bet["id"] for bet in response.json())
+
+
+def test_search_matches_descriptions_and_names(client, bets):
+    rain = sorted([bets["rain on saturday"], bets["rain before the match"]])
+    assert _search(client, "rain") == rain
+    # Every word has to match, in the description or either name
+    assert _search(client, "rain alice") == rain
+    assert _search(client, "rain bob") == [bets["rain on saturday"]]
+    # The last word matches as a prefix
+    assert _search(client, "tra") == [bets["the train is late"]]
+    assert _search(client, "car") == sorted(
+        [bets["the train is late"], bets["rain before the match"]]
+    )
+
+
+def test_renamed_users_are_found_by_their_new_name(client, bets):
+    bet = client.get(f"/bets/{bets['rain on saturday']}").json()
+    bob = bet["bettee_id"]
+    renamed = {"name": "robert", "email": "bob@example.com"}
+    assert client.put(f"/users/{bob}", params=SECRET, json=renamed).status_code == 200
+
+    assert _search(client, "bob") == []
+    assert _search(client, "robert") == sorted(
+        [bets["rain on saturday"], bets["the train is late"]]
+    )
+
+
+def test_search_without_a_match_is_empty(client, bets):
+    assert _search(client, "snow") == []
+    assert _search(client, "rain dave") == []
+
+
+def test_deleted_and_archived_bets_are_not_found(client, bets):
+    deleted, archived = bets["rain on saturday"], bets["rain before the match"]
+    assert client.delete(f"/bets/{deleted}", params=SECRET).status_code == 200
+    settled = {"outcome": "2020-01-01T00:00:00"}
+    assert client.put(f"/bets/{archived}", json=settled).status_code == 200
+    # Made long enough ago to be archived
+    with database.get_engine().begin() as conn:
+        conn.execute(
+            update(models.Bet.__table__)
+            .where(models.Bet.id == archived)
+            .values(created_at=datetime(2019, 1, 1))
+        )
+    assert (
+        archive.archive_bets(
+            database.get_engine(), older_than_days=30, on_batch=changes.bets_archived
+        )
+        == 1
+    )
+
+    assert _search(client, "rain") == []
+    assert _search(client, "train") == [bets["the train is late"]]
@@ -0,0 +1,123 @@
+"""
+Settlements zero every open balance, and the exact search never needs more
+transfers than the greedy heuristic (see app/settlements.py).
+"""
+
+import random
+
+import pytest
+
+from app import settlements
+from app.settlements import exact_transfers, greedy_transfers
+
+from conftest import SECRET
+
+
+def _random_balances(rng, users):
+    # Net shots for `users` users, summing to zero
+    balances = {user_id: rng.randint(-6, 6) for user_id in range(1, users)}
+    balances[users] = -sum(balances.values())
+    return balances
+
+
+def _settled(balances, transfers):
+    left = dict(balances)
+    for transfer in transfers:
+        assert transfer["shots"] > 0
+        left[transfer["from"]] += transfer["shots"]
+        left[transfer["to"]] -= transfer["shots"]
+    return not any(left.values())
+
+
+def _fewest_transfers(amounts):
+    # n - k, k being the most zero-sum groups the amounts split into, by brute force
+    if not amounts:
+        return 0
+    first, rest = amounts[0], amounts[1:]
+    best = None
+    for mask in range(1 << len(rest)):
+        group = [amount for i, amount in enumerate(rest) if mask >> i & 1]
+        if first + sum(group) == 0:
+            others = [amount for i, amount in enumerate(rest) if not mask >> i & 1]
+            needed = len(group) + _fewest_transfers(others)
+            best = needed if best is None else min(best, needed)
+    return best
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_exact_and_greedy_settle_small_groups(seed):
+    rng = random.Random(seed)
+    balances = _random_balances(rng, rng.randint(2, 7))
+
+    greedy = greedy_transfers(balances)
+    exact = exact_transfers(balances)
+
+    assert _settled(balances, greedy)
+    assert _settled(balances, exact)
+    fewest = _fewest_transfers([amount for amount in balances.values() if amount])
+    assert len(exact) == fewest <= len(greedy)
+
+
+def test_exact_beats_greedy_when_groups_cancel_out():
+    # {2, 4} and {1, 3, 5} square up among themselves, but greedy starts by having
+    # 3 pay 2, the biggest debtor and creditor
+    balances = {1: 2, 2: 4, 3: -5, 4: -4, 5: 3}
+    assert len(exact_transfers(balances)) == 3
+    assert len(greedy_transfers(balances)) == 4
+
+
+@pytest.fixture(params=[12, 0])
+def exact_limit(request, monkeypatch):
+    # With a limit of 0 every group is settled greedily
+    monkeypatch.setattr(settlements, "SETTLEMENT_EXACT_LIMIT", request.param)
+    return request.param
+
+
+@pytest.fixture
+def open_bets(client, make_users, make_bets, exact_limit):
+    # Two groups of users linked by open bets, with a resolved and a deleted bet
+    users = make_users(6)
+    rng = random.Random(0)
+    pairs = [rng.sample(users[:4], 2) for _ in range(12)] + [
+        (users[4], users[5]),
+        (users[5], users[4]),
+        (users[4], users[5]),
+    ]
+    bet_ids = []
+    for shots in (1, 2, 3):
+        bet_ids += make_bets(pairs[shots - 1 :: 3], shots=shots)
+    # Settlements are kept up to date from here on
+    assert client.get("/data/settlements").status_code == 200
+    resolved, deleted = bet_ids[0], bet_ids[1]
+    assert (
+        client.put(f"/bets/{resolved}", json={"outcome": "expired"}).status_code == 200
+    )
+    assert client.delete(f"/bets/{deleted}", params=SECRET).status_code == 200
+    return client
+
+
+def _open_balances(client):
+    balances = {}
+    for bet in client.get("/bets/", params={"limit": 1000}).json():
+        if bet["outcome"] is None:
+            shots = bet["shots"]
+            bettor, bettee = bet["bettor_id"], bet["bettee_id"]
+            balances[bettor] = balances.get(bettor, 0) - shots
+            balances[bettee] = balances.get(bettee, 0) + shots
+    return balances
+
+
+@pytest.mark.parametrize("scope", ["component", "global"])
+def test_settlements_zero_every_open_balance(open_bets, exact_limit, scope):
+    client = open_bets
+    balances = _open_balances(client)
+    assert any(balances.values())
+
+    payload = client.get("/data/settlements", params={"scope": scope}).json()
+    assert _settled(balances, payload["transfers"])
+    exact = (
+        [component["exact"] for component in payload["components"]]
+        if scope == "component"
+        else [payload["exact"]]
+    )
+    assert set(exact) == {bool(exact_limit)}
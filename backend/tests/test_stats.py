@@ -0,0 +1,59 @@
+"""
+The /data/stats buckets kept up to date by the mutation hooks match buckets
+built from scratch (see app/stats.py).
+"""
+
+from datetime import datetime, timedelta
+
+from app import changes
+
+from conftest import SECRET
+
+
+def _resolved_in(days):
+    moment = datetime.utcnow().replace(microsecond=0) + timedelta(days=days)
+    return moment.isoformat()
+
+
+def _stats(client, users):
+    first, second = users[:2]
+    queries = [
+        {},
+        {"user_id": first},
+        {"user_id": second},
+        {"user_id": first, "counterparty_id": second},
+    ]
+    results = {}
+    for query in queries:
+        for interval in ("day", "week", "total"):
+            response = client.get("/data/stats", params=dict(query, interval=interval))
+            assert response.status_code == 200
+            results[tuple(sorted(query.items())), interval] = response.json()
+    return results
+
+
+def test_incremental_buckets_match_a_rebuild(client, make_users, make_bets):
+    users = make_users(3)
+    first, second, third = users
+    # Built before any bet, so everything below is applied incrementally
+    assert client.get("/data/stats").json()["totals"]["bets_created"] == 0
+
+    bet_ids = make_bets([(first, second), (second, first), (first, third)], shots=2)
+    bet_ids += make_bets([(second, third), (first, second)], shots=5)
+    for bet_id, days in zip(bet_ids, (1, 1, 9)):
+        outcome = {"outcome": _resolved_in(days)}
+        assert client.put(f"/bets/{bet_id}", json=outcome).status_code == 200
+    # Resolving again moves the bet to another day, changing the shots too
+    outcome = {"outcome": _resolved_in(3), "shots": 4}
+    assert client.put(f"/bets/{bet_ids[0]}", json=outcome).status_code == 200
+    assert client.delete(f"/bets/{bet_ids[3]}", params=SECRET).status_code == 200
+
+    incremental = _stats(client, users)
+    totals = incremental[(), "total"]["totals"]
+    assert totals["bets_created"] == 4
+    assert totals["shots_wagered"] == 4 + 2 + 2 + 5
+    assert totals["bets_resolved"] == 3
+    assert totals["shots_called"] == 4 + 2 + 2
+
+    changes.resync()
+    assert _stats(client, users) == incremental